@@ -82,16 +82,28 @@ REST_FRAMEWORK = {
 # 変更を反映するにはプロセスの再起動が必要（デコレータは起動時に評価されるため）。
 REQUIRE_API_AUTH = config("REQUIRE_API_AUTH", default=True, cast=bool)
 
+# まとめての評価の同期（/api/ratings/score/batch）の冪等キーを覚えておく日数。
+# これより古いキーで送り直された項目は、新しい項目として後勝ちで当て直す。
+RATING_SYNC_RECEIPT_DAYS = config("RATING_SYNC_RECEIPT_DAYS", default=30, cast=int)
+
 MIDDLEWARE = [
+    # 処理時間の内訳（Server-Timing ヘッダとログ）。本文は触らず、全体を測るため先頭に置く
+    "songs.instrumentation.ServerTimingMiddleware",
     # レスポンス本文を書き換える他のミドルウェアより先に置く必要がある
     "django.middleware.gzip.GZipMiddleware",
+    # 圧縮前の本文の大きさ（/metrics の圧縮率用）。GZip の内側に置く
+    "songs.instrumentation.ResponseSizeMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    # スタッフが ?_profile=1 を付けたリクエストのプロファイル。request.user を見るのでここ
+    "songs.request_profiler.RequestProfilerMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    # N+1 の検出とビューごとの SQL 件数の上限（QUERY_AUDIT が "off" なら何もしない）
+    "songs.query_audit.QueryAuditMiddleware",
 ]
 
 ROOT_URLCONF = "music.urls"
@@ -181,18 +193,66 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 5000
 
+# リクエストごとの処理時間の内訳（songs.instrumentation）を "songs.perf" に1行ずつ出すか。
+# 毎リクエスト1行出るので既定では出さない。遅さを調べるときだけ True にする。
+PERF_LOG = config("PERF_LOG", default=False, cast=bool)
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "songs.perf": {
+            "handlers": ["console"],
+            "level": "INFO" if PERF_LOG else "WARNING",
+            "propagate": False,
+        },
+        "songs.query_audit": {"handlers": ["console"], "level": "WARNING"},
+    },
+}
+
 # 開発時のみ：実行されたSQLと所要時間をコンソールに出す（遅い画面の切り分け用）。
 # 不要になったらこのブロックごと削除してよい。
 if DEBUG:
-    LOGGING = {
-        "version": 1,
-        "disable_existing_loggers": False,
-        "handlers": {"console": {"class": "logging.StreamHandler"}},
-        "loggers": {
-            "django.db.backends": {"handlers": ["console"], "level": "DEBUG"},
-        },
+    LOGGING["loggers"]["django.db.backends"] = {
+        "handlers": ["console"],
+        "level": "DEBUG",
     }
 
+# 処理時間の内訳を Server-Timing レスポンスヘッダにも付けるか。
+# ブラウザの開発者ツールで見られるが、誰にでも SQL の件数や時間が見えてしまうので
+# 既定は DEBUG のときだけ。本番で load_test を流すときなどに一時的に True にする。
+SERVER_TIMING = config("SERVER_TIMING", default=DEBUG, cast=bool)
+
+# /metrics（Prometheus 形式）。トークンは /api/dump/* と同じ EXPORT_API_TOKEN。
+# 各ワーカーが METRICS_DIR に自分の累積値を METRICS_FLUSH_INTERVAL 秒ごとに書き、
+# /metrics で全ファイルを足し合わせる。ワーカー間で共有できる場所にすること。
+METRICS_ENABLED = config("METRICS_ENABLED", default=True, cast=bool)
+METRICS_DIR = config("METRICS_DIR", default=str(BASE_DIR / "cache" / "metrics"))
+METRICS_FLUSH_INTERVAL = config("METRICS_FLUSH_INTERVAL", default=5, cast=int)
+
+# 遅いリクエストの記録（songs.flight_recorder、スタッフ用の画面 /slow-requests/）。
+# SLOW_REQUEST_MS ミリ秒以上かかったリクエストの SQL と実行計画を残す（0 で無効）。
+# 新しいものから SLOW_REQUEST_KEEP 件だけ残し、EXPLAIN は遅い順に SLOW_REQUEST_EXPLAIN 件。
+SLOW_REQUEST_MS = config("SLOW_REQUEST_MS", default=1000, cast=int)
+SLOW_REQUEST_DIR = config(
+    "SLOW_REQUEST_DIR", default=str(BASE_DIR / "cache" / "slow_requests")
+)
+SLOW_REQUEST_KEEP = config("SLOW_REQUEST_KEEP", default=200, cast=int)
+SLOW_REQUEST_EXPLAIN = config("SLOW_REQUEST_EXPLAIN", default=3, cast=int)
+
+# スタッフ用のその場プロファイラ（songs.request_profiler、?_profile=1）の保存先と件数、
+# サンプリングの間隔（秒）。
+PROFILE_DIR = config("PROFILE_DIR", default=str(BASE_DIR / "cache" / "profiles"))
+PROFILE_KEEP = config("PROFILE_KEEP", default=50, cast=int)
+PROFILE_SAMPLE_INTERVAL = config("PROFILE_SAMPLE_INTERVAL", default=0.005, cast=float)
+
+# N+1 の検出（songs.query_audit）。"off" / "warn"（ログに警告）/ "raise"（例外）。
+# SQL ごとに呼び出し元を辿るので本番では "off"。未設定なら DEBUG 時だけ "warn"。
+# 同じ形の SQL が QUERY_AUDIT_REPEAT 回以上出たら N+1 の疑いとして報告する。
+QUERY_AUDIT = config("QUERY_AUDIT", default="warn" if DEBUG else "off")
+QUERY_AUDIT_REPEAT = config("QUERY_AUDIT_REPEAT", default=5, cast=int)
+
 # 末尾スラッシュは必須。省くと APPEND_SLASH による 301 が毎回挟まり、
 # しかもブラウザに恒久キャッシュされてURL変更時に厄介になる。
 LOGIN_URL = "/login/"  # @login_required の飛び先（既定の /accounts/login/ を上書き）
@@ -204,3 +264,58 @@ LOGOUT_REDIRECT_URL = "/login/"  # ログアウト後のリダイレクト先
 EXPORT_API_TOKEN = config("EXPORT_API_TOKEN", default="")
 
 RATING_CACHE_DIR = BASE_DIR / "exports"
+
+# ランキング集計の実装（songs.rankings を参照）。
+#   "sql"   : 表示のたびに services.py の CTE を実行する（既定）
+#   "store" : 書き込み時に更新する集計テーブル（RankingGroup / RankingEntry）を読む
+#   "numpy" : 評価を1回のクエリで取り出し、NumPy で集計する（numpy が必要）
+# "store" に切り替える前に manage.py rebuild_rankings で全ユーザー分を作っておくこと。
+# "sql" の間は集計テーブルを更新しないので、戻して再び使うときも作り直しが必要。
+RANKING_BACKEND = config("RANKING_BACKEND", default="sql")
+
+# ランキング結果のキャッシュ（songs.ranking_cache）。
+# 版番号を複数ワーカーで共有する必要があるので、既定はファイルキャッシュ。
+# locmem にするとプロセスごとに別物になり、他のワーカーで更新された評価が
+# 反映されなくなる（単一プロセスの開発・テスト用）。
+# RANKING_CACHE_TIMEOUT=0 でキャッシュを使わない。
+RANKING_CACHE_TIMEOUT = config("RANKING_CACHE_TIMEOUT", default=3600, cast=int)
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "rankings": {
+        "BACKEND": config(
+            "RANKING_CACHE_BACKEND",
+            default="django.core.cache.backends.filebased.FileBasedCache",
+        ),
+        "LOCATION": config(
+            "RANKING_CACHE_LOCATION", default=str(BASE_DIR / "cache" / "rankings")
+        ),
+        "OPTIONS": {"MAX_ENTRIES": 5000},
+    },
+    # 「もっと見る」用の結果カーソル（songs.result_cursors）。
+    # 別ワーカーに振られたら集計し直すだけなので、プロセス内の locmem で足りる。
+    # メモリ使用量の上限はおおよそ MAX_ENTRIES × RESULT_CURSOR_MAX_BYTES。
+    "cursors": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "result-cursors",
+        "OPTIONS": {"MAX_ENTRIES": 50},
+    },
+    # 曲目録のチェックサムの控え（songs.catalog_changes）。作るのに目録全体を
+    # 読むので、ワーカーごとに作り直さないよう共有できるファイルキャッシュに置く。
+    "catalog": {
+        "BACKEND": config(
+            "CATALOG_CACHE_BACKEND",
+            default="django.core.cache.backends.filebased.FileBasedCache",
+        ),
+        "LOCATION": config(
+            "CATALOG_CACHE_LOCATION", default=str(BASE_DIR / "cache" / "catalog")
+        ),
+    },
+}
+
+RESULT_CURSOR_TTL = config("RESULT_CURSOR_TTL", default=600, cast=int)
+RESULT_CURSOR_MAX_BYTES = config(
+    "RESULT_CURSOR_MAX_BYTES", default=2 * 1024 * 1024, cast=int
+)
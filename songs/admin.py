@@ -31,6 +31,8 @@ class MusicRegionAdmin(BaseResourceAdmin):
 class ArtistResource(resources.ModelResource):
     class Meta:
         model = Artist
+        # DB が計算する列なので取り込み・書き出しの対象から外す
+        exclude = ("name_key",)
 
 
 class ArtistCreditInline(admin.TabularInline):
@@ -84,6 +86,8 @@ class ArtistAliasAdmin(BaseResourceAdmin):
 class SongResource(resources.ModelResource):
     class Meta:
         model = Song
+        # DB が計算する列なので取り込み・書き出しの対象から外す
+        exclude = ("title_key",)
 
 
 class SongAdmin(BaseResourceAdmin):
@@ -106,6 +110,7 @@ class RatingResource(resources.ModelResource):
 class RatingAdmin(BaseResourceAdmin):
     resource_class = RatingResource
     list_display = ["song", "song__artist", "user", "score"]
+    list_select_related = ["song__artist", "user"]
     search_fields = ["user__username", "song__title", "song__artist__name"]
 
 
@@ -117,6 +122,7 @@ class ArtistYearPreferenceResource(resources.ModelResource):
 class ArtistYearPreferenceAdmin(BaseResourceAdmin):
     resource_class = ArtistYearPreferenceResource
     list_display = ["user", "artist", "year", "score"]
+    list_select_related = ["user", "artist"]
     search_fields = ["user__username", "artist__name"]
     list_filter = ["user", "year", "score"]
 
@@ -129,6 +135,7 @@ class UserProfileResource(resources.ModelResource):
 class UserProfileAdmin(BaseResourceAdmin):
     resource_class = UserProfileResource
     list_display = ["user", "birth_year"]
+    list_select_related = ["user"]
     search_fields = ["user__username"]
     list_filter = ["birth_year"]
 
@@ -10,12 +10,20 @@ urlpatterns = [
     # 別表記（ArtistAlias）の一覧。名義とは別テーブル。
     path("artist_aliases/", api_views.artist_alias_list),
     path("songs/", api_views.song_list),
+    # 上の4つの差分（変更履歴）。?since=<前回の next>。全件を取り直さずに同期する。
+    path("changes", api_views.catalog_change_list, name="catalog_changes"),
     path(
         "songs_rating",
         api_views.SongsRatingExport.as_view(),
         name="songs-rating-export",
     ),
     path("ratings/score/update", api_views.update_score, name="update"),  # POST
+    # オフライン端末からのまとめて同期（POST、500件まで、冪等キーと後勝ち）
+    path(
+        "ratings/score/batch",
+        api_views.update_scores_batch,
+        name="update_scores_batch",
+    ),
     path(
         "songs/create_with_artist",
         api_views.create_song_with_artist,
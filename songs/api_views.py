@@ -1,7 +1,9 @@
+import json
 from decimal import Decimal, InvalidOperation
 from django.conf import settings
 from django.db import IntegrityError, transaction
 from django.db.models import Q
+from django.http import StreamingHttpResponse
 from django.utils.dateparse import parse_datetime
 from rest_framework import permissions
 from rest_framework.exceptions import ValidationError
@@ -24,6 +26,8 @@ from .api_serializers import (
     SongSerializer,
     RatingRowSerializer,
 )
+from . import catalog_changes, rating_sync
+from .conditional import api_list_condition
 from .utils import normalize
 
 
@@ -191,6 +195,104 @@ def update_score(request):
     )
 
 
+@api_view(["POST"])
+@permission_classes([permissions.IsAuthenticated])
+def update_scores_batch(request):
+    """
+    オフライン端末の評価をまとめて同期する（update_score の複数版）。
+    {"items": [{"key", "song_id" または "artist"/"title", "score",
+    "karaoke_score", "client_updated_at"}, ...]} を受け取り、
+    項目ごとの結果を送られた順に返す。中身は songs.rating_sync を参照。
+    """
+    items = request.data.get("items") if isinstance(request.data, dict) else None
+    if not isinstance(items, list) or not items:
+        return Response({"detail": "items（配列）が必要です"}, status=400)
+    if len(items) > rating_sync.MAX_ITEMS:
+        detail = f"items は {rating_sync.MAX_ITEMS} 件以内で指定してください"
+        return Response({"detail": detail}, status=400)
+    return Response({"results": rating_sync.sync_ratings(request.user, items)})
+
+
+# /api/songs_rating を流すとき（stream / cursor 指定時）に1回の SELECT で読む行数。
+# 続きは (updated_at, id) のキーセットで読むので、件数が増えてもメモリは一定。
+RATING_EXPORT_CHUNK = 2000
+RATING_EXPORT_MAX_LIMIT = 100000
+RATING_EXPORT_STREAMS = {
+    "jsonl": "application/x-ndjson; charset=utf-8",
+    "json": "application/json",
+}
+_RATING_EXPORT_FIELDS = (
+    "id",
+    "user_id",
+    "song_id",
+    "score",
+    "karaoke_score",
+    "created_at",
+    "updated_at",
+)
+
+
+def _parse_rating_cursor(value):
+    """cursor="<updated_at（ISO8601）>,<id>" を (datetime, id) にする。"""
+    updated_at, sep, rating_id = value.rpartition(",")
+    # URL エンコードせずに送られると +09:00 の + が空白になるので戻す
+    try:
+        dt = sep and (
+            parse_datetime(updated_at) or parse_datetime(updated_at.replace(" ", "+"))
+        )
+    except ValueError:
+        dt = None
+    if not dt or not rating_id.isdigit():
+        raise ValidationError({"cursor": "must be '<updated_at>,<id>'"})
+    return dt, int(rating_id)
+
+
+def iter_rating_rows(qs, after=None, limit=None, chunk_size=None):
+    """
+    Rating を (updated_at, id) 順に chunk_size 行ずつ読み、values() の dict を1行ずつ返す。
+    after: (updated_at, id)。この行より後から読む（差分取得の続き）。
+    1回の SELECT は LIMIT chunk_size（既定 RATING_EXPORT_CHUNK）で、続きは最後の行をキーにして読む。
+    """
+    chunk_size = chunk_size or RATING_EXPORT_CHUNK
+    remaining = limit
+    while remaining is None or remaining > 0:
+        page = qs
+        if after is not None:
+            updated_at, rating_id = after
+            page = page.filter(
+                Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=rating_id)
+            )
+        size = chunk_size if remaining is None else min(chunk_size, remaining)
+        rows = list(page.order_by("updated_at", "id").values(*_RATING_EXPORT_FIELDS)[:size])
+        yield from rows
+        if len(rows) < size:
+            return
+        if remaining is not None:
+            remaining -= len(rows)
+        after = (rows[-1]["updated_at"], rows[-1]["id"])
+
+
+def _rating_row(values, fields):
+    """values() の1行を RatingRowSerializer と同じ表記にする（id つき）。"""
+    row = {"id": values["id"]}
+    for name in RatingRowSerializer.Meta.fields:
+        value = values[name]
+        row[name] = None if value is None else fields[name].to_representation(value)
+    return row
+
+
+def _stream_rating_rows(rows, stream):
+    fields = RatingRowSerializer().fields
+    if stream == "jsonl":
+        for values in rows:
+            yield json.dumps(_rating_row(values, fields), ensure_ascii=False) + "\n"
+        return
+    yield "["
+    for i, values in enumerate(rows):
+        yield ("," if i else "") + json.dumps(_rating_row(values, fields), ensure_ascii=False)
+    yield "]"
+
+
 class SongsRatingExport(APIView):
     """
     GET /api/songs_rating
@@ -199,12 +301,19 @@ class SongsRatingExport(APIView):
       - user_id: 任意。指定した場合はそのユーザーのみ。
       - updated_after: 任意。ISO8601形式。更新日時がこれ以降のものだけ返す。
       - limit: 任意。最大件数（安全のため上限あり）。
+      - stream: 任意。"jsonl"（1行1件の JSON Lines）または "json"（JSON の配列）。
+          指定すると RATING_EXPORT_CHUNK 件ずつ読みながら流す（全件でもメモリは一定）。
+      - cursor: 任意。"<updated_at>,<id>"（前回受け取った最後の行の値）。
+          この行より後だけを (updated_at, id) 順に返す。差分同期の再開用。
+
+    stream か cursor を指定したときは (updated_at, id) 順で、各行に id も付く。
+    どちらも無いときは従来どおり song_id 順の配列を返す。
     """
 
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
-        qs = Rating.objects.select_related("song", "user").order_by("song_id")
+        qs = Rating.objects.all()
 
         # user_id は「必須」から「任意フィルタ」へ変更
         user_id = request.query_params.get("user_id")
@@ -224,15 +333,35 @@ class SongsRatingExport(APIView):
             qs = qs.filter(updated_at__gte=dt)
 
         # 件数制限
+        n = None
         limit = request.query_params.get("limit")
         if limit:
             try:
                 n = int(limit)
             except ValueError:
                 raise ValidationError({"limit": "must be integer"})
-            n = max(1, min(100000, n))  # 上限はお好みで
-            qs = qs[:n]
+            n = max(1, min(RATING_EXPORT_MAX_LIMIT, n))
+
+        stream = request.query_params.get("stream")
+        if stream and stream not in RATING_EXPORT_STREAMS:
+            raise ValidationError({"stream": "must be 'jsonl' or 'json'"})
+        cursor = request.query_params.get("cursor")
+        after = _parse_rating_cursor(cursor) if cursor else None
+
+        if stream:
+            return StreamingHttpResponse(
+                _stream_rating_rows(iter_rating_rows(qs, after, n), stream),
+                content_type=RATING_EXPORT_STREAMS[stream],
+            )
+        if after is not None:
+            fields = RatingRowSerializer().fields
+            return Response(
+                [_rating_row(v, fields) for v in iter_rating_rows(qs, after, n)]
+            )
 
+        qs = qs.select_related("song", "user").order_by("song_id")
+        if n is not None:
+            qs = qs[:n]
         serializer = RatingRowSerializer(qs, many=True)
         return Response(serializer.data)
 
@@ -448,6 +577,7 @@ def update_song_credits(request):
 
 @api_view(["GET"])
 @permission_classes([permissions.IsAuthenticated])
+@api_list_condition("artists")
 def artist_list(request):
     qs = Artist.objects.all().order_by("id")
     data = ArtistSerializer(qs, many=True).data
@@ -456,6 +586,7 @@ def artist_list(request):
 
 @api_view(["GET"])
 @permission_classes([permissions.IsAuthenticated])
+@api_list_condition("artist_credits")
 def artist_credit_list(request):
     """
     GET /api/artist_credits/
@@ -469,6 +600,7 @@ def artist_credit_list(request):
 
 @api_view(["GET"])
 @permission_classes([permissions.IsAuthenticated])
+@api_list_condition("artist_aliases")
 def artist_alias_list(request):
     """
     GET /api/artist_aliases/
@@ -482,7 +614,37 @@ def artist_alias_list(request):
 
 @api_view(["GET"])
 @permission_classes([permissions.IsAuthenticated])
+@api_list_condition("songs")
 def song_list(request):
     qs = Song.objects.all().order_by("id").select_related("artist", "credit")
     data = SongSerializer(qs, many=True).data
     return Response(data)
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAuthenticated])
+def catalog_change_list(request):
+    """
+    GET /api/changes?since=<通し番号（seq）>
+    歌手・名義・別表記・曲の、since より後の変更（songs.catalog_changes）。
+    {
+      "since": 12, "next": 40, "has_more": false,
+      "upserts": [{"table": "artists", "rows": [...]}, ...],   # 歌手 → 名義 → 別表記 → 曲
+      "deletes": [{"table": "songs", "ids": [...]}, ...],      # 曲 → 別表記 → 名義 → 歌手
+      "checksums": {"artists": {"count": 1200, "crc32_sum": 123456789}, ...}
+    }
+    has_more が true なら next を since にしてもう一度呼ぶ。
+    checksums は最後まで返せたときだけ付く（途中なら null）。
+    """
+    since = request.query_params.get("since", "0")
+    try:
+        since = int(since)
+    except ValueError:
+        raise ValidationError({"since": "must be integer"})
+    if since < 0:
+        raise ValidationError({"since": "must be >= 0"})
+
+    data = {"since": since, **catalog_changes.changes_since(since)}
+    # まだ返していない変更があるうちは、手元のテーブルと合わないので付けない
+    data["checksums"] = None if data["has_more"] else catalog_changes.checksums()
+    return Response(data)
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class SongsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'songs'
+
+    def ready(self):
+        # 集計テーブルなどの派生データを保存・削除に追従させる
+        from . import instrumentation, signals  # noqa: F401
+
+        # テンプレートの描画時間を測る（ServerTimingMiddleware が使う）。
+        # ミドルウェアの生成ごとに差し替えないよう、ここで1回だけ行う
+        instrumentation.install()
@@ -0,0 +1,286 @@
+"""
+歌手・名義・別表記・曲の変更履歴（CatalogChange）と、差分同期用の読み出し。
+
+同期スクリプトは /api/artists/ などで毎回テーブル全体を取っていたが、
+ここで変更のあった行だけを /api/changes?since=<通し番号（seq）> で返す。
+記録は songs.signals が Model.save() / delete() に合わせて行うので、
+ビュー・DRF API・admin（import_export を含む）のどこから書いても残る。
+QuerySet.update() / bulk_create()（generate_dataset など）は記録されないので、
+そのときはクライアント側でチェックサムが合わなくなり、全件を取り直すことになる。
+
+差分の中身:
+  - 同じ行が何度変わっても最後の状態だけを返す（行は本体から今の値を読む）
+  - upserts は依存の順（歌手 → 名義 → 別表記 → 曲）、deletes はその逆順。
+    クライアントはこの順に当てれば外部キーを壊さない
+  - 行の形は /api/artists/ などの一覧と同じ（同じシリアライザ）
+  - checksums はテーブルごとの行数と、各行の JSON（キー順、区切りは "," ":"、
+    ensure_ascii=False）の CRC32 の合計（2**32 の剰余）。当て終えた手元の
+    テーブルで同じ値を計算し、合わなければ全件を取り直す
+
+初回の同期は、先に /api/changes を叩いて next を控えてから一覧の API で全件を取り、
+以降は控えた next から差分を取る（全件を取っている間の変更も取りこぼさない）。
+
+通し番号は CatalogChange.id ではなく seq。id は INSERT の時点で決まるので、
+長いトランザクションが後から若い id でコミットすると、id 順に読んだクライアントは
+それを永久に飛ばしてしまう。seq は読み出すときに、コミット済みでまだ番号の無い
+履歴へ CatalogSequence の行をロックして順に振る（assign_sequence）。ある seq が
+見えたときには、それより小さい seq の履歴はすべてコミット済みで見えている。
+
+差分を最後まで返せたとき（has_more が無いとき）だけ checksums を付ける。
+まだ返していない変更があると、手元と合わないのは当然なので。
+チェックサムの控えは目録全体から作るので、ワーカーごとに作り直さないよう
+共有のキャッシュ（settings.CACHES["catalog"]）に置く。
+
+履歴は行ごとに最新のものだけ残せば足りるので、manage.py compact_catalog_changes を
+cron で回して古い履歴を詰める（どの since から読んでも返す差分は変わらない）。
+"""
+
+import json
+import time
+import zlib
+from datetime import timedelta
+
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .api_serializers import (
+    ArtistAliasSerializer,
+    ArtistCreditSerializer,
+    ArtistSerializer,
+    SongSerializer,
+)
+from .models import (
+    Artist,
+    ArtistAlias,
+    ArtistCredit,
+    CatalogChange,
+    CatalogSequence,
+    Song,
+)
+
+# チェックサムの控えを置くキャッシュ
+CACHE_ALIAS = "catalog"
+# 1回で読む変更履歴の件数
+PAGE_SIZE = 5000
+# 行ごとのチェックサムの控えを全件から作り直す間隔（秒）。記録のある変更はその行だけ
+# すぐ計算し直すが、記録を通らない書き込み（bulk_create など）はこの秒数まで反映されない
+CHECKSUM_TIMEOUT = 10 * 60
+
+# 依存の順（外部キーの参照先が先）。名前は API の一覧と同じ。
+TABLES = {
+    "artists": (Artist, ArtistSerializer),
+    "artist_credits": (ArtistCredit, ArtistCreditSerializer),
+    "artist_aliases": (ArtistAlias, ArtistAliasSerializer),
+    "songs": (Song, SongSerializer),
+}
+_TABLE_OF_MODEL = {model: table for table, (model, _s) in TABLES.items()}
+
+
+def record(instance, op):
+    CatalogChange.objects.create(
+        table=_TABLE_OF_MODEL[type(instance)], object_id=instance.pk, op=op
+    )
+
+
+def record_credit_songs(credit):
+    """
+    名義の変更は、その名義の曲の行（credit_name）も変える。
+    曲の変更としても残し、曲のチェックサムがずれないようにする。
+    """
+    song_ids = Song.objects.filter(credit=credit).values_list("id", flat=True)
+    CatalogChange.objects.bulk_create(
+        CatalogChange(table="songs", object_id=song_id, op=CatalogChange.OP_UPDATE)
+        for song_id in song_ids
+    )
+
+
+def _queryset(table):
+    model, _serializer = TABLES[table]
+    qs = model.objects.order_by("id")
+    if model is Song:
+        qs = qs.select_related("credit")
+    return qs
+
+
+def _rows(table, ids):
+    _model, serializer = TABLES[table]
+    return serializer(_queryset(table).filter(id__in=ids), many=True).data
+
+
+@transaction.atomic
+def _assign_pending():
+    # 番号を振る側を1つずつにする（行が無いのは migrate を通していないDBだけ）
+    counter, _created = CatalogSequence.objects.select_for_update().get_or_create(
+        pk=1
+    )
+    # ロックしてから読み直す（待っている間に別のリクエストが振った分は除く）
+    pending = list(
+        CatalogChange.objects.select_for_update()
+        .filter(seq__isnull=True)
+        .order_by("id")
+        .only("id")
+    )
+    for seq, entry in enumerate(pending, start=counter.last_seq + 1):
+        entry.seq = seq
+    CatalogChange.objects.bulk_update(pending, ["seq"], batch_size=PAGE_SIZE)
+    counter.last_seq += len(pending)
+    counter.save(update_fields=["last_seq"])
+
+
+def assign_sequence():
+    """
+    コミット済みでまだ seq の無い履歴に、id の順で続きの seq を振る。
+    まだコミットされていない履歴は見えないので、コミットされた後の呼び出しで
+    それより大きい seq が振られる。
+    """
+    if CatalogChange.objects.filter(seq__isnull=True).exists():
+        _assign_pending()
+
+
+def changes_since(since, limit=PAGE_SIZE):
+    """
+    since（seq）より後の変更を、行ごとに最後の状態へまとめて返す。
+    戻り値: {"next": 次に渡す since, "has_more": 続きがあるか,
+             "upserts": [{"table", "rows"}, ...], "deletes": [{"table", "ids"}, ...]}
+    """
+    assign_sequence()
+    entries = list(
+        CatalogChange.objects.filter(seq__gt=since)
+        .order_by("seq")
+        .values_list("seq", "table", "object_id", "op")[:limit]
+    )
+
+    last_op = {}
+    for _seq, table, object_id, op in entries:
+        last_op[(table, object_id)] = op
+
+    upserts, deletes = [], []
+    for table in TABLES:
+        changed = {oid for (t, oid), op in last_op.items() if t == table}
+        deleted = {oid for oid in changed if last_op[(table, oid)] == CatalogChange.OP_DELETE}
+        rows = _rows(table, sorted(changed - deleted)) if changed - deleted else []
+        # 記録の後に消えた行（記録を通らない削除）も削除として返す
+        deleted |= changed - deleted - {row["id"] for row in rows}
+        if rows:
+            upserts.append({"table": table, "rows": rows})
+        if deleted:
+            deletes.insert(0, {"table": table, "ids": sorted(deleted)})
+
+    return {
+        "next": entries[-1][0] if entries else since,
+        "has_more": len(entries) == limit,
+        "upserts": upserts,
+        "deletes": deletes,
+    }
+
+
+def row_checksum(row):
+    text = json.dumps(row, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return zlib.crc32(text.encode("utf-8"))
+
+
+def _row_checksums(table, ids=None):
+    """{id: 行の CRC32}。ids を渡せばその行だけ（消えた行は含まれない）。"""
+    _model, serializer = TABLES[table]
+    qs = _queryset(table)
+    if ids is not None:
+        qs = qs.filter(id__in=ids)
+    return {
+        obj.id: row_checksum(serializer(obj).data)
+        for obj in qs.iterator(chunk_size=2000)
+    }
+
+
+def _refresh_checksums(table, state, changed):
+    """控えの行ごとの CRC32 に、変更履歴に載った行（changed）を当て直す。"""
+    rows = state["rows"]
+    for object_id in changed:
+        rows.pop(object_id, None)
+    if changed:
+        rows.update(_row_checksums(table, changed))
+
+
+def checksums():
+    """
+    テーブルごとの {"count", "crc32_sum"}。
+
+    行ごとの CRC32 を控えておき、前回から変更履歴に載った行だけを計算し直す。
+    控えは CHECKSUM_TIMEOUT ごとに全件から作り直す（共有のキャッシュなので、
+    全件から作るのは全ワーカーを通して期限ごとに1回）。
+    まだ返していない変更があるときに呼ぶと、手元のテーブルと合わなくなるので、
+    差分を最後まで返せたときだけ呼ぶこと。
+    """
+    cache = caches[CACHE_ALIAS]
+    latest = dict(
+        CatalogChange.objects.filter(seq__isnull=False)
+        .values("table")
+        .annotate(last=Max("seq"))
+        .values_list("table", "last")
+    )
+    keys = {table: f"catalog_checksum:{table}" for table in TABLES}
+    states = cache.get_many(keys.values())
+
+    # 前回の控えより後に変わった行（全テーブル分を1回で読む）
+    behind = {
+        table: states[key]["seq"]
+        for table, key in keys.items()
+        if key in states and states[key]["seq"] != latest.get(table, 0)
+    }
+    changed = {table: set() for table in behind}
+    if behind:
+        entries = CatalogChange.objects.filter(
+            table__in=behind, seq__gt=min(behind.values())
+        ).values_list("seq", "table", "object_id")
+        for seq, table, object_id in entries:
+            if behind[table] < seq <= latest.get(table, 0):
+                changed[table].add(object_id)
+
+    result = {}
+    for table, key in keys.items():
+        seq = latest.get(table, 0)
+        state = states.get(key)
+        if state is not None and len(changed.get(table, ())) > PAGE_SIZE:
+            state = None
+        if state is None:
+            state = {
+                "seq": seq,
+                "rows": _row_checksums(table),
+                "expires": time.time() + CHECKSUM_TIMEOUT,
+            }
+            cache.set(key, state, CHECKSUM_TIMEOUT)
+        elif table in changed:
+            _refresh_checksums(table, state, changed[table])
+            state["seq"] = seq
+            # 期限は延ばさない（記録を通らない書き込みを CHECKSUM_TIMEOUT で拾い直す）
+            cache.set(key, state, max(1, int(state["expires"] - time.time())))
+        rows = state["rows"]
+        result[table] = {"count": len(rows), "crc32_sum": sum(rows.values()) % 2**32}
+    return result
+
+
+def compact(days):
+    """
+    days 日より古い履歴のうち、同じ行のもっと新しい履歴があるものを消す。
+    差分は行ごとに最後の状態だけを返すので、どの since から読んでも結果は変わらない。
+    残るのは行ごとに最新の1件（消えた行は削除の1件）と、新しい履歴だけになる。
+    戻り値: 消した件数
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    seen, stale = set(), []
+    # 差分は seq の順に返すので、新しさも seq で比べる（まだ seq の無い履歴は残す）
+    entries = (
+        CatalogChange.objects.filter(seq__isnull=False)
+        .order_by("-seq")
+        .values_list("id", "table", "object_id", "changed_at")
+    )
+    for entry_id, table, object_id, changed_at in entries.iterator(chunk_size=PAGE_SIZE):
+        if (table, object_id) in seen:
+            if changed_at < cutoff:
+                stale.append(entry_id)
+        else:
+            seen.add((table, object_id))
+    for start in range(0, len(stale), PAGE_SIZE):
+        CatalogChange.objects.filter(id__in=stale[start : start + PAGE_SIZE]).delete()
+    return len(stale)
@@ -0,0 +1,106 @@
+"""
+条件付き GET（ETag）に使うデータの版。
+
+Android / Windows のクライアントは API の一覧を定期的に取りに来るが、
+中身が変わっていなくても毎回テーブル全体をシリアライズして gzip していた。
+ここで表やユーザーごとの「版」を安く（インデックスを1〜2回引くだけで）求め、
+django.views.decorators.http.condition に渡して、変わっていなければ 304 を返す。
+
+  - テーブルの版: 変更履歴（songs.catalog_changes）の最新の通し番号と、
+    表の最大の id（変更履歴を通らない bulk_create の追加も拾う）
+  - ユーザーの版: そのユーザーの評価の件数と最新の updated_at
+    （Rating の (user, updated_at) インデックスで引く）
+
+Last-Modified は付けない。変更履歴の時刻は秒単位で、同じ秒の中の2回の変更や
+記録を通らない bulk_create の追加を区別できず、If-Modified-Since だけを送る
+クライアントに古いままの 304 を返し続けてしまうため。
+
+HTML のランキング画面は、他のユーザーのデータを見ているときだけ 304 を返す。
+自分の画面は開いたまま採点を直すので、いつも作り直す。
+画面にはログイン中のユーザー名・CSRF トークン・ユーザーの一覧も入るので、
+それらとプロセスの起動時刻（デプロイでテンプレートが変わる）も版に含める。
+"""
+
+import hashlib
+import time
+
+from django.contrib.auth.models import User
+from django.db.models import Count, Max
+from django.views.decorators.http import condition
+
+from .catalog_changes import TABLES
+from .models import CatalogChange, Rating
+
+# テンプレートやコードが変わったら画面の版も変える（再起動＝デプロイ）
+_BOOT = str(time.time_ns())
+
+
+def table_version(table):
+    """表の版の文字列。table は catalog_changes.TABLES の名前。"""
+    model, _serializer = TABLES[table]
+    seq = (
+        CatalogChange.objects.filter(table=table)
+        .order_by("-id")
+        .values_list("id", flat=True)
+        .first()
+    )
+    max_id = model.objects.aggregate(m=Max("id"))["m"] or 0
+    return f"{table}-{seq or 0}-{max_id}"
+
+
+def catalog_version():
+    """曲目録全体の版の文字列。"""
+    seq = CatalogChange.objects.order_by("-id").values_list("id", flat=True).first()
+    return f"catalog-{seq or 0}"
+
+
+def user_version(user_id):
+    """ユーザーの評価の版の文字列。"""
+    row = Rating.objects.filter(user_id=user_id).aggregate(
+        n=Count("id"), last=Max("updated_at")
+    )
+    stamp = row["last"].timestamp() if row["last"] else 0
+    return f"user{user_id}-{row['n']}-{stamp}"
+
+
+def api_list_condition(table):
+    """API の一覧（テーブル全体を返すもの）を条件付き GET にするデコレータ。"""
+    return condition(etag_func=lambda request, *args, **kwargs: table_version(table))
+
+
+def _selected_other_user_id(request):
+    """user パラメータで他のユーザーを見ているならその id。自分の画面なら None。"""
+    selected = request.GET.get("user")
+    if not selected or not selected.isdigit():
+        return None
+    if request.user.is_authenticated and int(selected) == request.user.id:
+        return None
+    return int(selected)
+
+
+def _page_version(request):
+    user_id = _selected_other_user_id(request)
+    if user_id is None or not request.user.is_authenticated:
+        return None
+    users = User.objects.aggregate(n=Count("id"), m=Max("id"))
+    csrf = request.META.get("CSRF_COOKIE", "")
+    raw = "|".join(
+        [
+            _BOOT,
+            user_version(user_id),
+            catalog_version(),
+            f"users-{users['n']}-{users['m']}",
+            str(request.user.id),
+            hashlib.sha1(csrf.encode()).hexdigest(),
+        ]
+    )
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def other_user_page_condition(view):
+    """
+    他のユーザーのランキング画面を条件付き GET にするデコレータ（login_required の内側に付ける）。
+    """
+    return condition(
+        etag_func=lambda request, *args, **kwargs: _page_version(request)
+    )(view)
@@ -0,0 +1,227 @@
+"""
+遅いリクエストの記録（フライトレコーダー）。
+
+処理に settings.SLOW_REQUEST_MS ミリ秒以上かかったリクエストについて、
+URL・ユーザー・パラメータ・実行した SQL（パラメータと所要時間つき。
+セッション・トークン・パスワードに関わる文のパラメータは伏せる）と、
+遅かった上位 SLOW_REQUEST_EXPLAIN 件の SQL の実行計画（EXPLAIN）を
+settings.SLOW_REQUEST_DIR に1件1ファイルの JSON で残す。
+新しい順に SLOW_REQUEST_KEEP 件を超えたら古いものから消す。
+
+services.py の CTE は f-string で組み立てるので、後から同じ文を再現するのが
+難しい。実際に遅かったリクエストの文と実行計画をその場で控えておく。
+記録はスタッフ用の画面（/slow-requests/）で見る。
+SQL の控えは songs.instrumentation.ServerTimingMiddleware が取る。
+"""
+
+import datetime
+import json
+import os
+import re
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+from django.http.request import RawPostDataException
+
+# 実行計画を取るための接頭辞（DB ごと）
+EXPLAIN_PREFIXES = {
+    "mysql": "EXPLAIN ",
+    "postgresql": "EXPLAIN ",
+    "sqlite": "EXPLAIN QUERY PLAN ",
+}
+# 実際に実行して所要時間も取る EXPLAIN（MySQL は 8.0.18 以降）
+EXPLAIN_ANALYZE_PREFIXES = {
+    "mysql": "EXPLAIN ANALYZE ",
+    "postgresql": "EXPLAIN ANALYZE ",
+}
+
+# 1リクエストで控える SQL の上限（ループで大量に発行するビューでもメモリを食わないように）
+MAX_STATEMENTS = 500
+# パラメータの控えの上限（IN 句に大量の ID を渡す文があるため）
+MAX_PARAMS = 50
+
+# POST の値を控えないキー
+_SECRET_KEYS = re.compile(r"password|token|csrf|secret", re.IGNORECASE)
+# パラメータを伏せる SQL（セッションキー・API トークン・パスワードのハッシュを
+# 条件や値に持つ文）。セッションとトークンの読み込みは毎リクエスト出る
+_SECRET_SQL = re.compile(r"django_session|authtoken_token|password", re.IGNORECASE)
+# 記録のID（ファイル名）。画面の URL から受け取るので形を確かめる
+_RECORD_ID = re.compile(r"^\d+-\d+$")
+
+
+def threshold_ms():
+    """記録する処理時間の下限（ミリ秒）。0 以下なら記録しない。"""
+    return getattr(settings, "SLOW_REQUEST_MS", 0)
+
+
+def is_enabled():
+    return threshold_ms() > 0
+
+
+def _directory():
+    return Path(settings.SLOW_REQUEST_DIR)
+
+
+def explain_rows(sql, params=None, analyze=False):
+    """
+    SQL の実行計画を (列名のリスト, 行のリスト) で返す。
+    analyze=True なら実際に実行して所要時間も取る（EXPLAIN ANALYZE）。
+    対応していない DB なら None。
+    """
+    prefixes = EXPLAIN_ANALYZE_PREFIXES if analyze else EXPLAIN_PREFIXES
+    prefix = prefixes.get(connection.vendor)
+    if prefix is None:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql, params)
+        columns = [c[0] for c in cursor.description]
+        return columns, cursor.fetchall()
+
+
+def explain(sql, params=None):
+    """SQL の実行計画を1行ずつの文字列で返す（対応していない DB なら注記のみ）。"""
+    result = explain_rows(sql, params)
+    if result is None:
+        return [f"（{connection.vendor} の EXPLAIN には未対応）"]
+    return [" | ".join("" if v is None else str(v) for v in row) for row in result[1]]
+
+
+def _is_select(sql):
+    return sql.lstrip().upper().startswith(("SELECT", "WITH"))
+
+
+def _params(sql, params):
+    if params is None:
+        return None
+    params = list(params)
+    if _SECRET_SQL.search(sql):
+        return ["***"] * min(len(params), MAX_PARAMS)
+    shown = [repr(p) for p in params[:MAX_PARAMS]]
+    if len(params) > MAX_PARAMS:
+        shown.append(f"...（全 {len(params)} 件）")
+    return shown
+
+
+def _request_params(request):
+    """GET はそのまま、POST はパスワード・トークンなどの値を伏せて控える。"""
+    post = {}
+    if request.method == "POST" and not request.content_type.startswith("multipart/"):
+        try:
+            for key in request.POST:
+                post[key] = "***" if _SECRET_KEYS.search(key) else request.POST.get(key)
+        except RawPostDataException:
+            pass  # 本文をビューが直接読んだ（JSON の API など）
+    return {"get": dict(request.GET.lists()), "post": post}
+
+
+def record(request, response, total_ms, timings):
+    """遅いリクエストなら記録する。"""
+    if not is_enabled() or total_ms < threshold_ms():
+        return
+    statements = timings.statements or []
+
+    explains = []
+    slowest = sorted(
+        range(len(statements)), key=lambda i: statements[i][2], reverse=True
+    )
+    for index in slowest[: getattr(settings, "SLOW_REQUEST_EXPLAIN", 3)]:
+        sql, params, _ms, many = statements[index]
+        if many or not _is_select(sql):
+            continue
+        try:
+            plan = explain(sql, params)
+        except Exception as e:  # 実行計画が取れなくても記録は残す
+            plan = [f"（EXPLAIN に失敗しました: {e}）"]
+        explains.append({"index": index, "plan": plan})
+
+    user = getattr(request, "user", None)
+    match = getattr(request, "resolver_match", None)
+    data = {
+        "recorded_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "method": request.method,
+        "path": request.path,
+        "query_string": request.META.get("QUERY_STRING", ""),
+        "params": _request_params(request),
+        "user": user.get_username() if user and user.is_authenticated else None,
+        "view": match.view_name if match else None,
+        "status": response.status_code,
+        "total_ms": round(total_ms, 1),
+        "db_ms": round(timings.db_ms, 1),
+        "queries": timings.queries,
+        "template_ms": round(timings.template_ms, 1),
+        "statements": [
+            {
+                "sql": sql,
+                "params": _params(sql, params),
+                "ms": round(ms, 2),
+                "many": many,
+            }
+            for sql, params, ms, many in statements
+        ],
+        "explains": explains,
+    }
+    _write(data)
+
+
+def _write(data):
+    directory = _directory()
+    record_id = f"{time.time_ns()}-{os.getpid()}"
+    tmp = None
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, default=str)
+        os.replace(tmp, directory / f"{record_id}.json")
+    except OSError:
+        # 書けなくてもリクエストは止めない
+        if tmp is not None and os.path.exists(tmp):
+            os.unlink(tmp)
+        return
+    _prune(directory)
+
+
+def _record_paths(directory):
+    """記録のファイル（新しい順）。"""
+    paths = [p for p in directory.glob("*.json") if _RECORD_ID.match(p.stem)]
+    return sorted(paths, key=lambda p: int(p.stem.split("-")[0]), reverse=True)
+
+
+def _prune(directory):
+    for path in _record_paths(directory)[getattr(settings, "SLOW_REQUEST_KEEP", 200) :]:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass  # 別のワーカーが先に消した
+
+
+def list_records():
+    """記録の一覧（新しい順）。SQL は省いた要約だけを返す。"""
+    directory = _directory()
+    if not directory.is_dir():
+        return []
+    summaries = []
+    for path in _record_paths(directory):
+        data = load_record(path.stem)
+        if data is None:
+            continue
+        summary = {k: v for k, v in data.items() if k not in ("statements", "explains")}
+        summary["id"] = path.stem
+        summaries.append(summary)
+    return summaries
+
+
+def load_record(record_id):
+    """1件の記録。見つからない（消えた）ときは None。"""
+    if not _RECORD_ID.match(record_id):
+        return None
+    try:
+        with open(_directory() / f"{record_id}.json", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    data["id"] = record_id
+    return data
@@ -0,0 +1,248 @@
+"""
+リクエストごとの処理時間の内訳を測るミドルウェア。
+
+1リクエストについて、全体の時間・SQL の件数と合計時間・テンプレートの描画時間・
+ランキングキャッシュ（songs.ranking_cache）のヒット/ミスを集め、
+Server-Timing ヘッダ（ブラウザの開発者ツールの「タイミング」に出る）と
+ロガー "songs.perf" への1行の JSON として出す。
+同じ値を songs.metrics にも足し、/metrics で全ワーカー分をまとめて見られるようにする。
+遅いリクエストは SQL の控えごと songs.flight_recorder に記録する。
+
+DEBUG 時の django.db.backends のログと違って SQL 本文は控えず、件数と時間を
+足すだけなので、本番で常に有効にしておける。
+ヘッダは SERVER_TIMING（既定は DEBUG のときだけ）、ログは PERF_LOG（既定は出さない）で
+切り替える。メトリクスと遅いリクエストの記録はどちらの設定にもよらない。
+
+テンプレートの描画時間は Template.render を差し替えて測る。差し替えは
+SongsConfig.ready() から install() で1回だけ行い、ミドルウェアからは触らない。
+リクエストの外で測りたいとき（manage.py profile_page）は template_timer() を使う。
+"""
+
+import contextvars
+import json
+import logging
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.template.base import Template
+
+from songs import flight_recorder, metrics
+
+logger = logging.getLogger("songs.perf")
+
+# 処理中のリクエストの集計（リクエストの外では None）
+_current = contextvars.ContextVar("songs_request_timings", default=None)
+
+# template_timer() で描画時間を集めている集計（リクエストの集計とは別に足す）
+_template_timers = contextvars.ContextVar("songs_template_timers", default=())
+
+
+class RequestTimings:
+    """1リクエスト分の集計。"""
+
+    __slots__ = (
+        "queries",
+        "db_ms",
+        "template_ms",
+        "template_depth",
+        "cache_hits",
+        "cache_misses",
+        "body_bytes",
+        "statements",
+    )
+
+    def __init__(self, capture_sql=False):
+        self.queries = 0
+        self.db_ms = 0.0
+        self.template_ms = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.body_bytes = None
+        # (SQL, パラメータ, ミリ秒, executemany か)。遅いリクエストの記録用
+        self.statements = [] if capture_sql else None
+
+
+def current_timings():
+    """処理中のリクエストの集計（リクエストの外なら None）。"""
+    return _current.get()
+
+
+def record_cache(hit):
+    """ランキングキャッシュのヒット/ミスを処理中のリクエストに数える。"""
+    timings = _current.get()
+    if timings is None:
+        return
+    if hit:
+        timings.cache_hits += 1
+    else:
+        timings.cache_misses += 1
+
+
+def _query_timer(execute, sql, params, many, context):
+    """connection.execute_wrapper 用。SQL の件数と時間を足す。"""
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        ms = (time.perf_counter() - started) * 1000
+        timings.queries += 1
+        timings.db_ms += ms
+        if (
+            timings.statements is not None
+            and len(timings.statements) < flight_recorder.MAX_STATEMENTS
+        ):
+            timings.statements.append((sql, params, ms, many))
+
+
+_original_render = Template.render
+
+
+def _timed_render(self, context):
+    """
+    Template.render の差し替え。
+    include / extends の入れ子は外側の描画に含まれるので、一番外側だけ数える。
+    """
+    timings = _current.get()
+    targets = _template_timers.get()
+    if timings is not None:
+        targets += (timings,)
+    if not targets:
+        return _original_render(self, context)
+    for target in targets:
+        target.template_depth += 1
+    started = time.perf_counter()
+    try:
+        return _original_render(self, context)
+    finally:
+        ms = (time.perf_counter() - started) * 1000
+        for target in targets:
+            target.template_depth -= 1
+            if target.template_depth == 0:
+                target.template_ms += ms
+
+
+def install():
+    """Template.render を差し替える。何度呼んでも1回だけ（SongsConfig.ready から呼ぶ）。"""
+    if Template.render is not _timed_render:
+        Template.render = _timed_render
+
+
+@contextmanager
+def template_timer():
+    """
+    with の中で描画したテンプレートの時間を集める（戻り値の template_ms）。
+    リクエストの外から測るとき用で、中で処理したリクエストの集計とは別に足す。
+    """
+    install()
+    timings = RequestTimings()
+    token = _template_timers.set(_template_timers.get() + (timings,))
+    try:
+        yield timings
+    finally:
+        _template_timers.reset(token)
+
+
+def _server_timing(total_ms, timings):
+    return ", ".join(
+        [
+            f"total;dur={total_ms:.1f}",
+            f'db;dur={timings.db_ms:.1f};desc="{timings.queries} queries"',
+            f"tpl;dur={timings.template_ms:.1f}",
+            f'cache;desc="hit={timings.cache_hits} miss={timings.cache_misses}"',
+        ]
+    )
+
+
+def _view_label(request):
+    """メトリクスのラベルにする URL 名（名前の無い URL はパターン）。"""
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unresolved"
+    return match.url_name or match.route
+
+
+def _record_metrics(request, response, total_ms, timings):
+    view = _view_label(request)
+    metrics.observe("music_request_duration_seconds", total_ms / 1000, view=view)
+    metrics.observe("music_request_db_queries", timings.queries, view=view)
+    metrics.observe("music_request_db_seconds", timings.db_ms / 1000, view=view)
+    metrics.inc("music_requests_total", view=view, status=response.status_code)
+    if response.streaming:
+        return
+    size = len(response.content)
+    metrics.observe("music_response_bytes", size, view=view)
+    if response.get("Content-Encoding") == "gzip" and timings.body_bytes:
+        metrics.inc("music_gzip_input_bytes_total", timings.body_bytes, view=view)
+        metrics.inc("music_gzip_output_bytes_total", size, view=view)
+
+
+class ServerTimingMiddleware:
+    """
+    処理時間の内訳を Server-Timing ヘッダとログに出す。
+    全体の時間に他のミドルウェアも含めるため、MIDDLEWARE の先頭に置く。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.header = getattr(settings, "SERVER_TIMING", settings.DEBUG)
+
+    def __call__(self, request):
+        timings = RequestTimings(capture_sql=flight_recorder.is_enabled())
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(_query_timer))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total_ms = (time.perf_counter() - started) * 1000
+
+        if self.header:
+            response["Server-Timing"] = _server_timing(total_ms, timings)
+        _record_metrics(request, response, total_ms, timings)
+        flight_recorder.record(request, response, total_ms, timings)
+        if logger.isEnabledFor(logging.INFO):
+            match = getattr(request, "resolver_match", None)
+            logger.info(
+                json.dumps(
+                    {
+                        "method": request.method,
+                        "path": request.path,
+                        "view": match.view_name if match else None,
+                        "status": response.status_code,
+                        "total_ms": round(total_ms, 1),
+                        "db_ms": round(timings.db_ms, 1),
+                        "queries": timings.queries,
+                        "template_ms": round(timings.template_ms, 1),
+                        "cache_hits": timings.cache_hits,
+                        "cache_misses": timings.cache_misses,
+                    },
+                    ensure_ascii=False,
+                )
+            )
+        return response
+
+
+class ResponseSizeMiddleware:
+    """
+    GZip で圧縮する前の本文の大きさを控える（圧縮率のメトリクス用）。
+    MIDDLEWARE で GZipMiddleware の直後（内側）に置く。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        timings = _current.get()
+        if timings is not None and not response.streaming:
+            timings.body_bytes = len(response.content)
+        return response
@@ -0,0 +1,217 @@
+"""
+ランキングの重いクエリの実行計画（EXPLAIN）と所要時間を測る開発用コマンド。
+
+インデックスやスキーマを変えたときに、変更の前後で同じコマンドを流して比べる。
+キャッシュ（songs.rankings）は通さず、services.py の SQL をそのまま実行する。
+評価が数件しか無いDBでは差が出ないので、manage.py generate_dataset で作った
+大きめのデータで測ること。
+
+変更前の値は、変更前のコミットのコードで測る。今の services.py の SQL は
+新しい列（0028 の title_key / name_key など）を使うので、migrate で戻しただけの
+スキーマでは動かない。変更前のコミットにはこのコマンドが無いこともあるので、
+このファイルを持ち込んで実行する（そのためこのファイルだけで完結させてある）。
+変更前のコードに無い関数は飛ばし、比較にも出さない。
+
+使い方（0028 の前後を比べる例。migrate で戻すと 0029 以降の表も消えるので、
+測定用のDBで行うこと）:
+    python manage.py migrate songs 0027
+    git worktree add ../music-before 272d6e2~1
+    cp .env ../music-before/
+    cp songs/management/commands/bench_ranking_sql.py \\
+        ../music-before/songs/management/commands/
+    (cd ../music-before && python manage.py bench_ranking_sql --save /tmp/before.json)
+    git worktree remove --force ../music-before
+    python manage.py migrate songs
+    python manage.py bench_ranking_sql --compare /tmp/before.json --explain
+"""
+
+import json
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+
+from songs import services
+
+# 実行計画を取るための接頭辞（DB ごと）。
+# 変更前のコードにも持ち込めるよう songs.flight_recorder は使わない
+EXPLAIN_PREFIXES = {
+    "mysql": "EXPLAIN ",
+    "postgresql": "EXPLAIN ",
+    "sqlite": "EXPLAIN QUERY PLAN ",
+}
+
+
+def _explain(sql):
+    prefix = EXPLAIN_PREFIXES.get(connection.vendor)
+    if prefix is None:
+        return [f"（{connection.vendor} の EXPLAIN には未対応）"]
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql)
+        return [
+            " | ".join("" if v is None else str(v) for v in row)
+            for row in cursor.fetchall()
+        ]
+
+
+def _targets(user_id, region_id):
+    """
+    測る対象: (名前, 呼び出し)。画面を開いたときに実際に走るものを並べる。
+    名前の先頭は services の関数名で、その関数が無い版のコードでは飛ばす。
+    """
+    targets = [
+        (
+            "call_song_ranking_page",
+            lambda: services.call_song_ranking_page(user_id, region_id, 200)["songs"],
+        ),
+        (
+            "call_song_ranking_page karaoke",
+            lambda: services.call_song_ranking_page(
+                user_id, region_id, 200, karaoke_mode=True
+            )["songs"],
+        ),
+        ("count_song_ranking", lambda: [services.count_song_ranking(user_id, region_id)]),
+        (
+            "call_ranking_bundle_by_region",
+            lambda: [
+                row
+                for bundle in services.call_ranking_bundle_by_region(user_id, 5).values()
+                for part in bundle.values()
+                for row in part["top"] + part["insufficient"]
+            ],
+        ),
+        (
+            "call_group_prefix_sums_by_region artist",
+            lambda: [
+                group
+                for groups in services.call_group_prefix_sums_by_region(
+                    user_id, "artist"
+                ).values()
+                for group in groups
+            ],
+        ),
+        (
+            "call_artist_song_top_n",
+            lambda: services.call_artist_song_top_n(user_id, 5, region_id),
+        ),
+        (
+            "call_creator_song_top_n lyricist",
+            lambda: services.call_creator_song_top_n(user_id, 5, region_id, "lyricist"),
+        ),
+    ]
+    return [(name, call) for name, call in targets if hasattr(services, name.split()[0])]
+
+
+class Command(BaseCommand):
+    help = "ランキングの重いクエリの実行計画と所要時間を測る（開発用）"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user",
+            default=None,
+            help="対象ユーザー名（省略時は評価の件数が最も多いユーザー）",
+        )
+        parser.add_argument(
+            "--region", type=int, default=None, help="地域ID（省略時は全地域）"
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=5, help="1クエリあたりの実行回数（既定5）"
+        )
+        parser.add_argument(
+            "--explain", action="store_true", help="実行計画も表示する"
+        )
+        parser.add_argument("--save", default=None, help="結果を書き出す JSON ファイル")
+        parser.add_argument(
+            "--compare", default=None, help="比べる JSON ファイル（以前の --save の結果）"
+        )
+
+    def handle(self, *args, **options):
+        user = self._user(options["user"])
+        if options["repeat"] < 1:
+            raise CommandError("--repeat は 1 以上にしてください")
+
+        self.stdout.write(
+            f"user={user.username}  region={options['region']}  "
+            f"db={connection.vendor}  repeat={options['repeat']}"
+        )
+        results = {}
+        for name, call in _targets(user.id, options["region"]):
+            results[name] = self._measure(call, options["repeat"])
+            self._report(name, results[name], options["explain"])
+
+        if options["compare"]:
+            self._compare(options["compare"], results)
+        if options["save"]:
+            with open(options["save"], "w", encoding="utf-8") as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+            self.stdout.write(f"保存しました: {options['save']}")
+
+    def _user(self, username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f"ユーザーが見つかりません: {username}")
+        user = (
+            User.objects.annotate(n=Count("rating"))
+            .filter(n__gt=0)
+            .order_by("-n", "id")
+            .first()
+        )
+        if user is None:
+            raise CommandError("評価のあるユーザーがいません")
+        return user
+
+    def _measure(self, call, repeat):
+        # 1回目は SQL を控えて実行計画を取る（時間には数えない）
+        with CaptureQueriesContext(connection) as queries:
+            rows = len(call())
+        plan = []
+        for query in queries.captured_queries:
+            plan += _explain(query["sql"])
+
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            call()
+            timings.append((time.perf_counter() - started) * 1000)
+        return {
+            "rows": rows,
+            "queries": len(queries.captured_queries),
+            "p50_ms": round(statistics.median(timings), 2),
+            "max_ms": round(max(timings), 2),
+            "plan": plan,
+        }
+
+    def _report(self, name, result, explain):
+        self.stdout.write(
+            f"{name:<42} {result['p50_ms']:>9.2f} ms (max {result['max_ms']:.2f})  "
+            f"{result['rows']:,} 行 / {result['queries']} クエリ"
+        )
+        if explain:
+            for line in result["plan"]:
+                self.stdout.write(f"    {line}")
+
+    def _compare(self, path, results):
+        try:
+            with open(path, encoding="utf-8") as f:
+                before = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"比較用のファイルを読めません: {path} ({e})")
+
+        self.stdout.write("")
+        self.stdout.write(f"比較（{path} → 今回）")
+        for name, result in results.items():
+            if name not in before:
+                continue
+            old = before[name]
+            ratio = result["p50_ms"] / old["p50_ms"] if old["p50_ms"] else 0
+            changed = "  実行計画が変わりました" if old["plan"] != result["plan"] else ""
+            self.stdout.write(
+                f"{name:<42} {old['p50_ms']:>9.2f} → {result['p50_ms']:.2f} ms "
+                f"(x{ratio:.2f}){changed}"
+            )
@@ -0,0 +1,326 @@
+"""
+services.py のランキング関数を一通り実行して所要時間を測るベンチマーク。
+
+関数ごとに、ユーザー（評価の件数が少ない/中くらい/多い人）× 地域 × 採点の種類 ×
+top_n × 集計軸の組み合わせを回し、p50 / p95 / 最大の所要時間・返した行数・
+使ったメモリの最大値（tracemalloc）を出す。SQL の書き換えや別の集計実装
+（--backend numpy / store）の良し悪しを数字で比べるためのもの。
+
+結果は --output の JSON に書き出せる。--baseline に以前の結果を渡すと
+同じ組み合わせどうしで比べ、p50 が --threshold 倍を超えて遅くなったもの
+（差が --min-ms 未満のものは揺れとして除く）があれば失敗で終わる。
+
+ランキング結果のキャッシュ（songs.ranking_cache）は切って測る。
+データは manage.py generate_dataset で作ると件数をそろえやすい。
+
+使い方:
+    python manage.py benchmark_rankings --output bench.json
+    python manage.py benchmark_rankings --baseline bench.json --threshold 1.2
+    python manage.py benchmark_rankings --backend numpy --only song_top_n
+    python manage.py benchmark_rankings --users synth_0,synth_9 --top-ns 5,20
+"""
+
+import datetime
+import inspect
+import itertools
+import json
+import math
+import statistics
+import time
+import tracemalloc
+from importlib import import_module
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import override_settings
+
+from songs import services
+from songs.models import MusicRegion
+from songs.rankings import RANKING_BACKENDS
+
+# 測らない関数（集計クエリではないもの・引数を組み立てられないもの）
+SKIP_FUNCTIONS = {
+    "call_my_procedure",  # ストアドプロシージャ呼び出しの汎用関数
+    "rows_from_prefix_sums",  # 集計済みの値から行を組み立てるだけ
+    "empty_ranking_bundle",
+}
+
+# 引数を省略したときに使う値（必須の引数だけ）
+LIMIT = 200
+
+
+def _public_functions(only=None):
+    """services.py で定義されている公開関数（名前順）。"""
+    funcs = []
+    for name, func in inspect.getmembers(services, inspect.isfunction):
+        if name.startswith("_") or name in SKIP_FUNCTIONS:
+            continue
+        if func.__module__ != services.__name__:
+            continue
+        if only and not any(o in name for o in only):
+            continue
+        funcs.append((name, func))
+    return funcs
+
+
+def _argument_choices(func, users, region_ids, top_ns):
+    """
+    関数の引数名から、回す値の候補を組み立てる。
+    戻り値: {引数名: [値, ...]}（知らない必須引数があれば None）
+    """
+    choices = {}
+    for param in inspect.signature(func).parameters.values():
+        name = param.name
+        if name == "user_id":
+            choices[name] = users
+        elif name == "region_id":
+            choices[name] = region_ids
+        elif name == "karaoke_mode":
+            choices[name] = [False, True]
+        elif name == "top_n":
+            choices[name] = list(top_ns)
+        elif name == "top_ns":
+            choices[name] = [tuple(top_ns)]
+        elif name == "creator_type":
+            choices[name] = list(services._CREATOR_COLUMNS)
+        elif name == "kind":
+            choices[name] = list(services.RANKING_KINDS)
+        elif name == "limit" and param.default is inspect.Parameter.empty:
+            choices[name] = [LIMIT]
+        elif param.default is inspect.Parameter.empty:
+            return None
+    return choices
+
+
+def _count_rows(value):
+    """戻り値の行数（dict は中のリストを合計する）。"""
+    if isinstance(value, list):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(
+            _count_rows(v) for v in value.values() if isinstance(v, (list, dict))
+        )
+    return 1
+
+
+def _percentile(values, p):
+    """最近傍法のパーセンタイル。"""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(len(ordered) * p / 100) - 1, 0)]
+
+
+def _case_label(name, arguments, user_labels):
+    parts = [name]
+    for key, value in arguments.items():
+        if key == "user_id":
+            parts.append(f"user={user_labels[value]}")
+        elif key == "region_id":
+            parts.append(f"region={value or 'all'}")
+        elif key == "top_ns":
+            parts.append("top_ns=" + ",".join(str(n) for n in value))
+        else:
+            parts.append(f"{key}={value}")
+    return " ".join(parts)
+
+
+class Command(BaseCommand):
+    help = "services.py のランキング関数の所要時間を測る（--baseline で前回と比べる）"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--backend",
+            default="sql",
+            choices=sorted(RANKING_BACKENDS),
+            help="測る集計の実装（既定 sql。実装に無い関数は services.py で測る）",
+        )
+        parser.add_argument(
+            "--users",
+            default=None,
+            help="対象ユーザー名（カンマ区切り。省略時は評価の件数が少ない/中くらい/多い3人）",
+        )
+        parser.add_argument(
+            "--top-ns", default="5,10,20", help="回す top_n（カンマ区切り、既定 5,10,20）"
+        )
+        parser.add_argument(
+            "--only", default=None, help="関数名に含まれる文字列で絞る（カンマ区切り）"
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=5, help="1組み合わせあたりの実行回数（既定5）"
+        )
+        parser.add_argument(
+            "--warmup", type=int, default=1, help="測る前に捨てる実行回数（既定1）"
+        )
+        parser.add_argument("--output", default=None, help="結果を書き出す JSON ファイル")
+        parser.add_argument(
+            "--baseline", default=None, help="比べる JSON ファイル（以前の --output）"
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=1.2,
+            help="p50 が基準の何倍を超えたら悪化とするか（既定 1.2）",
+        )
+        parser.add_argument(
+            "--min-ms",
+            type=float,
+            default=2.0,
+            help="この差（ミリ秒）未満の悪化は揺れとして無視する（既定 2.0）",
+        )
+
+    def handle(self, *args, **options):
+        if options["repeat"] < 1 or options["warmup"] < 0:
+            raise CommandError("--repeat は 1 以上、--warmup は 0 以上にしてください")
+        try:
+            top_ns = services._validate_top_ns(options["top_ns"].split(","))
+        except ValueError:
+            raise CommandError(f"--top-ns が不正です: {options['top_ns']}")
+
+        backend = import_module(RANKING_BACKENDS[options["backend"]])
+        users = self._users(options["users"])
+        only = options["only"].split(",") if options["only"] else None
+
+        # キャッシュが効くと2回目以降が集計にならないので切っておく
+        with override_settings(RANKING_CACHE_TIMEOUT=0):
+            results = self._run(backend, users, top_ns, only, options)
+
+        report = {
+            "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "backend": options["backend"],
+            "database": connection.vendor,
+            "repeat": options["repeat"],
+            "users": {label: count for label, (_id, count) in users.items()},
+            "results": results,
+        }
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(f"保存しました: {options['output']}")
+        if options["baseline"]:
+            self._compare(options["baseline"], report, options)
+
+    def _users(self, usernames):
+        """{ラベル: (ユーザーID, 評価の件数)}"""
+        counted = User.objects.annotate(n=Count("rating")).filter(n__gt=0)
+        if usernames:
+            names = [u.strip() for u in usernames.split(",") if u.strip()]
+            found = {u.username: (u.id, u.n) for u in counted.filter(username__in=names)}
+            missing = [n for n in names if n not in found]
+            if missing:
+                raise CommandError(
+                    f"評価のあるユーザーが見つかりません: {', '.join(missing)}"
+                )
+            return {n: found[n] for n in names}
+
+        ordered = list(counted.order_by("n", "id").values_list("id", "n"))
+        if not ordered:
+            raise CommandError("評価のあるユーザーがいません")
+        picks = {
+            "small": ordered[0],
+            "medium": ordered[len(ordered) // 2],
+            "large": ordered[-1],
+        }
+        # 同じユーザーを何度も測らない（人数が少ないとき）
+        users = {}
+        for label, pick in picks.items():
+            if pick not in users.values():
+                users[label] = pick
+        return users
+
+    def _run(self, backend, users, top_ns, only, options):
+        user_labels = {user_id: label for label, (user_id, _n) in users.items()}
+        user_ids = list(user_labels)
+        region_ids = [None] + list(MusicRegion.objects.values_list("id", flat=True))
+
+        self.stdout.write(
+            f"backend={options['backend']}  db={connection.vendor}  users="
+            + ", ".join(f"{label}({n:,} 件)" for label, (_id, n) in users.items())
+        )
+        results = {}
+        for name, func in _public_functions(only):
+            choices = _argument_choices(func, user_ids, region_ids, top_ns)
+            if choices is None:
+                self.stdout.write(f"{name}: 引数を組み立てられないので飛ばします")
+                continue
+            impl = getattr(backend, name, func)
+            keys = list(choices)
+            for values in itertools.product(*(choices[k] for k in keys)):
+                arguments = dict(zip(keys, values))
+                label = _case_label(name, arguments, user_labels)
+                results[label] = self._measure(impl, arguments, options)
+                r = results[label]
+                self.stdout.write(
+                    f"{label:<70} p50 {r['p50_ms']:>8.2f}  p95 {r['p95_ms']:>8.2f}  "
+                    f"max {r['max_ms']:>8.2f} ms  {r['rows']:>7,} 行  "
+                    f"{r['peak_kb']:>9,.0f} KB"
+                )
+        return results
+
+    def _measure(self, func, arguments, options):
+        for _ in range(options["warmup"]):
+            func(**arguments)
+
+        # メモリは別に1回だけ測る（tracemalloc を付けたままだと時間が伸びるため）
+        tracemalloc.start()
+        try:
+            rows = _count_rows(func(**arguments))
+            _current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        timings = []
+        for _ in range(options["repeat"]):
+            started = time.perf_counter()
+            func(**arguments)
+            timings.append((time.perf_counter() - started) * 1000)
+        return {
+            "p50_ms": round(statistics.median(timings), 3),
+            "p95_ms": round(_percentile(timings, 95), 3),
+            "max_ms": round(max(timings), 3),
+            "rows": rows,
+            "peak_kb": round(peak / 1024, 1),
+        }
+
+    def _compare(self, path, report, options):
+        try:
+            with open(path, encoding="utf-8") as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"基準のファイルを読めません: {path} ({e})")
+
+        if baseline.get("users") != report["users"]:
+            self.stdout.write(
+                self.style.WARNING(
+                    "基準とユーザー（評価の件数）が違います。データが変わっていると比べられません"
+                )
+            )
+
+        regressions = []
+        compared = 0
+        for label, result in report["results"].items():
+            old = baseline.get("results", {}).get(label)
+            if old is None:
+                continue
+            compared += 1
+            slower = result["p50_ms"] - old["p50_ms"]
+            if (
+                result["p50_ms"] > old["p50_ms"] * options["threshold"]
+                and slower >= options["min_ms"]
+            ):
+                regressions.append((label, old["p50_ms"], result["p50_ms"]))
+
+        self.stdout.write("")
+        self.stdout.write(f"基準（{path}）と {compared} 件を比べました")
+        for label, old_ms, new_ms in regressions:
+            self.stdout.write(
+                self.style.ERROR(
+                    f"悪化: {label}  {old_ms:.2f} → {new_ms:.2f} ms "
+                    f"(x{new_ms / old_ms:.2f})"
+                )
+            )
+        if regressions:
+            raise CommandError(
+                f"{len(regressions)} 件が基準より {options['threshold']} 倍を超えて遅くなりました"
+            )
+        self.stdout.write(self.style.SUCCESS("基準より遅くなったものはありません"))
@@ -0,0 +1,397 @@
+"""
+services.py が組み立てる SQL の実行計画（EXPLAIN）を一通り取り、基準と比べるコマンド。
+
+services.py の公開関数を、集計軸（creator_type / kind）× 地域の指定あり・なし ×
+採点の種類（好み度・カラオケ）× 件数の指定あり・なし（limit / 続きのページ）の
+組み合わせで実行し、発行した SELECT の実行計画を取る。実行計画は DB ごとに
+件数・コストなどデータ量で揺れる値を除いた形にそろえ、次のものに印を付ける。
+  full_scan : テーブル全体の走査（MySQL の type=ALL、SQLite の SCAN、PostgreSQL の Seq Scan）
+  filesort  : インデックスを使わない並べ替え（Using filesort / USE TEMP B-TREE FOR ORDER BY / Sort）
+  temporary : 一時テーブル（Using temporary / USE TEMP B-TREE FOR GROUP BY・DISTINCT / Materialize）
+
+結果は基準のファイル（既定 query_plans/<DB の種類>.json。リポジトリに入れておく）
+と比べ、SQL の形・実行計画・印が変わった組み合わせを差分つきで表示して
+失敗で終わる。インデックスやスキーマ、services.py の SQL を変えたときに
+本番に出す前に流し、意図した変化なら --update で基準を書き直してコミットする。
+
+基準のファイルが無いときは（--update 以外）失敗で終わる。
+  query_plans/sqlite.json : songs.tests の合成データ（下の使い方の generate_dataset）で
+                            取った基準。QueryPlanTests がテストのたびに比べる
+  query_plans/mysql.json  : 本番と同じ MySQL の基準。まだ入っていないので、MySQL の
+                            開発環境で同じ手順を流してコミットすること
+
+実行計画はデータの量と分布で変わるので、基準は manage.py generate_dataset で
+作った同じ大きさのデータで取ること。--analyze を付けると EXPLAIN ANALYZE の
+結果（実際の所要時間つき）も表示する（MySQL 8.0.18 以降・PostgreSQL。基準には入れない）。
+
+使い方:
+    python manage.py check_query_plans
+    python manage.py check_query_plans --update
+    python manage.py check_query_plans --only song_ranking --show
+    python manage.py check_query_plans --only artist_song_top_n --analyze
+    # 基準の取り直し（空のDBに songs.tests と同じ合成データを入れてから）
+    python manage.py generate_dataset --prefix base --seed 1 --users 2 \\
+        --artists 30 --songs 300 --ratings-per-user 200
+    python manage.py check_query_plans --user base_0 --update
+"""
+
+import datetime
+import difflib
+import inspect
+import itertools
+import json
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+
+from songs import services
+from songs.flight_recorder import explain_rows
+from songs.models import MusicRegion
+from songs.query_audit import fingerprint
+
+from .benchmark_rankings import _public_functions
+
+# 基準のファイルを置くディレクトリ（DB の種類ごとに1ファイル）
+PLAN_DIR = Path(settings.BASE_DIR) / "query_plans"
+
+# 引数に渡す値
+TOP_N = 5
+LIMIT = 200
+
+# call_song_ranking_page の after に渡す印（先頭ページの "next" に置き換える）
+NEXT_PAGE = "next"
+
+_PG_COSTS = re.compile(r"\s+\((?:cost|actual)[^)]*\)")
+_CTE_NAME = re.compile(r"(\w+)\s+AS\s*\(", re.IGNORECASE)
+_TABLE_ALIAS = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)\s+(?:AS\s+)?(\w+)", re.IGNORECASE)
+
+
+def _argument_choices(func, user_id, region_id):
+    """
+    関数の引数名から、回す値の候補を組み立てる。SQL が変わる引数だけを回す。
+    戻り値: {引数名: [値, ...]}（知らない必須引数があれば None）
+    """
+    choices = {}
+    for param in inspect.signature(func).parameters.values():
+        name = param.name
+        required = param.default is inspect.Parameter.empty
+        if name == "user_id":
+            choices[name] = [user_id]
+        elif name == "region_id":
+            choices[name] = [region_id, None]
+        elif name == "karaoke_mode":
+            choices[name] = [False, True]
+        elif name == "top_n":
+            choices[name] = [TOP_N]
+        elif name == "creator_type":
+            choices[name] = list(services._CREATOR_COLUMNS)
+        elif name == "kind":
+            choices[name] = list(services.RANKING_KINDS)
+        elif name == "limit":
+            choices[name] = [LIMIT] if required else [None, LIMIT]
+        elif name == "after":
+            choices[name] = [None, NEXT_PAGE]
+        elif required:
+            return None
+    return choices
+
+
+def _case_label(name, arguments):
+    parts = [name]
+    for key, value in arguments.items():
+        if key == "user_id":
+            continue
+        if key == "region_id":
+            value = "on" if value else "off"
+        elif key == "limit":
+            value = value or "off"
+        elif key == "after":
+            value = "next" if value else "first"
+        parts.append(f"{key}={value}")
+    return " ".join(parts)
+
+
+def _derived_names(sql):
+    """CTE（WITH 句）の名前と、それに付けた別名。これらを読むのは中間結果の走査。"""
+    names = set(_CTE_NAME.findall(sql))
+    names |= {alias for table, alias in _TABLE_ALIAS.findall(sql) if table in names}
+    return names
+
+
+def _is_select(sql):
+    return sql.lstrip().upper().startswith(("SELECT", "WITH"))
+
+
+def _capture(func, arguments):
+    """関数を実行し、発行した SELECT を [(sql, params), ...] で返す。"""
+    if arguments.get("after") == NEXT_PAGE:
+        first = func(**dict(arguments, after=None))
+        if not first.get("next"):
+            return None  # 1ページで収まるデータでは続きのページが無い
+        arguments = dict(arguments, after=first["next"])
+
+    statements = []
+
+    def wrapper(execute, sql, params, many, context):
+        if not many and _is_select(sql):
+            statements.append((sql, params))
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(wrapper):
+        func(**arguments)
+    return statements
+
+
+# ===== 実行計画をそろえる・印を付ける（DB ごと） =====
+
+
+def _mysql_plan(columns, rows, derived):
+    plan, flags = [], set()
+    for row in rows:
+        r = dict(zip(columns, row))
+        table = r.get("table") or ""
+        extra = r.get("Extra") or ""
+        plan.append(
+            f"{r.get('select_type')} {table} type={r.get('type')} "
+            f"key={r.get('key')} {extra}".rstrip()
+        )
+        # <derived2> などは CTE・サブクエリの結果なので全体を読むのが普通
+        if r.get("type") == "ALL" and not table.startswith("<") and table not in derived:
+            flags.add(f"full_scan:{table}")
+        if "Using filesort" in extra:
+            flags.add("filesort")
+        if "Using temporary" in extra:
+            flags.add("temporary")
+    return plan, flags
+
+
+def _sqlite_plan(columns, rows, derived):
+    plan, flags = [], set()
+    depth = {0: -1}
+    for node_id, parent, _notused, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        plan.append("  " * depth[node_id] + detail)
+        # (subquery-3) などは CTE・サブクエリの結果なので全体を読むのが普通
+        match = re.match(r"SCAN ([^(\s]\S*)", detail)
+        if match and "USING" not in detail and match.group(1) not in derived:
+            flags.add(f"full_scan:{match.group(1)}")
+        if "TEMP B-TREE FOR" in detail and "ORDER BY" in detail:
+            flags.add("filesort")
+        if re.search(r"TEMP B-TREE FOR (GROUP BY|DISTINCT)|^MATERIALIZE", detail):
+            flags.add("temporary")
+    return plan, flags
+
+
+def _postgresql_plan(columns, rows, derived):
+    plan, flags = [], set()
+    for (line,) in rows:
+        line = _PG_COSTS.sub("", line)
+        plan.append(line)
+        node = line.strip().removeprefix("->").strip()
+        match = re.match(r"(?:Parallel )?Seq Scan on (\S+)", node)
+        if match and match.group(1) not in derived:
+            flags.add(f"full_scan:{match.group(1)}")
+        if node.startswith(("Sort", "Incremental Sort")):
+            flags.add("filesort")
+        if node.startswith("Materialize"):
+            flags.add("temporary")
+    return plan, flags
+
+
+_PLAN_READERS = {
+    "mysql": _mysql_plan,
+    "sqlite": _sqlite_plan,
+    "postgresql": _postgresql_plan,
+}
+
+
+class Command(BaseCommand):
+    help = "services.py の SQL の実行計画を取り、基準（query_plans/）と比べる"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user",
+            default=None,
+            help="対象ユーザー名（省略時は評価の件数が最も多いユーザー）",
+        )
+        parser.add_argument(
+            "--only", default=None, help="関数名に含まれる文字列で絞る（カンマ区切り）"
+        )
+        parser.add_argument(
+            "--baseline",
+            default=None,
+            help="基準の JSON ファイル（既定 query_plans/<DB の種類>.json）",
+        )
+        parser.add_argument(
+            "--update", action="store_true", help="比べずに基準のファイルを書き直す"
+        )
+        parser.add_argument(
+            "--show", action="store_true", help="すべての実行計画を表示する"
+        )
+        parser.add_argument(
+            "--analyze",
+            action="store_true",
+            help="EXPLAIN ANALYZE の結果も表示する（SQL を実際に実行する）",
+        )
+
+    def handle(self, *args, **options):
+        reader = _PLAN_READERS.get(connection.vendor)
+        if reader is None:
+            raise CommandError(f"{connection.vendor} の実行計画には未対応です")
+        user, ratings = self._user(options["user"])
+        region_id = MusicRegion.objects.order_by("id").values_list("id", flat=True).first()
+        only = options["only"].split(",") if options["only"] else None
+        baseline_path = Path(
+            options["baseline"] or PLAN_DIR / f"{connection.vendor}.json"
+        )
+
+        self.stdout.write(
+            f"db={connection.vendor}  user={user.username}（{ratings:,} 件）  "
+            f"region={region_id}"
+        )
+        cases = self._run(reader, user.id, region_id, only, options)
+        report = {
+            "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "database": connection.vendor,
+            "ratings": ratings,
+            "cases": cases,
+        }
+
+        if options["update"]:
+            if only and baseline_path.exists():
+                # 一部だけ取り直したときは、残りの組み合わせは基準のまま残す
+                old = self._load(baseline_path)
+                report["cases"] = {**old.get("cases", {}), **cases}
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(baseline_path, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+                f.write("\n")
+            self.stdout.write(f"基準を書き直しました: {baseline_path}")
+            return
+        # 基準が無いまま通ると CI で何も確かめないことになるので失敗にする
+        # （--show / --analyze の表示は上で済んでいる）
+        if not baseline_path.exists():
+            raise CommandError(
+                f"基準のファイルがありません: {baseline_path}"
+                "（--update で作ってコミットする）"
+            )
+        self._compare(baseline_path, report)
+
+    def _user(self, username):
+        counted = User.objects.annotate(n=Count("rating"))
+        if username:
+            user = counted.filter(username=username).first()
+            if user is None:
+                raise CommandError(f"ユーザーが見つかりません: {username}")
+        else:
+            user = counted.filter(n__gt=0).order_by("-n", "id").first()
+            if user is None:
+                raise CommandError("評価のあるユーザーがいません")
+        return user, user.n
+
+    def _run(self, reader, user_id, region_id, only, options):
+        cases = {}
+        for name, func in _public_functions(only):
+            choices = _argument_choices(func, user_id, region_id)
+            if choices is None:
+                self.stdout.write(f"{name}: 引数を組み立てられないので飛ばします")
+                continue
+            keys = list(choices)
+            for values in itertools.product(*(choices[k] for k in keys)):
+                arguments = dict(zip(keys, values))
+                label = _case_label(name, arguments)
+                statements = _capture(func, arguments)
+                if statements is None:
+                    self.stdout.write(f"{label}: 続きのページが無いので飛ばします")
+                    continue
+                cases[label] = [
+                    self._plan(reader, sql, params, options) for sql, params in statements
+                ]
+                self._report(label, cases[label], options["show"])
+        return cases
+
+    def _plan(self, reader, sql, params, options):
+        columns, rows = explain_rows(sql, params)
+        plan, flags = reader(columns, rows, _derived_names(sql))
+        if options["analyze"]:
+            analyzed = explain_rows(sql, params, analyze=True)
+            if analyzed is None:
+                self.stdout.write(f"    （{connection.vendor} の EXPLAIN ANALYZE には未対応）")
+            else:
+                for row in analyzed[1]:
+                    self.stdout.write(f"    {' | '.join(str(v) for v in row)}")
+        return {"sql": fingerprint(sql), "plan": plan, "flags": sorted(flags)}
+
+    def _report(self, label, statements, show):
+        flags = sorted({f for s in statements for f in s["flags"]})
+        line = f"{label:<70} {len(statements):>2} 文"
+        if flags:
+            line += "  " + self.style.WARNING(", ".join(flags))
+        self.stdout.write(line)
+        if show:
+            for statement in statements:
+                for plan_line in statement["plan"]:
+                    self.stdout.write(f"    {plan_line}")
+                self.stdout.write("")
+
+    def _load(self, path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"基準のファイルを読めません: {path} ({e})")
+
+    def _compare(self, path, report):
+        baseline = self._load(path)
+        if baseline.get("ratings") != report["ratings"]:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"基準と評価の件数が違います（{baseline.get('ratings')} → "
+                    f"{report['ratings']}）。データが違うと実行計画も変わります"
+                )
+            )
+
+        old_cases = baseline.get("cases", {})
+        changed = []
+        for label, statements in report["cases"].items():
+            old = old_cases.get(label)
+            if old is None:
+                self.stdout.write(f"基準に無い組み合わせ: {label}")
+                continue
+            if old != statements:
+                changed.append(label)
+                self._show_diff(label, old, statements)
+        compared = sum(1 for label in report["cases"] if label in old_cases)
+
+        self.stdout.write("")
+        self.stdout.write(f"基準（{path}）と {compared} 件を比べました")
+        if changed:
+            raise CommandError(
+                f"{len(changed)} 件の実行計画が変わりました。"
+                "意図した変化なら --update で基準を書き直してください"
+            )
+        self.stdout.write(self.style.SUCCESS("実行計画の変化はありません"))
+
+    def _show_diff(self, label, old, new):
+        self.stdout.write("")
+        self.stdout.write(self.style.ERROR(f"変化: {label}"))
+        old_flags = {f for s in old for f in s["flags"]}
+        new_flags = {f for s in new for f in s["flags"]}
+        for flag in sorted(new_flags - old_flags):
+            self.stdout.write(self.style.ERROR(f"  増えた印: {flag}"))
+        for flag in sorted(old_flags - new_flags):
+            self.stdout.write(self.style.SUCCESS(f"  消えた印: {flag}"))
+        for i in range(max(len(old), len(new))):
+            before = old[i] if i < len(old) else {"sql": "", "plan": []}
+            after = new[i] if i < len(new) else {"sql": "", "plan": []}
+            if before["sql"] != after["sql"]:
+                self.stdout.write(f"  {i + 1} 文目の SQL が変わりました")
+            for line in difflib.unified_diff(
+                before["plan"], after["plan"], "基準", "今回", lineterm="", n=1
+            ):
+                self.stdout.write(f"  {line}")
@@ -0,0 +1,383 @@
+"""
+ランキング集計の実装（songs.rankings の RANKING_BACKENDS）を、
+services.py の SQL 版と突き合わせるコマンド（ゴールデンテスト）。
+
+地域 × 採点の種類 × top_n × 集計軸の全パターンで、行の並びまで含めて
+1行ずつ比べる。同点の曲の並び（UPPER(曲名) 順）や、同じ合計点の
+グループの並び（UPPER(名前) 順）が SQL 版と違えば不一致になる。
+SQL 版に ORDER BY が無い call_creator_top_n_multi だけは並びを比べない。
+*_top_n_multi は実装に無いので、songs.rankings と同じく実装の累積和から組み立てて比べる。
+4集計軸まとめての call_ranking_bundle と、全地域＋地域別まとめての
+*_by_region は、地域ごとの個別の関数（SQL 版）と突き合わせる。
+--backend sql ではこれだけを確かめる。
+
+並び順のキー（グループ・点数・UPPER(曲名) など）まで完全に同じ曲どうしは
+SQL 版でも順番が決まらない（同じ曲名の別の曲を同点で付けた場合など）。
+そうした行の並びは曲IDで揃え、通し番号もその順に振り直してから比べる。
+
+RANKING_BACKEND を切り替える前と、集計の実装を変更したときに実行する。
+
+使い方:
+    python manage.py check_rankings --backend numpy
+    python manage.py check_rankings --backend sql
+    python manage.py check_rankings --backend store --user pawaburo
+    python manage.py check_rankings --backend numpy --top-ns 1,3,5,10,15,20,30
+"""
+
+from decimal import Decimal
+from importlib import import_module
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from songs import services
+from songs.models import MusicRegion, Rating
+from songs.rankings import RANKING_BACKENDS
+
+# 食い違いを表示する最大件数（1パターンあたり）
+MAX_DIFF_LINES = 5
+
+
+def _normalize(value):
+    """
+    SQL 版と各実装で型が揺れる値（int / Decimal）を揃えて比べる。
+    DB によっては DECIMAL の SUM が float で返るので、小数3桁に丸めて比べる。
+    """
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, float):
+        value = round(Decimal(str(value)), 3)
+    if isinstance(value, (int, Decimal)):
+        return Decimal(value).normalize()
+    return value
+
+
+def _top_n_multi(backend, user_id, region_id, kind, top_ns, karaoke_mode):
+    """
+    songs.rankings と同じく、実装の累積和（call_group_prefix_sums）から
+    call_artist_top_n_multi / call_creator_top_n_multi の行を組み立てる。
+    """
+    groups = backend.call_group_prefix_sums(
+        user_id, region_id, kind, karaoke_mode=karaoke_mode
+    )
+    return services.rows_from_prefix_sums(
+        kind, groups, top_ns, with_order=kind == "artist"
+    )
+
+
+def _normalize_rows(rows, sort_key=None):
+    rows = [{k: _normalize(v) for k, v in row.items()} for row in rows]
+    if sort_key:
+        rows.sort(key=sort_key)
+    return rows
+
+
+def _normalize_prefix_sums(groups):
+    return [
+        {**_normalize_rows([g])[0], "prefix": [_normalize(v) for v in g["prefix"]]}
+        for g in groups
+    ]
+
+
+# 関数ごとの (並び順を決めるキー, 並び順で振られる通し番号の列)
+_TIE_KEYS = {
+    "call_artist_song_top_n": (
+        lambda r: (r["artist_id"], r["score"], r["song_title"].upper()),
+        "order_artist",
+    ),
+    "call_artist_insufficient_songs": (
+        lambda r: (r["score"], r["artist_name"].upper(), r["song_title"].upper()),
+        "order_artist",
+    ),
+    "call_creator_song_top_n": (
+        lambda r: (r["creator"], r["score"], r["song_title"].upper()),
+        "order_creator",
+    ),
+    "call_creator_insufficient_songs": (
+        lambda r: (r["score"], r["artist_name"].upper(), r["song_title"].upper()),
+        None,
+    ),
+}
+
+
+def _settle_ties(name, rows):
+    """
+    並び順のキーが同じ連続した行を曲ID順に並べ直し、通し番号を振り直す
+    （SQL 版でも順番が決まらない部分を比較の対象から外すため）。
+    """
+    tie_key, order_field = _TIE_KEYS[name]
+    result = []
+    run = []
+    for row in rows + [None]:
+        if run and (row is None or tie_key(row) != tie_key(run[0])):
+            if len(run) > 1:
+                orders = sorted(r[order_field] for r in run) if order_field else None
+                run.sort(key=lambda r: r["song_id"])
+                if orders:
+                    run = [{**r, order_field: o} for r, o in zip(run, orders)]
+            result.extend(run)
+            run = []
+        if row is not None:
+            run.append(row)
+    return result
+
+
+def _parse_top_ns(value):
+    try:
+        return services._validate_top_ns(value.split(","))
+    except ValueError:
+        raise CommandError(f"--top-ns が不正です: {value}")
+
+
+class Command(BaseCommand):
+    help = "ランキング集計の実装を services.py の SQL 版と1行ずつ突き合わせる"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--backend",
+            required=True,
+            choices=sorted(RANKING_BACKENDS),
+            help="突き合わせる実装",
+        )
+        parser.add_argument(
+            "--user", default=None, help="対象ユーザー名（省略時は評価のある全ユーザー）"
+        )
+        parser.add_argument(
+            "--top-ns",
+            default=",".join(str(n) for n in services.TOP_NS),
+            help="比べる top_n（カンマ区切り）",
+        )
+
+    def handle(self, *args, **options):
+        backend = import_module(RANKING_BACKENDS[options["backend"]])
+        top_ns = _parse_top_ns(options["top_ns"])
+
+        if options["user"]:
+            try:
+                users = [User.objects.get(username=options["user"])]
+            except User.DoesNotExist:
+                raise CommandError(f"ユーザーが見つかりません: {options['user']}")
+        else:
+            user_ids = Rating.objects.values_list("user_id", flat=True).distinct()
+            users = list(User.objects.filter(id__in=user_ids).order_by("id"))
+
+        mismatches = 0
+        for user in users:
+            if options["backend"] != "sql":
+                mismatches += self._check_user(backend, user, top_ns)
+            mismatches += self._check_bundle(backend, user, top_ns)
+        if mismatches:
+            raise CommandError(f"SQL 版と一致しないパターンが {mismatches} 件あります")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{options['backend']}: {len(users)} ユーザー分、SQL 版と全パターン一致しました"
+            )
+        )
+
+    def _compare(self, label, expected, actual):
+        if expected == actual:
+            return 0
+        self.stdout.write(
+            self.style.ERROR(
+                f"不一致: {label}（SQL {len(expected)} 行 / 実装 {len(actual)} 行）"
+            )
+        )
+        shown = 0
+        for i, (e, a) in enumerate(zip(expected, actual)):
+            if e != a:
+                self.stdout.write(f"  {i}行目 SQL={e}")
+                self.stdout.write(f"  {i}行目 実装={a}")
+                shown += 1
+                if shown >= MAX_DIFF_LINES:
+                    break
+        return 1
+
+    def _check_user(self, backend, user, top_ns):
+        region_ids = [None] + list(MusicRegion.objects.values_list("id", flat=True))
+        creator_key = lambda r: str(r["creator"])  # noqa: E731
+        mismatches = 0
+
+        for region_id in region_ids:
+            for karaoke_mode in (False, True):
+                scope = f"user={user.username} region={region_id} karaoke={karaoke_mode}"
+
+                for kind in services.RANKING_KINDS:
+                    mismatches += self._compare(
+                        f"call_group_prefix_sums {kind} {scope}",
+                        _normalize_prefix_sums(
+                            services.call_group_prefix_sums(
+                                user.id, region_id, kind, karaoke_mode=karaoke_mode
+                            )
+                        ),
+                        _normalize_prefix_sums(
+                            backend.call_group_prefix_sums(
+                                user.id, region_id, kind, karaoke_mode=karaoke_mode
+                            )
+                        ),
+                    )
+
+                mismatches += self._compare(
+                    f"call_artist_top_n_multi {scope}",
+                    _normalize_rows(
+                        services.call_artist_top_n_multi(
+                            user.id, region_id, top_ns, karaoke_mode=karaoke_mode
+                        )
+                    ),
+                    _normalize_rows(
+                        _top_n_multi(
+                            backend, user.id, region_id, "artist", top_ns, karaoke_mode
+                        )
+                    ),
+                )
+                for creator_type in services._CREATOR_COLUMNS:
+                    # SQL 版は ORDER BY を持たないので並びは比べない
+                    mismatches += self._compare(
+                        f"call_creator_top_n_multi {creator_type} {scope}",
+                        _normalize_rows(
+                            services.call_creator_top_n_multi(
+                                user.id,
+                                region_id,
+                                creator_type,
+                                top_ns,
+                                karaoke_mode=karaoke_mode,
+                            ),
+                            creator_key,
+                        ),
+                        _normalize_rows(
+                            _top_n_multi(
+                                backend,
+                                user.id,
+                                region_id,
+                                creator_type,
+                                top_ns,
+                                karaoke_mode,
+                            ),
+                            creator_key,
+                        ),
+                    )
+
+                for top_n in top_ns:
+                    for name in ("call_artist_song_top_n", "call_artist_insufficient_songs"):
+                        mismatches += self._compare(
+                            f"{name} top_n={top_n} {scope}",
+                            _normalize_rows(
+                                _settle_ties(
+                                    name,
+                                    getattr(services, name)(
+                                        user.id, top_n, region_id, karaoke_mode=karaoke_mode
+                                    ),
+                                )
+                            ),
+                            _normalize_rows(
+                                _settle_ties(
+                                    name,
+                                    getattr(backend, name)(
+                                        user.id, top_n, region_id, karaoke_mode=karaoke_mode
+                                    ),
+                                )
+                            ),
+                        )
+                    for creator_type in services._CREATOR_COLUMNS:
+                        for name in (
+                            "call_creator_song_top_n",
+                            "call_creator_insufficient_songs",
+                        ):
+                            mismatches += self._compare(
+                                f"{name} {creator_type} top_n={top_n} {scope}",
+                                _normalize_rows(
+                                    _settle_ties(
+                                        name,
+                                        getattr(services, name)(
+                                            user.id,
+                                            top_n,
+                                            region_id,
+                                            creator_type,
+                                            karaoke_mode=karaoke_mode,
+                                        ),
+                                    )
+                                ),
+                                _normalize_rows(
+                                    _settle_ties(
+                                        name,
+                                        getattr(backend, name)(
+                                            user.id,
+                                            top_n,
+                                            region_id,
+                                            creator_type,
+                                            karaoke_mode=karaoke_mode,
+                                        ),
+                                    )
+                                ),
+                            )
+        return mismatches
+
+    def _check_bundle(self, backend, user, top_ns):
+        region_ids = [None] + list(MusicRegion.objects.values_list("id", flat=True))
+        mismatches = 0
+
+        for karaoke_mode in (False, True):
+            for kind in services.RANKING_KINDS:
+                by_region = backend.call_group_prefix_sums_by_region(
+                    user.id, kind, karaoke_mode=karaoke_mode
+                )
+                for region_id in region_ids:
+                    mismatches += self._compare(
+                        f"call_group_prefix_sums_by_region[{region_id}] {kind} "
+                        f"user={user.username} karaoke={karaoke_mode}",
+                        _normalize_prefix_sums(
+                            services.call_group_prefix_sums(
+                                user.id, region_id, kind, karaoke_mode=karaoke_mode
+                            )
+                        ),
+                        _normalize_prefix_sums(by_region.get(region_id, [])),
+                    )
+
+        for top_n in top_ns:
+            by_region = backend.call_ranking_bundle_by_region(user.id, top_n)
+            for region_id in region_ids:
+                single = backend.call_ranking_bundle(user.id, top_n, region_id)
+                batched = by_region.get(region_id) or services.empty_ranking_bundle()
+                for label, bundle in (
+                    ("call_ranking_bundle", single),
+                    (f"call_ranking_bundle_by_region[{region_id}]", batched),
+                ):
+                    mismatches += self._check_bundle_parts(
+                        label, bundle, user, top_n, region_id
+                    )
+        return mismatches
+
+    def _check_bundle_parts(self, label, bundle, user, top_n, region_id):
+        mismatches = 0
+        for (kind, karaoke_mode), part in bundle.items():
+            scope = (
+                f"{kind} top_n={top_n} user={user.username} "
+                f"region={region_id} karaoke={karaoke_mode}"
+            )
+            if kind == "artist":
+                calls = (
+                    ("call_artist_song_top_n", "top", ()),
+                    ("call_artist_insufficient_songs", "insufficient", ()),
+                )
+            else:
+                calls = (
+                    ("call_creator_song_top_n", "top", (kind,)),
+                    ("call_creator_insufficient_songs", "insufficient", (kind,)),
+                )
+            for name, key, extra in calls:
+                mismatches += self._compare(
+                    f"{label}[{key}] {scope}",
+                    _normalize_rows(
+                        _settle_ties(
+                            name,
+                            getattr(services, name)(
+                                user.id,
+                                top_n,
+                                region_id,
+                                *extra,
+                                karaoke_mode=karaoke_mode,
+                            ),
+                        )
+                    ),
+                    _normalize_rows(_settle_ties(name, part[key])),
+                )
+        return mismatches
@@ -0,0 +1,33 @@
+"""
+曲目録の変更履歴（CatalogChange）を詰めるコマンド。
+
+Song.save() などのたびに1行ずつ増えるので、cron で1日1回くらい回す。
+古い履歴のうち同じ行のもっと新しい履歴があるものだけを消すので、
+/api/changes がどの since から返す差分も変わらない（songs.catalog_changes.compact）。
+
+使い方:
+    python manage.py compact_catalog_changes
+    python manage.py compact_catalog_changes --days 7
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from songs import catalog_changes
+
+
+class Command(BaseCommand):
+    help = "曲目録の変更履歴のうち、同じ行の新しい履歴がある古いものを消す"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=30,
+            help="これより新しい履歴は残す（日数、既定 30）",
+        )
+
+    def handle(self, *args, **options):
+        if options["days"] < 0:
+            raise CommandError("--days は 0 以上で指定してください")
+        deleted = catalog_changes.compact(options["days"])
+        self.stdout.write(f"変更履歴を {deleted} 件消しました")
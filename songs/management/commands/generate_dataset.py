@@ -0,0 +1,414 @@
+"""
+負荷試験用の合成データ（ユーザー・歌手・曲・評価など）を作る開発用コマンド。
+
+fixtures には歌手と曲しか無く評価が1件も無いので、ランキングの重いクエリを
+本番相当の件数で測れない。ここでは乱数の種から毎回同じ中身を作り、
+bulk_create でまとめて入れる（1千万件の評価でも数分で入る）。
+
+  - 歌手は既存の MusicRegion に偏りを付けて振り分ける（地域が無ければ作る）
+  - 歌手ごとに主名義を作り、一部には別名義（ArtistCredit）と別表記（ArtistAlias）も付ける
+  - 曲の作詞/作曲者は少数の人に偏らせ（Zipf 分布）、年は最近ほど多くする
+  - 評価はよく聴く歌手ほど多く付け、点数は歌手ごと・ユーザーごとに偏らせる。
+    カラオケ採点は一部の曲にだけ入れ、カラオケ採点だけの行も混ぜる
+  - ArtistYearPreference（年表ヒートマップの好き度）も少し入れる（歌手の2%ほど）
+
+名前はすべて --prefix で始まる。同じ prefix のデータが既にあれば止まるので、
+作り直すときは別の prefix を使うか、空のDBで実行すること。
+bulk_create はシグナルを通らないので、RANKING_BACKEND=store のときは
+実行後に manage.py rebuild_rankings で集計テーブルを作ること。
+
+使い方:
+    python manage.py generate_dataset --users 10 --artists 2000 --songs 50000
+    python manage.py generate_dataset --users 1000 --artists 20000 --songs 200000 \\
+        --ratings-per-user 10000 --seed 42
+"""
+
+import random
+import time
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from songs import ranking_cache, ranking_store
+from songs.models import (
+    Artist,
+    ArtistAlias,
+    ArtistCredit,
+    ArtistYearPreference,
+    MusicRegion,
+    Rating,
+    Song,
+)
+from songs.utils import normalize
+
+# 地域が1件も無いときに作るもの（code, name, 歌手の割合の重み）
+DEFAULT_REGIONS = [("JP", "邦楽", 6), ("EN", "洋楽", 3), ("KR", "K-POP", 1)]
+
+# 曲名・人名の材料。UPPER() の並びが効くように大文字小文字とかなを混ぜる
+TITLE_WORDS = [
+    "あの日", "さくら", "ひかり", "夜空", "Love", "love", "Dream", "sunrise",
+    "Blue", "ナミダ", "君へ", "Summer", "winter", "風", "メロディー", "Star",
+    "はじまり", "Hello", "good-bye", "未来", "Rain", "HOME", "歌", "Tokyo",
+]
+FAMILY_NAMES = ["佐藤", "鈴木", "高橋", "田中", "伊藤", "渡辺", "山本", "中村", "Smith", "Lee"]
+GIVEN_NAMES = ["太郎", "花子", "健", "由美", "翔", "美咲", "John", "Anna", "Min", "Ken"]
+
+# 年の範囲（最近ほど多くする）
+YEAR_MIN, YEAR_MAX = 1960, 2025
+
+
+def _zipf_cum_weights(n, s=1.1):
+    """1位が一番多い Zipf 分布の累積重み（random.choices の cum_weights 用）。"""
+    total = 0.0
+    cum = []
+    for i in range(n):
+        total += 1.0 / (i + 1) ** s
+        cum.append(total)
+    return cum
+
+
+def _clamp(value, low, high):
+    return max(low, min(high, value))
+
+
+class Command(BaseCommand):
+    help = "負荷試験用の合成データを作る（開発用）"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10, help="ユーザー数（既定10）")
+        parser.add_argument("--artists", type=int, default=2000, help="歌手数（既定2000）")
+        parser.add_argument("--songs", type=int, default=50000, help="曲数（既定50000）")
+        parser.add_argument(
+            "--ratings-per-user",
+            type=int,
+            default=3000,
+            help="1ユーザーあたりの評価数（既定3000。曲数の8割が上限）",
+        )
+        parser.add_argument("--seed", type=int, default=0, help="乱数の種（既定0）")
+        parser.add_argument(
+            "--prefix", default="synth", help="作る名前の先頭に付ける文字列（既定 synth）"
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=5000, help="bulk_create の1回の件数（既定5000）"
+        )
+
+    def handle(self, *args, **options):
+        for name in ("users", "artists", "songs", "batch_size"):
+            if options[name] < 1:
+                raise CommandError(f"--{name.replace('_', '-')} は 1 以上にしてください")
+        if options["ratings_per_user"] < 0:
+            raise CommandError("--ratings-per-user は 0 以上にしてください")
+
+        self.prefix = options["prefix"]
+        self.batch_size = options["batch_size"]
+        self.rng = random.Random(options["seed"])
+
+        if (
+            User.objects.filter(username__startswith=f"{self.prefix}_").exists()
+            or Artist.objects.filter(name__startswith=f"{self.prefix} ").exists()
+        ):
+            raise CommandError(
+                f"prefix '{self.prefix}' のデータが既にあります。"
+                "別の --prefix を指定するか、空のDBで実行してください"
+            )
+
+        started = time.perf_counter()
+        regions = self._regions()
+        artists = self._artists(options["artists"], regions)
+        songs = self._songs(options["songs"], artists)
+        users = self._users(options["users"])
+        ratings = self._ratings(users, artists, songs, options["ratings_per_user"])
+        prefs = self._year_preferences(users, artists)
+
+        # bulk_create はシグナルを通らないので、ランキングのキャッシュはここで捨てる
+        ranking_cache.bump_catalog_version()
+        for user_id in users:
+            ranking_cache.bump_user_version(user_id)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"完了: ユーザー {len(users):,} / 歌手 {len(artists):,} / "
+                f"曲 {len(songs):,} / 評価 {ratings:,} / 年の好き度 {prefs:,} 件 "
+                f"（{time.perf_counter() - started:.1f} 秒）"
+            )
+        )
+        if ranking_store.is_enabled():
+            self.stdout.write(
+                "RANKING_BACKEND=store です。manage.py rebuild_rankings を実行してください"
+            )
+
+    # ===== 作る順に =====
+
+    def _bulk(self, model, objs):
+        with transaction.atomic():
+            model.objects.bulk_create(objs, batch_size=self.batch_size)
+
+    def _regions(self):
+        """(地域ID, 重み) のリスト。既存の地域は先頭ほど歌手を多くする。"""
+        regions = list(MusicRegion.objects.order_by("id").values_list("id", flat=True))
+        if not regions:
+            for code, name, _weight in DEFAULT_REGIONS:
+                MusicRegion.objects.get_or_create(code=code, defaults={"name": name})
+            return [
+                (MusicRegion.objects.get(code=code).id, weight)
+                for code, _name, weight in DEFAULT_REGIONS
+            ]
+        return [(region_id, len(regions) - i) for i, region_id in enumerate(regions)]
+
+    def _artists(self, count, regions):
+        """
+        歌手・名義・別表記を作る。
+        戻り値: 歌手ごとの dict のリスト {id, credit_ids, bias}（人気順）
+        """
+        region_ids = [r for r, _w in regions]
+        weights = [w for _r, w in regions]
+        width = len(str(count))
+
+        objs = []
+        for i in range(count):
+            name = f"{self.prefix} {self.rng.choice(TITLE_WORDS)} {i:0{width}d}"
+            objs.append(
+                Artist(
+                    name=name,
+                    format_name=normalize(name),
+                    region_id=self.rng.choices(region_ids, weights)[0],
+                )
+            )
+        self._bulk(Artist, objs)
+        # MySQL の bulk_create は ID を返さないので、名前で引き直す
+        ids = dict(
+            Artist.objects.filter(name__startswith=f"{self.prefix} ").values_list(
+                "name", "id"
+            )
+        )
+
+        credits = []
+        aliases = []
+        artists = []
+        for obj in objs:
+            artist_id = ids[obj.name]
+            credits.append(
+                ArtistCredit(
+                    artist_id=artist_id,
+                    name=obj.name,
+                    format_name=obj.format_name,
+                    is_primary=True,
+                )
+            )
+            if self.rng.random() < 0.1:
+                credit_name = f"{obj.name} feat. {self.rng.choice(GIVEN_NAMES)}"
+                credits.append(
+                    ArtistCredit(
+                        artist_id=artist_id,
+                        name=credit_name,
+                        format_name=normalize(credit_name),
+                    )
+                )
+            if self.rng.random() < 0.15:
+                alias_name = obj.name.upper()
+                if alias_name == obj.name:
+                    alias_name = f"{obj.name}（別表記）"
+                aliases.append(
+                    ArtistAlias(
+                        artist_id=artist_id,
+                        name=alias_name,
+                        format_name=normalize(alias_name),
+                        kind=self.rng.choice(ArtistAlias.KIND_CHOICES)[0],
+                    )
+                )
+            # 歌手ごとの点数の付きやすさ（好きな歌手ほど高い）
+            artists.append(
+                {"id": artist_id, "credit_ids": [], "bias": self.rng.gauss(0, 10)}
+            )
+        self._bulk(ArtistCredit, credits)
+        self._bulk(ArtistAlias, aliases)
+
+        index_of = {a["id"]: i for i, a in enumerate(artists)}
+        for artist_id, credit_id in (
+            ArtistCredit.objects.filter(artist_id__in=ids.values())
+            .order_by("artist_id", "-is_primary", "id")
+            .values_list("artist_id", "id")
+        ):
+            artists[index_of[artist_id]]["credit_ids"].append(credit_id)
+
+        self.stdout.write(
+            f"歌手 {len(artists):,} 件（名義 {len(credits):,} / 別表記 {len(aliases):,}）"
+        )
+        return artists
+
+    def _creator_pool(self, size):
+        return [
+            f"{self.rng.choice(FAMILY_NAMES)}{self.rng.choice(GIVEN_NAMES)}{i}"
+            for i in range(size)
+        ]
+
+    def _songs(self, count, artists):
+        """
+        曲を作る。人気の歌手ほど曲を多くする。
+        戻り値: [(song_id, 歌手の番号), ...]
+        """
+        artist_cum = _zipf_cum_weights(len(artists), s=0.8)
+        lyricists = self._creator_pool(max(len(artists) // 2, 1))
+        composers = self._creator_pool(max(len(artists) // 2, 1))
+        lyricist_cum = _zipf_cum_weights(len(lyricists))
+        composer_cum = _zipf_cum_weights(len(composers))
+        artist_indexes = range(len(artists))
+
+        objs = []
+        owners = []
+        for i in range(count):
+            a = self.rng.choices(artist_indexes, cum_weights=artist_cum)[0]
+            credit_ids = artists[a]["credit_ids"]
+            # 別名義のある歌手は2割の曲をそちらで出す
+            credit_id = credit_ids[0]
+            if len(credit_ids) > 1 and self.rng.random() < 0.2:
+                credit_id = credit_ids[1]
+            title = (
+                f"{self.rng.choice(TITLE_WORDS)}{self.rng.choice(TITLE_WORDS)} {i}"
+            )
+            roll = self.rng.random()
+            is_cover = None if roll < 0.02 else roll < 0.07
+            lyricist = None
+            composer = None
+            if self.rng.random() < 0.8:
+                lyricist = self.rng.choices(lyricists, cum_weights=lyricist_cum)[0]
+            if self.rng.random() < 0.8:
+                composer = self.rng.choices(composers, cum_weights=composer_cum)[0]
+            year = None
+            if self.rng.random() < 0.9:
+                year = _clamp(
+                    YEAR_MAX - int(abs(self.rng.gauss(0, 15))), YEAR_MIN, YEAR_MAX
+                )
+            objs.append(
+                Song(
+                    title=title,
+                    format_title=normalize(title),
+                    artist_id=artists[a]["id"],
+                    credit_id=credit_id,
+                    is_cover=is_cover,
+                    lyricist=lyricist,
+                    composer=composer,
+                    year=year,
+                )
+            )
+            owners.append(a)
+            if len(objs) >= self.batch_size:
+                self._bulk(Song, objs)
+                objs = []
+        self._bulk(Song, objs)
+
+        index_of = {a["id"]: i for i, a in enumerate(artists)}
+        songs = [
+            (song_id, index_of[artist_id])
+            for song_id, artist_id in Song.objects.filter(
+                artist_id__in=index_of
+            )
+            .order_by("id")
+            .values_list("id", "artist_id")
+        ]
+        self.stdout.write(f"曲 {len(songs):,} 件")
+        return songs
+
+    def _users(self, count):
+        width = len(str(count))
+        # 合成ユーザーではログインさせないので、ハッシュ計算の要らない無効パスワードにする
+        password = make_password(None)
+        self._bulk(
+            User,
+            [
+                User(username=f"{self.prefix}_{i:0{width}d}", password=password)
+                for i in range(count)
+            ],
+        )
+        return list(
+            User.objects.filter(username__startswith=f"{self.prefix}_")
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+
+    def _pick_songs(self, songs_by_artist, artist_cum, count, total):
+        """よく聴く歌手ほど多く選ぶ（重複なし）。"""
+        if count >= total // 2:
+            return self.rng.sample(range(total), count)
+        picked = set()
+        artist_indexes = range(len(songs_by_artist))
+        while len(picked) < count:
+            for a in self.rng.choices(
+                artist_indexes, cum_weights=artist_cum, k=count - len(picked)
+            ):
+                if songs_by_artist[a]:
+                    picked.add(self.rng.choice(songs_by_artist[a]))
+        return list(picked)
+
+    def _ratings(self, users, artists, songs, per_user):
+        per_user = min(per_user, len(songs) * 8 // 10)
+        songs_by_artist = [[] for _ in artists]
+        for i, (_song_id, a) in enumerate(songs):
+            songs_by_artist[a].append(i)
+        # 曲の多さとは別に、ユーザーごとに聴く歌手の偏りを付ける
+        artist_cum = _zipf_cum_weights(len(artists), s=1.0)
+
+        created = 0
+        started = time.perf_counter()
+        objs = []
+        for n, user_id in enumerate(users, start=1):
+            user_bias = self.rng.gauss(70, 8)
+            karaoke_ratio = self.rng.uniform(0.1, 0.5)
+            for i in self._pick_songs(songs_by_artist, artist_cum, per_user, len(songs)):
+                song_id, a = songs[i]
+                score = _clamp(
+                    round(self.rng.gauss(user_bias + artists[a]["bias"], 12)), 0, 100
+                )
+                karaoke_score = None
+                if self.rng.random() < karaoke_ratio:
+                    value = _clamp(self.rng.gauss(80 + (score - 70) * 0.2, 6), 50, 100)
+                    karaoke_score = Decimal(f"{value:.3f}")
+                    # カラオケ採点だけ付けた曲（API の update_score と同じ形）
+                    if self.rng.random() < 0.05:
+                        score = None
+                objs.append(
+                    Rating(
+                        user_id=user_id,
+                        song_id=song_id,
+                        score=score,
+                        karaoke_score=karaoke_score,
+                    )
+                )
+                if len(objs) >= self.batch_size:
+                    self._bulk(Rating, objs)
+                    created += len(objs)
+                    objs = []
+            if n % 10 == 0 or n == len(users):
+                self.stdout.write(
+                    f"評価 {created + len(objs):,} 件（ユーザー {n:,}/{len(users):,}、"
+                    f"{time.perf_counter() - started:.1f} 秒）"
+                )
+        self._bulk(Rating, objs)
+        return created + len(objs)
+
+    def _year_preferences(self, users, artists):
+        """ユーザーごとに歌手の2%ほどへ、数年ぶんの好き度を付ける。"""
+        created = 0
+        objs = []
+        for user_id in users:
+            for a in self.rng.sample(range(len(artists)), max(len(artists) // 50, 1)):
+                start = self.rng.randint(YEAR_MIN, YEAR_MAX)
+                end = min(start + self.rng.randint(1, 5), YEAR_MAX + 1)
+                for year in range(start, end):
+                    objs.append(
+                        ArtistYearPreference(
+                            user_id=user_id,
+                            artist_id=artists[a]["id"],
+                            year=year,
+                            score=self.rng.randint(1, 4),
+                        )
+                    )
+            if len(objs) >= self.batch_size:
+                self._bulk(ArtistYearPreference, objs)
+                created += len(objs)
+                objs = []
+        self._bulk(ArtistYearPreference, objs)
+        return created + len(objs)
@@ -0,0 +1,478 @@
+"""
+手元で起動したサーバーに、実際の使われ方に近い混ぜ方でリクエストを送る負荷試験。
+
+複数のユーザーでログインし、スレッドごとに1本の接続（keep-alive）で
+MIX の重みに従ってリクエストを選んで送り続ける。
+  - ランキング（地域・top_n・カラオケを変える）と「もっと見る」
+  - 全曲ランキング・歌手検索の続きの行
+  - 曲一覧の検索
+  - 好み度の更新（update_rating_view）
+  - 歌手×年ヒートマップの一括保存
+  - API の好み度更新（update_score。トークン認証）
+エンドポイントごとのスループット・所要時間のパーセンタイル・エラー率と、
+Server-Timing ヘッダ（songs.instrumentation）から読んだ SQL の件数の合計を出す
+（件数はサーバー側が SERVER_TIMING=True のときだけ。既定は DEBUG のときだけ付く）。
+
+--concurrency に 1,2,4,8 のように複数の値を渡すと、並列数を上げながら
+同じ時間ずつ流し、並列数を上げてもスループットが伸びなくなったところ
+（ワーカーが詰まり始めたところ）を示す。本番（PythonAnywhere）は
+ワーカー1つなので、--concurrency 1,2,4 あたりで詰まり方を見る。
+
+ログインは --password があればログイン画面から行い、無ければサーバーと
+同じ DB にセッションを直接作る（generate_dataset のユーザーはパスワードが
+無いため）。後者はサーバーがこのコマンドと同じ設定・同じ DB で動いているときだけ使える。
+書き込みも送るので、本番の DB に向けて流さないこと。
+generate_dataset で作ったユーザー（既定 synth_*）で流す。
+
+使い方:
+    python manage.py runserver --noreload &
+    python manage.py load_test --duration 30 --concurrency 1,2,4,8
+    python manage.py load_test --url http://127.0.0.1:8000 --users synth_0,synth_1 --output load.json
+    python manage.py load_test --only ranking,song_list --concurrency 4
+"""
+
+import datetime
+import http.client
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from http.cookies import SimpleCookie
+from importlib import import_module
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from rest_framework.authtoken.models import Token
+
+from songs.models import Artist, MusicRegion, Rating, Song
+
+# Server-Timing の db の desc（"12 queries"）
+_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+_CSRF_INPUT = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+TOP_NS = (5, 10, 20)
+SEARCH_WORDS = ("a", "e", "love", "the", "night", "1")
+
+# 並列数を上げてもスループットがこの割合しか伸びなければ「詰まった」とみなす
+SATURATION_GAIN = 1.1
+
+
+# ===== 送るリクエスト（名前, 重み, 組み立て関数） =====
+# 組み立て関数は (method, path, body, headers) を返す。body は dict（フォーム）か
+# bytes（JSON）。rng は各スレッドの random.Random、data は _UserData。
+
+
+def _region(rng, data):
+    return rng.choice(data.region_ids + [""])
+
+
+def _ranking(rng, data):
+    params = {"region_id": _region(rng, data), "top_n": rng.choice(TOP_NS)}
+    if rng.random() < 0.3:
+        params["karaoke"] = 1
+    return "GET", "/ranking/?" + urlencode(params), None, {}
+
+
+def _ranking_more(rng, data):
+    params = {
+        "kind": rng.choice(("artist", "lyricist", "composer", "year")),
+        "parent_offset": rng.choice((20, 40, 60)),
+        "region_id": _region(rng, data),
+        "top_n": rng.choice(TOP_NS),
+    }
+    return "GET", "/ranking/more/?" + urlencode(params), None, {}
+
+
+def _song_ranking(rng, data):
+    params = {"region_id": _region(rng, data)}
+    if rng.random() < 0.3:
+        params["karaoke"] = 1
+    return "GET", "/song_ranking/?" + urlencode(params), None, {}
+
+
+def _song_ranking_rows(rng, data):
+    params = {"offset": rng.choice((200, 400, 600)), "region_id": _region(rng, data)}
+    return "GET", "/song_ranking/rows/?" + urlencode(params), None, {}
+
+
+def _artist_search_rows(rng, data):
+    return "GET", f"/artist_search/rows/?offset={rng.choice((200, 400))}", None, {}
+
+
+def _song_list(rng, data):
+    return "GET", "/songs/?" + urlencode({"q": rng.choice(SEARCH_WORDS)}), None, {}
+
+
+def _update_rating(rng, data):
+    body = {"song_id": rng.choice(data.song_ids), "score": rng.randint(0, 100)}
+    return "POST", "/update-rating/", body, {}
+
+
+def _heatmap_bulk_save(rng, data):
+    artist_ids = rng.sample(data.artist_ids, min(5, len(data.artist_ids)))
+    items = [
+        {"artist_id": artist_id, "year": year, "score": rng.randint(0, 4)}
+        for artist_id in artist_ids
+        for year in range(2000, 2010)
+    ]
+    body = json.dumps({"items": items}).encode()
+    headers = {"Content-Type": "application/json"}
+    return "POST", "/api/artist_year_heatmap/bulk_save/", body, headers
+
+
+def _api_update_score(rng, data):
+    body = {"song_id": rng.choice(data.song_ids), "score": rng.randint(0, 100)}
+    headers = {"Authorization": f"Token {data.token}"}
+    return "POST", "/api/ratings/score/update", body, headers
+
+
+MIX = [
+    ("ranking", 20, _ranking),
+    ("ranking_more", 10, _ranking_more),
+    ("song_ranking", 10, _song_ranking),
+    ("song_ranking_rows", 8, _song_ranking_rows),
+    ("artist_search_rows", 5, _artist_search_rows),
+    ("song_list", 15, _song_list),
+    ("update_rating", 15, _update_rating),
+    ("heatmap_bulk_save", 5, _heatmap_bulk_save),
+    ("api_update_score", 12, _api_update_score),
+]
+
+
+class _UserData:
+    """リクエストを組み立てるのに使う、ユーザーごとの値。"""
+
+    def __init__(self, user, region_ids, artist_ids):
+        self.user = user
+        self.region_ids = region_ids
+        self.artist_ids = artist_ids
+        self.song_ids = list(
+            Rating.objects.filter(user=user).values_list("song_id", flat=True)[:2000]
+        ) or list(Song.objects.values_list("id", flat=True)[:2000])
+        self.token = Token.objects.get_or_create(user=user)[0].key
+
+
+class _Client:
+    """1本の接続とクッキー（セッション・CSRF）を持つ HTTP クライアント。"""
+
+    def __init__(self, url, timeout):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port
+        self.https = parts.scheme == "https"
+        self.timeout = timeout
+        self.cookies = {}
+        self.connection = None
+
+    def _connect(self):
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        self.connection = cls(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method, path, body=None, headers=None):
+        """戻り値: (ステータス, 本文, レスポンスヘッダ)"""
+        headers = dict(headers or {})
+        if isinstance(body, dict):
+            body = urlencode(body).encode()
+            headers.setdefault("Content-Type", "application/x-www-form-urlencoded")
+        if method == "POST" and "csrftoken" in self.cookies:
+            headers["X-CSRFToken"] = self.cookies["csrftoken"]
+            headers["Referer"] = f"{'https' if self.https else 'http'}://{self.host}/"
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in self.cookies.items())
+
+        for attempt in range(2):  # サーバーが keep-alive を切っていたら1回だけつなぎ直す
+            if self.connection is None:
+                self._connect()
+            try:
+                self.connection.request(method, path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                content = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+        for header in response.headers.get_all("Set-Cookie") or []:
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+        return response.status, content, response.headers
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    return ordered[max(math.ceil(len(ordered) * p / 100) - 1, 0)]
+
+
+def _summarize(samples, seconds):
+    """samples: [(所要ミリ秒, 成功か, SQL の件数 or None), ...]"""
+    timings = [ms for ms, _ok, _q in samples]
+    queries = [q for _ms, _ok, q in samples if q is not None]
+    errors = sum(1 for _ms, ok, _q in samples if not ok)
+    return {
+        "requests": len(samples),
+        "rps": round(len(samples) / seconds, 2) if seconds else 0,
+        "p50_ms": round(_percentile(timings, 50), 1) if timings else None,
+        "p95_ms": round(_percentile(timings, 95), 1) if timings else None,
+        "p99_ms": round(_percentile(timings, 99), 1) if timings else None,
+        "max_ms": round(max(timings), 1) if timings else None,
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0,
+        "queries": sum(queries),
+        "queries_per_request": round(sum(queries) / len(queries), 1) if queries else None,
+    }
+
+
+class Command(BaseCommand):
+    help = "手元のサーバーに実際に近い混ぜ方でリクエストを送り、詰まり始める並列数を測る"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url", default="http://127.0.0.1:8000", help="送り先（既定 http://127.0.0.1:8000）"
+        )
+        parser.add_argument(
+            "--users",
+            default=None,
+            help="ログインするユーザー名（カンマ区切り。省略時は synth_* から最大4人）",
+        )
+        parser.add_argument(
+            "--password",
+            default=None,
+            help="ログイン画面から入るときのパスワード（省略時はセッションを DB に直接作る）",
+        )
+        parser.add_argument(
+            "--concurrency",
+            default="1,2,4,8",
+            help="同時に送るスレッド数（カンマ区切りで複数なら順に上げる。既定 1,2,4,8）",
+        )
+        parser.add_argument(
+            "--duration", type=float, default=20, help="1段あたりの秒数（既定20）"
+        )
+        parser.add_argument(
+            "--warmup", type=float, default=3, help="各段の最初に集計しない秒数（既定3）"
+        )
+        parser.add_argument(
+            "--think-ms",
+            type=float,
+            default=0,
+            help="1リクエストごとに待つミリ秒（既定0＝待たずに送り続ける）",
+        )
+        parser.add_argument(
+            "--only", default=None, help="MIX の名前で絞る（カンマ区切り）"
+        )
+        parser.add_argument("--seed", type=int, default=0, help="乱数の種（既定0）")
+        parser.add_argument(
+            "--timeout", type=float, default=30, help="1リクエストのタイムアウト秒（既定30）"
+        )
+        parser.add_argument("--output", default=None, help="結果を書き出す JSON ファイル")
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(c) for c in options["concurrency"].split(",")]
+        except ValueError:
+            raise CommandError(f"--concurrency が不正です: {options['concurrency']}")
+        if not levels or min(levels) < 1:
+            raise CommandError("--concurrency は 1 以上にしてください")
+        if options["duration"] <= options["warmup"]:
+            raise CommandError("--duration は --warmup より長くしてください")
+
+        mix = MIX
+        if options["only"]:
+            names = set(options["only"].split(","))
+            mix = [m for m in MIX if m[0] in names]
+            if not mix:
+                raise CommandError(f"--only に当てはまるものがありません: {options['only']}")
+
+        users = self._users(options["users"])
+        region_ids = [str(i) for i in MusicRegion.objects.values_list("id", flat=True)]
+        artist_ids = list(Artist.objects.values_list("id", flat=True)[:2000])
+        user_data = [_UserData(user, region_ids, artist_ids) for user in users]
+
+        self.stdout.write(
+            f"url={options['url']}  users={', '.join(u.username for u in users)}  "
+            f"concurrency={levels}  duration={options['duration']}s"
+        )
+        steps = []
+        for level in levels:
+            steps.append(self._run_level(level, mix, user_data, options))
+            self._report(steps[-1])
+        self._report_saturation(steps)
+
+        if options["output"]:
+            report = {
+                "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+                "url": options["url"],
+                "users": [u.username for u in users],
+                "mix": {name: weight for name, weight, _build in mix},
+                "steps": steps,
+            }
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(f"保存しました: {options['output']}")
+
+    def _users(self, usernames):
+        if usernames:
+            names = [u.strip() for u in usernames.split(",") if u.strip()]
+            users = list(User.objects.filter(username__in=names))
+            missing = set(names) - {u.username for u in users}
+            if missing:
+                raise CommandError(f"ユーザーが見つかりません: {', '.join(sorted(missing))}")
+            return users
+        users = list(
+            User.objects.filter(username__startswith="synth_")
+            .annotate(n=Count("rating"))
+            .order_by("-n", "id")[:4]
+        )
+        if not users:
+            raise CommandError(
+                "synth_* のユーザーがいません。generate_dataset で作るか --users を指定してください"
+            )
+        return users
+
+    # ===== ログイン =====
+
+    def _login(self, client, user, password):
+        status, content, _headers = client.request("GET", "/login/")
+        if status != 200:
+            raise CommandError(f"ログイン画面を開けません（{status}）")
+        if password is None:
+            client.cookies[settings.SESSION_COOKIE_NAME] = self._session_key(user)
+            return
+        match = _CSRF_INPUT.search(content.decode("utf-8", "replace"))
+        form = {
+            "username": user.username,
+            "password": password,
+            "csrfmiddlewaretoken": match.group(1) if match else "",
+        }
+        status, _content, headers = client.request("POST", "/login/", form)
+        if status != 302 or "/login/" in (headers.get("Location") or ""):
+            raise CommandError(f"{user.username} でログインできません（{status}）")
+
+    def _session_key(self, user):
+        """ログイン後と同じ中身のセッションを作る（django.contrib.auth.login と同じキー）。"""
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+        return session.session_key
+
+    # ===== 送る =====
+
+    def _run_level(self, level, mix, user_data, options):
+        names = [name for name, _weight, _build in mix]
+        weights = [weight for _name, weight, _build in mix]
+        builders = {name: build for name, _weight, build in mix}
+        samples = defaultdict(list)
+        lock = threading.Lock()
+        failures = []
+
+        started = time.monotonic()
+        measure_from = started + options["warmup"]
+        deadline = started + options["duration"]
+
+        def worker(index):
+            data = user_data[index % len(user_data)]
+            rng = random.Random(options["seed"] * 1000 + index)
+            client = _Client(options["url"], options["timeout"])
+            try:
+                self._login(client, data.user, options["password"])
+                while time.monotonic() < deadline:
+                    name = rng.choices(names, weights)[0]
+                    method, path, body, headers = builders[name](rng, data)
+                    begin = time.monotonic()
+                    try:
+                        status, _content, response_headers = client.request(
+                            method, path, body, headers
+                        )
+                        ok = status < 400
+                        match = _QUERIES.search(response_headers.get("Server-Timing") or "")
+                        queries = int(match.group(1)) if match else None
+                    except (OSError, http.client.HTTPException):
+                        ok, queries = False, None
+                    end = time.monotonic()
+                    if begin >= measure_from:
+                        with lock:
+                            samples[name].append(((end - begin) * 1000, ok, queries))
+                    if options["think_ms"]:
+                        time.sleep(options["think_ms"] / 1000)
+            except Exception as e:  # ログインに失敗したスレッドは止めて報告する
+                with lock:
+                    failures.append(e)
+            finally:
+                client.close()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(level)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if failures:
+            raise CommandError(f"送れなかったスレッドがあります: {failures[0]}")
+
+        seconds = options["duration"] - options["warmup"]
+        every = [s for name in samples for s in samples[name]]
+        return {
+            "concurrency": level,
+            "seconds": seconds,
+            "total": _summarize(every, seconds),
+            "endpoints": {
+                name: _summarize(samples[name], seconds) for name in names if samples[name]
+            },
+        }
+
+    # ===== 表示 =====
+
+    def _row(self, label, s):
+        return (
+            f"{label:<20} {s['requests']:>7,} {s['rps']:>8.1f} "
+            f"{s['p50_ms'] or 0:>8.1f} {s['p95_ms'] or 0:>8.1f} {s['p99_ms'] or 0:>8.1f} "
+            f"{s['max_ms'] or 0:>8.1f} {s['error_rate'] * 100:>6.1f}% "
+            f"{s['queries']:>8,} {s['queries_per_request'] or 0:>6.1f}"
+        )
+
+    def _report(self, step):
+        self.stdout.write("")
+        self.stdout.write(f"並列数 {step['concurrency']}（{step['seconds']:.0f} 秒）")
+        self.stdout.write(
+            f"{'':<20} {'件数':>5} {'件/秒':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+            f"{'max ms':>8} {'エラー':>5} {'SQL':>8} {'SQL/件':>4}"
+        )
+        for name, summary in step["endpoints"].items():
+            line = self._row(name, summary)
+            self.stdout.write(self.style.ERROR(line) if summary["errors"] else line)
+        self.stdout.write(self._row("合計", step["total"]))
+
+    def _report_saturation(self, steps):
+        if len(steps) < 2:
+            return
+        self.stdout.write("")
+        self.stdout.write("並列数ごとの全体（スループットが伸びなくなったところで詰まっている）")
+        saturated = None
+        previous = None
+        for step in steps:
+            total = step["total"]
+            note = ""
+            if previous and saturated is None:
+                if total["rps"] < previous["rps"] * SATURATION_GAIN:
+                    saturated = step["concurrency"]
+                    note = "  ← ここで頭打ち"
+            self.stdout.write(
+                f"並列 {step['concurrency']:>3}: {total['rps']:>8.1f} 件/秒  "
+                f"p95 {total['p95_ms'] or 0:>8.1f} ms  エラー {total['error_rate'] * 100:.1f}%"
+                + note
+            )
+            previous = total
+        if saturated is None:
+            self.stdout.write("試した範囲では頭打ちになっていません（並列数を増やして試す）")
@@ -4,37 +4,113 @@
 ブラウザや回線を挟まずビューだけを実行するので、
 「サーバー側の何に時間がかかっているか」を切り分けられる。
 
+URL は複数並べるか --file で渡せる（地域や top_n はクエリ文字列で指定する）。
+URL ごとに --warmup 回捨ててから --iterations 回測り、所要時間の p50/p95/最大、
+SQL の件数・合計時間・遅い文、テンプレートの描画時間、レスポンスの大きさを出す。
+--output で JSON に書き出し、--baseline に以前の JSON を渡すと差を表示する。
+URL が1つで --output を付けないときは、従来どおり cProfile の結果も表示する。
+
 使い方:
     python manage.py profile_page /artist_search/
     python manage.py profile_page /artist_search/ --user pawaburo --top 30
+    python manage.py profile_page /ranking/ --no-cache   # 集計クエリ込みで測る
+    python manage.py profile_page "/ranking/?region=1" "/song_ranking/?mode=karaoke" -n 20
+    python manage.py profile_page --file urls.txt --output after.json --baseline before.json
 """
 
 import cProfile
 import io
+import json
+import math
 import pstats
+import statistics
 import time
 
 from django.contrib.auth.models import User
 from django.core.management.base import BaseCommand, CommandError
-from django.test import Client
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from songs import ranking_cache
+from songs.instrumentation import template_timer
+
+# 遅い文として表示する件数と、SQL を切り詰める長さ
+SLOW_QUERY_COUNT = 3
+SQL_PREVIEW_LENGTH = 160
+
+
+def _percentile(values, p):
+    """最近傍法のパーセンタイル。"""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(len(ordered) * p / 100) - 1, 0)]
+
+
+def _read_paths(paths, filename):
+    """引数と --file から URL を集める（# 以降と空行は無視）。"""
+    paths = list(paths)
+    if filename:
+        try:
+            with open(filename, encoding="utf-8") as f:
+                for line in f:
+                    line = line.split("#", 1)[0].strip()
+                    if line:
+                        paths.append(line)
+        except OSError as e:
+            raise CommandError(f"URL のファイルを読めません: {filename} ({e})")
+    if not paths:
+        raise CommandError("URL を指定してください（引数か --file）")
+    return paths
 
 
 class Command(BaseCommand):
     help = "指定URLのサーバー処理時間をプロファイルする（開発用）"
 
     def add_arguments(self, parser):
-        parser.add_argument("path", help="対象URL（例: /artist_search/）")
+        parser.add_argument(
+            "paths", nargs="*", help="対象URL（例: /artist_search/ \"/ranking/?region=1\"）"
+        )
+        parser.add_argument(
+            "--file", default=None, help="対象URLを1行に1つ書いたファイル（# 以降はコメント）"
+        )
         parser.add_argument(
             "--user",
             default=None,
             help="ログインするユーザー名（省略時は最初のユーザー）",
         )
+        parser.add_argument(
+            "-n",
+            "--iterations",
+            type=int,
+            default=5,
+            help="URLごとに測る回数（既定5）",
+        )
+        parser.add_argument(
+            "--warmup", type=int, default=1, help="測る前に捨てる回数（既定1）"
+        )
         parser.add_argument(
             "--top", type=int, default=25, help="表示する関数の件数（既定25）"
         )
+        parser.add_argument(
+            "--no-cache",
+            action="store_true",
+            help="ランキング結果のキャッシュを使わずに測る（2回目以降もSQLを実行する）",
+        )
+        parser.add_argument("--output", default=None, help="結果を書き出す JSON ファイル")
+        parser.add_argument(
+            "--baseline", default=None, help="比べる JSON ファイル（以前の --output）"
+        )
 
     def handle(self, *args, **options):
-        path = options["path"]
+        if options["iterations"] < 1 or options["warmup"] < 0:
+            raise CommandError("--iterations は 1 以上、--warmup は 0 以上にしてください")
+        if options["no_cache"]:
+            with override_settings(RANKING_CACHE_TIMEOUT=0):
+                return self._profile(options)
+        return self._profile(options)
+
+    def _profile(self, options):
+        paths = _read_paths(options["paths"], options["file"])
         username = options["user"]
 
         if username:
@@ -51,29 +127,125 @@ class Command(BaseCommand):
         client = Client(SERVER_NAME="localhost")
         client.force_login(user)
 
-        # 1回目はテンプレートの読み込みなどが混ざるので捨てる
-        first = client.get(path)
-        if first.status_code != 200:
-            raise CommandError(f"status={first.status_code} が返りました: {path}")
+        results = {}
+        for path in paths:
+            results[path] = self._measure(client, path, options)
+            self._report(path, user, results[path])
 
-        started = time.perf_counter()
-        response = client.get(path)
-        elapsed = time.perf_counter() - started
+        if options["baseline"]:
+            self._compare(options["baseline"], results)
+        if options["output"]:
+            report = {
+                "user": user.username,
+                "iterations": options["iterations"],
+                "no_cache": options["no_cache"],
+                "results": results,
+            }
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(f"保存しました: {options['output']}")
+        elif len(paths) == 1 and options["top"] > 0:
+            self._cprofile(client, paths[0], options["top"])
 
+    def _measure(self, client, path, options):
+        # 最初はテンプレートの読み込みなどが混ざるので捨てる
+        for _ in range(options["warmup"]):
+            response = client.get(path)
+            if response.status_code != 200:
+                raise CommandError(f"status={response.status_code} が返りました: {path}")
+
+        ranking_cache.reset_cache_stats()
+        timings, query_counts, db_times, render_times = [], [], [], []
+        statements = {}
+        for _ in range(options["iterations"]):
+            with CaptureQueriesContext(connection) as queries, template_timer() as render:
+                started = time.perf_counter()
+                response = client.get(path)
+                elapsed = (time.perf_counter() - started) * 1000
+            timings.append(elapsed)
+            render_times.append(render.template_ms)
+            query_counts.append(len(queries.captured_queries))
+            db_ms = 0.0
+            for query in queries.captured_queries:
+                ms = float(query["time"]) * 1000
+                db_ms += ms
+                # 同じ文は回数と合計時間をまとめる
+                entry = statements.setdefault(query["sql"], [0, 0.0])
+                entry[0] += 1
+                entry[1] += ms
+            db_times.append(db_ms)
+        stats = ranking_cache.cache_stats()
+
+        slowest = sorted(statements.items(), key=lambda item: item[1][1], reverse=True)
+        return {
+            "status": response.status_code,
+            "bytes": len(response.content),
+            "p50_ms": round(statistics.median(timings), 2),
+            "p95_ms": round(_percentile(timings, 95), 2),
+            "max_ms": round(max(timings), 2),
+            "queries": round(statistics.median(query_counts), 1),
+            "db_ms": round(statistics.median(db_times), 2),
+            "render_ms": round(statistics.median(render_times), 2),
+            "cache_hits": stats["hits"],
+            "cache_misses": stats["misses"],
+            "slowest_queries": [
+                {
+                    "sql": " ".join(sql.split())[:SQL_PREVIEW_LENGTH],
+                    "count": count,
+                    "avg_ms": round(total / count, 2),
+                }
+                for sql, (count, total) in slowest[:SLOW_QUERY_COUNT]
+            ],
+        }
+
+    def _report(self, path, user, result):
         self.stdout.write("")
         self.stdout.write(
-            f"{path}  user={user.username}  status={response.status_code}  "
-            f"{len(response.content):,} bytes  {elapsed:.3f} 秒"
+            f"{path}  user={user.username}  status={result['status']}  "
+            f"{result['bytes']:,} bytes"
         )
+        self.stdout.write(
+            f"    p50 {result['p50_ms']:.2f} ms  p95 {result['p95_ms']:.2f} ms  "
+            f"max {result['max_ms']:.2f} ms"
+        )
+        self.stdout.write(
+            f"    SQL {result['queries']:g} 件 / {result['db_ms']:.2f} ms  "
+            f"テンプレート {result['render_ms']:.2f} ms  "
+            f"ランキングキャッシュ hit={result['cache_hits']} miss={result['cache_misses']}"
+        )
+        for query in result["slowest_queries"]:
+            self.stdout.write(
+                f"    {query['avg_ms']:>8.2f} ms x{query['count']}  {query['sql']}"
+            )
+
+    def _compare(self, path, results):
+        try:
+            with open(path, encoding="utf-8") as f:
+                before = json.load(f).get("results", {})
+        except (OSError, ValueError, AttributeError) as e:
+            raise CommandError(f"比較用のファイルを読めません: {path} ({e})")
+
         self.stdout.write("")
+        self.stdout.write(f"比較（{path} → 今回）")
+        for url, result in results.items():
+            old = before.get(url)
+            if old is None:
+                self.stdout.write(f"{url}  （基準に無い URL）")
+                continue
+            ratio = result["p50_ms"] / old["p50_ms"] if old["p50_ms"] else 0
+            self.stdout.write(
+                f"{url}  p50 {old['p50_ms']:.2f} → {result['p50_ms']:.2f} ms (x{ratio:.2f})  "
+                f"SQL {old['queries']:g} → {result['queries']:g} 件  "
+                f"{old['bytes']:,} → {result['bytes']:,} bytes"
+            )
 
+    def _cprofile(self, client, path, top):
+        self.stdout.write("")
         profiler = cProfile.Profile()
         profiler.enable()
         client.get(path)
         profiler.disable()
 
         buffer = io.StringIO()
-        pstats.Stats(profiler, stream=buffer).sort_stats("cumulative").print_stats(
-            options["top"]
-        )
+        pstats.Stats(profiler, stream=buffer).sort_stats("cumulative").print_stats(top)
         self.stdout.write(buffer.getvalue())
@@ -0,0 +1,63 @@
+"""
+ランキング集計テーブル（RankingGroup / RankingEntry）を作り直すコマンド。
+
+RANKING_BACKEND=store に切り替える前と、loaddata などシグナルを通らない
+方法でデータを入れた後に実行する。--check を付けると、作り直した結果を
+check_rankings --backend store で services.py の SQL と突き合わせる。
+
+使い方:
+    python manage.py rebuild_rankings
+    python manage.py rebuild_rankings --user pawaburo --check
+    python manage.py rebuild_rankings --check-only
+"""
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from songs import ranking_store
+from songs.models import Rating
+
+
+class Command(BaseCommand):
+    help = "ランキング集計テーブルを作り直す（--check で SQL 版と突き合わせる）"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user", default=None, help="対象ユーザー名（省略時は評価のある全ユーザー）"
+        )
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="作り直した後に services.py の SQL と突き合わせる",
+        )
+        parser.add_argument(
+            "--check-only",
+            action="store_true",
+            help="作り直さずに突き合わせだけ行う",
+        )
+
+    def handle(self, *args, **options):
+        if options["user"]:
+            try:
+                users = [User.objects.get(username=options["user"])]
+            except User.DoesNotExist:
+                raise CommandError(f"ユーザーが見つかりません: {options['user']}")
+        else:
+            user_ids = Rating.objects.values_list("user_id", flat=True).distinct()
+            users = list(User.objects.filter(id__in=user_ids).order_by("id"))
+
+        if not options["check_only"]:
+            for user in users:
+                groups, entries = ranking_store.rebuild_user(user.id)
+                self.stdout.write(
+                    f"{user.username}: グループ {groups:,} 件 / 曲 {entries:,} 件"
+                )
+
+        if options["check"] or options["check_only"]:
+            call_command(
+                "check_rankings",
+                backend="store",
+                user=options["user"],
+                stdout=self.stdout,
+            )
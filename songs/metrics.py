@@ -0,0 +1,239 @@
+"""
+Prometheus 形式のメトリクス（/metrics）の集計。
+
+PythonAnywhere では複数のワーカープロセスが動くので、プロセスの中だけで
+数えても全体は分からない。外部のサービスは置かずに、各プロセスが自分の
+累積値を settings.METRICS_DIR に「プロセスID-起動時刻.json」として書き出し
+（一時ファイル → os.replace で置き換えるので読みかけを掴まない）、
+/metrics を返すときに全ファイルを足し合わせる。
+
+ファイルの書き手はそのプロセスだけなのでロックは要らない。
+書き出しは METRICS_FLUSH_INTERVAL 秒に1回と、プロセス終了時と /metrics を返す直前。
+終了したプロセスのファイルも消さずに足し続ける（カウンタが減らないように）。
+カウンタを0に戻したいときはディレクトリの中身を消す。
+"""
+
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+# 所要時間（秒）・SQL 件数・レスポンスの大きさ（バイト）のヒストグラムの区切り
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+BYTES_BUCKETS = (1_000, 10_000, 50_000, 100_000, 500_000, 1_000_000, 5_000_000)
+
+# 名前: (種類, 説明, ヒストグラムの区切り)
+METRICS = {
+    "music_request_duration_seconds": (
+        "histogram",
+        "リクエストの処理時間",
+        SECONDS_BUCKETS,
+    ),
+    "music_request_db_queries": (
+        "histogram",
+        "1リクエストで実行した SQL の件数",
+        QUERY_BUCKETS,
+    ),
+    "music_request_db_seconds": (
+        "histogram",
+        "1リクエストの SQL の合計時間",
+        SECONDS_BUCKETS,
+    ),
+    "music_response_bytes": (
+        "histogram",
+        "送ったレスポンス本文の大きさ（圧縮後）",
+        BYTES_BUCKETS,
+    ),
+    "music_requests_total": ("counter", "リクエスト数（ステータス別）", None),
+    "music_gzip_input_bytes_total": (
+        "counter",
+        "GZip で圧縮した本文の元の大きさ",
+        None,
+    ),
+    "music_gzip_output_bytes_total": (
+        "counter",
+        "GZip で圧縮した本文の圧縮後の大きさ",
+        None,
+    ),
+    "music_rating_writes_total": ("counter", "評価（Rating）の保存・削除の件数", None),
+    "music_ranking_computations_total": (
+        "counter",
+        "ランキングを集計した回数（キャッシュに無かったもの）",
+        None,
+    ),
+}
+
+_lock = threading.Lock()
+_counters = {}  # (名前, ラベル) -> 値
+_histograms = {}  # (名前, ラベル) -> [区切りごとの件数..., 合計, 件数]
+_last_flush = 0.0
+# PID は再起動で使い回されるので、起動時刻も付けて前のプロセスのファイルを潰さない
+_filename = f"{os.getpid()}-{int(time.time())}.json"
+
+
+def is_enabled():
+    return getattr(settings, "METRICS_ENABLED", True)
+
+
+def _labels(labels):
+    """ラベルの dict を、キーに使えるよう並びを固定したタプルにする。"""
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    """カウンタを増やす。"""
+    if not is_enabled():
+        return
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+    _maybe_flush()
+
+
+def observe(name, value, **labels):
+    """ヒストグラムに1件足す。"""
+    if not is_enabled():
+        return
+    buckets = METRICS[name][2]
+    key = (name, _labels(labels))
+    with _lock:
+        data = _histograms.get(key)
+        if data is None:
+            data = _histograms[key] = [0] * (len(buckets) + 2)
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                data[i] += 1
+                break
+        data[-2] += value
+        data[-1] += 1
+    _maybe_flush()
+
+
+# ===== プロセスごとのファイル =====
+
+
+def _directory():
+    return Path(getattr(settings, "METRICS_DIR", tempfile.gettempdir()))
+
+
+def _snapshot():
+    with _lock:
+        return {
+            "counters": [
+                [name, labels, value] for (name, labels), value in _counters.items()
+            ],
+            "histograms": [
+                [name, labels, data] for (name, labels), data in _histograms.items()
+            ],
+        }
+
+
+def flush():
+    """このプロセスの累積値をファイルに書き出す。"""
+    global _last_flush
+    _last_flush = time.monotonic()
+    if not _counters and not _histograms:
+        return
+    directory = _directory()
+    tmp = None
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(_snapshot(), f)
+        os.replace(tmp, directory / _filename)
+    except OSError:
+        # 書けなくても本来の処理は止めない（次の機会にまた書く）
+        if tmp is not None and os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def _maybe_flush():
+    interval = getattr(settings, "METRICS_FLUSH_INTERVAL", 5)
+    if time.monotonic() - _last_flush >= interval:
+        flush()
+
+
+atexit.register(flush)
+
+
+def collect():
+    """
+    全プロセスのファイルを足し合わせる。
+    戻り値: (counters, histograms)。どちらも {(名前, ラベル): 値} の dict。
+    """
+    flush()
+    counters, histograms = {}, {}
+    for path in sorted(_directory().glob("*.json")):
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, labels, value in data.get("counters", []):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in data.get("histograms", []):
+            if name not in METRICS or len(values) != len(METRICS[name][2]) + 2:
+                continue  # 区切りを変える前のファイル
+            key = (name, tuple(tuple(pair) for pair in labels))
+            total = histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                total[i] += value
+    return counters, histograms
+
+
+# ===== テキスト形式 =====
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """Prometheus のテキスト形式（version 0.0.4）で全メトリクスを返す。"""
+    counters, histograms = collect()
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "counter":
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(
+                        f"{name}{_format_labels(labels)} {_format_number(value)}"
+                    )
+            continue
+        for (n, labels), values in sorted(histograms.items()):
+            if n != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, values):
+                cumulative += count
+                le = _format_labels(labels, [("le", str(bound))])
+                lines.append(f"{name}_bucket{le} {cumulative}")
+            lines.append(
+                f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {values[-1]}"
+            )
+            lines.append(
+                f"{name}_sum{_format_labels(labels)} {_format_number(values[-2])}"
+            )
+            lines.append(f"{name}_count{_format_labels(labels)} {values[-1]}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,145 @@
+"""
+ランキング集計テーブル（RankingGroup / RankingEntry）を追加する。
+
+中身は songs.ranking_store が作る。RANKING_BACKEND=store に切り替える前に
+manage.py rebuild_rankings で全ユーザー分を作っておくこと。
+"""
+
+# Generated by Django 5.2.3 on 2026-10-18 04:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("songs", "0025_move_aliases_out_of_credits"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RankingEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("region_key", models.IntegerField()),
+                (
+                    "dimension",
+                    models.CharField(
+                        choices=[
+                            ("artist", "歌手"),
+                            ("lyricist", "作詞"),
+                            ("composer", "作曲"),
+                            ("year", "年"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("karaoke_mode", models.BooleanField()),
+                ("group_key", models.CharField(max_length=200)),
+                ("score", models.DecimalField(decimal_places=3, max_digits=6)),
+                ("order_in_group", models.IntegerField()),
+                ("rank_in_group", models.IntegerField()),
+                (
+                    "song",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="songs.song",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=[
+                            "user",
+                            "region_key",
+                            "dimension",
+                            "karaoke_mode",
+                            "group_key",
+                            "order_in_group",
+                        ],
+                        name="songs_ranki_user_id_4c9d11_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="RankingGroup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("region_key", models.IntegerField()),
+                (
+                    "dimension",
+                    models.CharField(
+                        choices=[
+                            ("artist", "歌手"),
+                            ("lyricist", "作詞"),
+                            ("composer", "作曲"),
+                            ("year", "年"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("karaoke_mode", models.BooleanField()),
+                ("group_key", models.CharField(max_length=200)),
+                ("song_count", models.IntegerField()),
+                (
+                    "total_5",
+                    models.DecimalField(decimal_places=3, max_digits=8, null=True),
+                ),
+                (
+                    "total_10",
+                    models.DecimalField(decimal_places=3, max_digits=8, null=True),
+                ),
+                (
+                    "total_15",
+                    models.DecimalField(decimal_places=3, max_digits=8, null=True),
+                ),
+                (
+                    "total_20",
+                    models.DecimalField(decimal_places=3, max_digits=8, null=True),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {
+                    ("user", "region_key", "dimension", "karaoke_mode", "group_key")
+                },
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.3 on 2026-10-18 04:47
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("songs", "0026_ranking_store"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="rating",
+            index=models.Index(
+                fields=["user", "karaoke_score"], name="songs_ratin_user_id_802615_idx"
+            ),
+        ),
+    ]
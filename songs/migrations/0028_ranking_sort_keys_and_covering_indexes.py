@@ -0,0 +1,81 @@
+"""
+ランキングの CTE がよく通る経路のためのスキーマ変更。
+
+  - Artist.name_key / Song.title_key: UPPER(名前) / UPPER(曲名) を DB が
+    計算して保存する列。並び順に使い、インデックスも張れるようにする。
+  - Rating: (user, score, karaoke_score, song) と (user, karaoke_score, score, song)
+    のカバリングインデックス。前の (user, score) / (user, karaoke_score) は置き換える。
+
+効果は manage.py bench_ranking_sql で、この移行の前後を比べて確かめる。
+"""
+
+# Generated by Django 5.2.3 on 2026-10-18 04:48
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("songs", "0027_rating_karaoke_score_index"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="artist",
+            name="name_key",
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.db.models.functions.text.Upper("name"),
+                output_field=models.CharField(max_length=100),
+            ),
+        ),
+        migrations.AddField(
+            model_name="song",
+            name="title_key",
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.db.models.functions.text.Upper("title"),
+                output_field=models.CharField(max_length=100),
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="artist",
+            index=models.Index(
+                fields=["region", "name_key"], name="songs_artis_region__424588_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="rating",
+            index=models.Index(
+                fields=["user", "score", "karaoke_score", "song"],
+                name="songs_ratin_user_id_b2cbb4_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="rating",
+            index=models.Index(
+                fields=["user", "karaoke_score", "score", "song"],
+                name="songs_ratin_user_id_eb9c32_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="song",
+            index=models.Index(
+                fields=["title_key"], name="songs_song_title_k_0f3659_idx"
+            ),
+        ),
+        # 新しいカバリングインデックスの先頭列と重なる古いインデックスは、
+        # 新しい方を作ってから外す（user_id の外部キーが使うインデックスを切らさない）
+        migrations.RemoveIndex(
+            model_name="rating",
+            name="songs_ratin_user_id_82ff44_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="rating",
+            name="songs_ratin_user_id_802615_idx",
+        ),
+    ]
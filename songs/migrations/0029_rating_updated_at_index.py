@@ -0,0 +1,27 @@
+# Generated by Django 5.2.3 on 2026-10-18 05:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("songs", "0028_ranking_sort_keys_and_covering_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="rating",
+            index=models.Index(
+                fields=["updated_at"], name="songs_ratin_updated_f80ae8_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="rating",
+            index=models.Index(
+                fields=["user", "updated_at"], name="songs_ratin_user_id_b368e4_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.3 on 2026-10-18 05:50
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("songs", "0031_rating_sync"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="rankinggroup",
+            name="total_10",
+        ),
+        migrations.RemoveField(
+            model_name="rankinggroup",
+            name="total_15",
+        ),
+        migrations.RemoveField(
+            model_name="rankinggroup",
+            name="total_20",
+        ),
+        migrations.RemoveField(
+            model_name="rankinggroup",
+            name="total_5",
+        ),
+    ]
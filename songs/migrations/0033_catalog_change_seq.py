@@ -0,0 +1,59 @@
+# Generated by Django 5.2.3 on 2026-10-18 06:00
+
+from django.db import migrations, models
+from django.db.models import F, Max
+
+
+def number_existing_changes(apps, schema_editor):
+    """
+    今ある履歴は id をそのまま seq にする（同期スクリプトが控えている
+    since は id なので、続きから読めるように）。
+    """
+    CatalogChange = apps.get_model("songs", "CatalogChange")
+    CatalogSequence = apps.get_model("songs", "CatalogSequence")
+    CatalogChange.objects.update(seq=F("id"))
+    last = CatalogChange.objects.aggregate(last=Max("id"))["last"] or 0
+    CatalogSequence.objects.create(pk=1, last_seq=last)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("songs", "0032_drop_ranking_group_totals"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CatalogSequence",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("last_seq", models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name="catalogchange",
+            name="songs_catal_table_c352a9_idx",
+        ),
+        migrations.AddField(
+            model_name="catalogchange",
+            name="seq",
+            field=models.BigIntegerField(blank=True, null=True, unique=True),
+        ),
+        migrations.RunPython(
+            number_existing_changes, reverse_code=migrations.RunPython.noop
+        ),
+        migrations.AddIndex(
+            model_name="catalogchange",
+            index=models.Index(
+                fields=["table", "seq"], name="songs_catal_table_52f3c7_idx"
+            ),
+        ),
+    ]
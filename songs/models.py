@@ -1,6 +1,7 @@
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.functions import Upper
 
 from .utils import normalize
 
@@ -27,6 +28,13 @@ class Artist(models.Model):
     # 検索・突き合わせ用に NFKC 正規化 + 小文字化した名前（songs.utils.normalize）。
     # ここは「正規化名」専用。別名義を入れる場所ではない（ArtistCredit を使うこと）。
     format_name = models.CharField(max_length=100, null=True, blank=True)
+    # ランキングの並び順（UPPER(名前) 順）用のキー。DB が計算して保存するので
+    # bulk_create や生SQL・フィクスチャで入れた行でも常に name と一致する。
+    name_key = models.GeneratedField(
+        expression=Upper("name"),
+        output_field=models.CharField(max_length=100),
+        db_persist=True,
+    )
     region = models.ForeignKey(
         MusicRegion,
         on_delete=models.CASCADE,
@@ -43,6 +51,10 @@ class Artist(models.Model):
             "name",
             "region",
         )
+        # 地域で絞って名前順に並べる一覧・ランキング用
+        indexes = [
+            models.Index(fields=["region", "name_key"]),
+        ]
 
     def __str__(self):
         return self.name
@@ -276,6 +288,12 @@ class Song(models.Model):
     title = models.CharField(max_length=100)
     # 検索・突き合わせ用に NFKC 正規化 + 小文字化したタイトル（songs.utils.normalize）
     format_title = models.CharField(max_length=100, null=True, blank=True)
+    # ランキングの並び順（UPPER(曲名) 順）用のキー。Artist.name_key と同じく DB が計算する
+    title_key = models.GeneratedField(
+        expression=Upper("title"),
+        output_field=models.CharField(max_length=100),
+        db_persist=True,
+    )
     artist = models.ForeignKey(Artist, on_delete=models.CASCADE, related_name="songs")
     # この曲がどの名義で出たか。主名義の曲も必ず行を指す（NULL 不可）。
     #
@@ -317,6 +335,7 @@ class Song(models.Model):
             models.Index(fields=["lyricist"]),
             models.Index(fields=["composer"]),
             models.Index(fields=["year"]),
+            models.Index(fields=["title_key"]),
         ]
 
     def __str__(self):
@@ -366,18 +385,44 @@ class Rating(models.Model):
     )  # カラオケ採点機能の点数（0.000〜100.000）
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # オフライン端末からまとめて送られた評価（/api/ratings/score/batch）の、
+    # 端末側で採点した時刻。後勝ちの比較に使う。サーバー上で直した評価は NULL
+    # （そのときは updated_at が最終更新の時刻）。
+    client_updated_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         unique_together = ("user", "song")  # 同じユーザーは1曲に1回だけ評価可能
 
-        # ランキング集計（user_id で絞って score 降順）用
+        # ランキング集計（user_id で絞って score / karaoke_score 降順）用。
+        # 集計の CTE が Rating から読む列（点数2つと song_id）を全部含めておき、
+        # 表本体を読まずにインデックスだけで済むようにする（カバリングインデックス）。
         indexes = [
-            models.Index(fields=["user", "score"]),
+            models.Index(fields=["user", "score", "karaoke_score", "song"]),
+            models.Index(fields=["user", "karaoke_score", "score", "song"]),
+            # /api/songs_rating の差分取得（updated_at, id のキーセット）用。
+            # InnoDB の副インデックスは主キーを含むので (updated_at, id) の順に読める。
+            models.Index(fields=["updated_at"]),
+            models.Index(fields=["user", "updated_at"]),
         ]
 
     def __str__(self):
         return f"{self.user.username} - {self.song.title} : {self.score}"
 
+    def save(self, *args, **kwargs):
+        # 画面・admin・1件ずつの API で直したら、端末側の時刻は捨てて
+        # updated_at（サーバーの時刻）を最終更新にする。
+        # まとめての同期は bulk_create で書くのでここを通らない。
+        self.client_updated_at = None
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "client_updated_at" not in update_fields:
+            kwargs["update_fields"] = [*update_fields, "client_updated_at"]
+        super().save(*args, **kwargs)
+
+    @property
+    def last_modified(self):
+        """後勝ちの比較に使う最終更新の時刻。"""
+        return self.client_updated_at or self.updated_at
+
 
 class ArtistYearPreference(models.Model):
     """
@@ -416,3 +461,164 @@ class UserProfile(models.Model):
 
     def __str__(self):
         return f"{self.user.username} profile"
+
+
+class RankingGroup(models.Model):
+    """
+    ランキング集計テーブル（グループ単位）。songs.ranking_store が書き込む。
+
+    (ユーザー, 地域, 集計軸, 採点の種類) ごとに、グループ（歌手・作詞者・
+    作曲者・年）の評価済み曲数を持つ。合計点は RankingEntry から読み出し時に出す。
+    評価や曲情報の保存時にシグナル経由で該当グループだけ作り直すので、
+    画面からは直接書き換えないこと。
+    """
+
+    DIMENSION_CHOICES = [
+        ("artist", "歌手"),
+        ("lyricist", "作詞"),
+        ("composer", "作曲"),
+        ("year", "年"),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    # 0 は「全地域」、それ以外は MusicRegion.id。
+    # FK にしないのは 0（全地域）を同じ列で表したいため。
+    region_key = models.IntegerField()
+    dimension = models.CharField(max_length=10, choices=DIMENSION_CHOICES)
+    # True ならカラオケ採点、False なら好み度で集計した行
+    karaoke_mode = models.BooleanField()
+    # 歌手は Artist.id、作詞/作曲は名前、年は西暦を文字列にしたもの
+    group_key = models.CharField(max_length=200)
+    song_count = models.IntegerField()
+
+    class Meta:
+        unique_together = (
+            "user",
+            "region_key",
+            "dimension",
+            "karaoke_mode",
+            "group_key",
+        )
+
+    def __str__(self):
+        return f"{self.user_id} {self.dimension}:{self.group_key} ({self.region_key})"
+
+
+class RankingEntry(models.Model):
+    """
+    ランキング集計テーブル（曲単位）。songs.ranking_store が書き込む。
+
+    グループ内での通し番号（ROW_NUMBER 相当、同点は曲名順）と
+    順位（RANK 相当）を持つ。キーの意味は RankingGroup と同じ。
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    region_key = models.IntegerField()
+    dimension = models.CharField(
+        max_length=10, choices=RankingGroup.DIMENSION_CHOICES
+    )
+    karaoke_mode = models.BooleanField()
+    group_key = models.CharField(max_length=200)
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name="+")
+    score = models.DecimalField(max_digits=6, decimal_places=3)
+    order_in_group = models.IntegerField()
+    rank_in_group = models.IntegerField()
+
+    class Meta:
+        # 読み出しは「ユーザー×地域×集計軸×採点の種類」で絞り、
+        # グループごとに通し番号順に取り出す
+        indexes = [
+            models.Index(
+                fields=[
+                    "user",
+                    "region_key",
+                    "dimension",
+                    "karaoke_mode",
+                    "group_key",
+                    "order_in_group",
+                ]
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.dimension}:{self.group_key} #{self.order_in_group}"
+
+
+class CatalogChange(models.Model):
+    """
+    歌手・名義・別表記・曲の変更履歴。songs.catalog_changes が書き込む。
+
+    同期スクリプトは /api/changes?since=<前回の seq> で続きの差分だけを受け取る。
+    行の中身は持たず（最新の行は本体から読む）、どの行が追加・変更・削除されたか
+    だけを残す。
+
+    id は INSERT の時点で決まるので、コミットの順とは限らない（長いトランザクションが
+    後から若い id でコミットしうる）。そのため差分は id ではなく seq の順に返す。
+    seq はコミット後に読み出し側が振る（songs.catalog_changes.assign_sequence）。
+    """
+
+    OP_INSERT = "insert"
+    OP_UPDATE = "update"
+    OP_DELETE = "delete"
+    OP_CHOICES = [
+        (OP_INSERT, "追加"),
+        (OP_UPDATE, "変更"),
+        (OP_DELETE, "削除"),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    # "artists" / "artist_credits" / "artist_aliases" / "songs"（API の一覧と同じ名前）
+    table = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    op = models.CharField(max_length=6, choices=OP_CHOICES)
+    changed_at = models.DateTimeField(auto_now_add=True)
+    # コミットの順の通し番号。まだ振っていない（読み出し側が見ていない）履歴は NULL
+    seq = models.BigIntegerField(null=True, blank=True, unique=True)
+
+    class Meta:
+        # テーブルごとの最新の seq（チェックサムの控えの位置）を引く用
+        indexes = [
+            models.Index(fields=["table", "seq"]),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} {self.op} {self.table}:{self.object_id}"
+
+
+class CatalogSequence(models.Model):
+    """
+    CatalogChange.seq を振るための行（1行だけ）。
+
+    振る側はこの行をロックしてから番号を進めるので、seq は1つずつ順に、
+    前に振った分がコミットされてから次が振られる。
+    """
+
+    last_seq = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"seq {self.last_seq}"
+
+
+class RatingSyncReceipt(models.Model):
+    """
+    まとめての評価の同期（/api/ratings/score/batch）で処理済みの項目。
+
+    端末は項目ごとに冪等キー（key）を付けて送る。通信が切れて同じ項目を
+    送り直しても、ここに残した結果を返すだけで二重に書き込まない。
+    古いものは songs.rating_sync が消す（RATING_SYNC_RECEIPT_DAYS 日）。
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=64)
+    result = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("user", "key")
+        # 古い受領の掃除用
+        indexes = [
+            models.Index(fields=["user", "created_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}:{self.key}"
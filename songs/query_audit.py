@@ -0,0 +1,231 @@
+"""
+N+1 クエリの検出とビューごとの SQL 件数の上限（開発・テスト用）。
+
+1リクエストで実行した SQL を「形」（数値・文字列・IN の中身を伏せたもの）で
+まとめ、同じ形が QUERY_AUDIT_REPEAT 回以上出たら N+1 の疑いとして、
+その SQL を発行した songs / music のコードの位置（例: models.py の
+Song.credit_name、admin.py の list_display）と一緒に報告する。
+あわせて VIEW_QUERY_BUDGETS のビューごとの上限を超えていないかを見る。
+
+settings.QUERY_AUDIT で動きを切り替える。
+  "off"  : 何もしない（本番。SQL ごとにスタックを辿るので重い）
+  "warn" : ロガー "songs.query_audit" に警告を出す（DEBUG 時の既定）
+  "raise": QueryAuditError を投げる（テストで落とすとき）
+
+テストでは audit_queries() を直接使ってもよい。
+
+    with audit_queries(budget=5, mode="raise"):
+        client.get("/ranking/")
+"""
+
+import logging
+import os
+import re
+import traceback
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger("songs.query_audit")
+
+# ビュー（URL 名。名前の無い API は URL パターン）ごとの SQL 件数の上限。
+# セッションとユーザーの読み込み（2件）を含む。データが増えても件数が
+# 変わらないこと（1行ごとに SQL を出さないこと）を前提にした値なので、
+# 上限を上げる前に N+1 になっていないかを確かめること。
+VIEW_QUERY_BUDGETS = {
+    # songs/views.py
+    "ranking": 10,
+    "ranking_more": 6,
+    "artist_list": 8,
+    "artist_rank_matrix": 7,
+    "song_ranking": 8,
+    "song_ranking_rows": 7,
+    "artist_songs": 8,
+    "song_list": 7,
+    "artist_search": 9,
+    "artist_search_rows": 8,
+    "update_rating": 9,
+    "update_karaoke_score": 9,
+    "update_cover": 7,
+    "update_song_credits": 9,
+    "lyricist_list": 7,
+    "composer_list": 7,
+    "year_list": 7,
+    "lyricist_grid": 8,
+    "composer_grid": 8,
+    "year_grid": 8,
+    "lyricist_matrix": 8,
+    "composer_matrix": 8,
+    "year_matrix": 8,
+    "creator_songs": 7,
+    "bulk_add_songs": 10,
+    "artist_year_heatmap": 10,
+    "artist_year_heatmap_bulk_save": 10,
+    "artist_year_heatmap_range_set": 10,
+    "artist_year_heatmap_add_artist": 10,
+    "signup": 6,
+    "login": 4,
+    # 運用向け（songs/views_*.py）
+    "list_dumps": 2,
+    "metrics": 2,
+    "slow_request_list": 4,
+    "slow_request_detail": 4,
+    "profile_download": 4,
+    # songs/api_views.py
+    "api/artists/": 4,
+    "api/artist_credits/": 4,
+    "api/artist_aliases/": 4,
+    "api/songs/": 4,
+    # seq の振り付け（未採番の確認・ロックした番号の行（初回は作成）・未採番の履歴・
+    # 更新2件）+ 変更履歴 1 + 4テーブルの行 + チェックサム（最新の番号・
+    # 変わった行の一覧・4テーブル分の行の読み直し）
+    "catalog_changes": 22,
+    "songs-rating-export": 4,
+    "update": 8,
+    # 受領・曲の特定（id / 別表記・曲 ×2）・評価の読み込み・upsert・受領の掃除と保存
+    "update_scores_batch": 16,
+    # 歌手・名義・曲の作成（それぞれ変更履歴の記録つき）
+    "create_song_with_artist": 17,
+    "api_update_song_credits": 8,
+}
+
+# 送られた行の数だけ保存する画面（行ごとに SQL が出るのは仕様）。
+# POST は上限と N+1 の検査から外す（表示の GET は検査する）。
+PER_ROW_WRITE_VIEWS = {"bulk_add_songs"}
+
+# スタックから「発行したコードの位置」を探すときに飛ばすファイル（SQL を包む側）
+_SONGS_DIR = os.path.dirname(os.path.abspath(__file__))
+_PROJECT_DIR = os.path.dirname(_SONGS_DIR)
+_SKIP_FILES = (
+    os.path.abspath(__file__),
+    os.path.join(_SONGS_DIR, "instrumentation.py"),
+)
+
+_NUMBER = re.compile(r"\b\d+(\.\d+)?\b")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_IN_LIST = re.compile(r"\bIN\s*\((?:\s*(?:%s|\?|\d+)\s*,?)+\)", re.IGNORECASE)
+_SPACES = re.compile(r"\s+")
+
+
+class QueryAuditError(AssertionError):
+    """N+1 の疑い、または SQL 件数の上限超え（QUERY_AUDIT="raise" のとき）。"""
+
+
+def fingerprint(sql):
+    """SQL の「形」。値だけが違う文は同じになる。"""
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("IN (...)", sql)
+    return _SPACES.sub(" ", sql).strip()
+
+
+def _caller():
+    """SQL を発行したプロジェクト内のコードの位置（site-packages は除く）。"""
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if (
+            filename.startswith(_PROJECT_DIR)
+            and filename not in _SKIP_FILES
+            and "site-packages" not in filename
+        ):
+            return f"{os.path.relpath(filename, _PROJECT_DIR)}:{frame.lineno} ({frame.name})"
+    return "（プロジェクト外）"
+
+
+class QueryLog:
+    """1リクエスト（または audit_queries の中）で実行した SQL の形と位置。"""
+
+    def __init__(self):
+        self.count = 0
+        self.groups = defaultdict(list)  # 形 -> [位置, ...]
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        self.groups[fingerprint(sql)].append(_caller())
+        return execute(sql, params, many, context)
+
+    def repeated(self, threshold):
+        """同じ形が threshold 回以上出たもの: [(回数, 形, 最も多い位置), ...]"""
+        found = []
+        for shape, callers in self.groups.items():
+            if len(callers) >= threshold:
+                location = max(set(callers), key=callers.count)
+                found.append((len(callers), shape, location))
+        return sorted(found, reverse=True)
+
+    def problems(self, budget=None, threshold=None):
+        """報告する内容（文字列のリスト）。問題が無ければ空。"""
+        if threshold is None:
+            threshold = getattr(settings, "QUERY_AUDIT_REPEAT", 5)
+        messages = [
+            f"N+1 の疑い: 同じ形の SQL が {count} 回（{location}）: {shape[:200]}"
+            for count, shape, location in self.repeated(threshold)
+        ]
+        if budget is not None and self.count > budget:
+            messages.append(f"SQL が {self.count} 件（上限 {budget} 件）")
+        return messages
+
+
+def _report(label, messages, mode):
+    if not messages:
+        return
+    text = f"{label}: " + " / ".join(messages)
+    if mode == "raise":
+        raise QueryAuditError(text)
+    logger.warning(text)
+
+
+@contextmanager
+def audit_queries(budget=None, mode="raise", label="audit_queries", threshold=None):
+    """
+    中で実行した SQL を調べ、N+1 の疑いや上限超えを mode に従って報告する。
+    戻り値の QueryLog で件数（.count）も見られる。
+    """
+    log = QueryLog()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(log))
+        yield log
+    _report(label, log.problems(budget, threshold), mode)
+
+
+def _view_key(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return None
+    return match.url_name or match.route
+
+
+def _mode():
+    default = "warn" if settings.DEBUG else "off"
+    return getattr(settings, "QUERY_AUDIT", default)
+
+
+class QueryAuditMiddleware:
+    """
+    リクエストごとに N+1 の疑いと VIEW_QUERY_BUDGETS の上限を調べる。
+    QUERY_AUDIT="off" のときは何もしない（SQL ごとにスタックを辿らない）。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = _mode()
+        if mode == "off":
+            return self.get_response(request)
+
+        log = QueryLog()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(log))
+            response = self.get_response(request)
+
+        view = _view_key(request)
+        if request.method == "POST" and view in PER_ROW_WRITE_VIEWS:
+            return response
+        budget = VIEW_QUERY_BUDGETS.get(view)
+        _report(f"{request.method} {request.path} ({view})", log.problems(budget), mode)
+        return response
@@ -0,0 +1,179 @@
+"""
+ランキング集計結果のキャッシュ。
+
+TOP5/10/15/20 やカラオケ採点の切り替えは同じ画面の中で何度も行われるが、
+そのたびに services.py の重いクエリが走っていた。ここでは集計関数の結果を
+Django のキャッシュ（settings.CACHES["rankings"]）に置き、
+(関数, 引数) とデータの版番号をキーにして使い回す。
+
+版番号は2種類。
+  - ユーザー版: そのユーザーの Rating が変わったら上げる
+  - カタログ版: 曲・歌手（曲名、カバー、作詞/作曲/年、地域など）が変わったら上げる
+古い版のキーは参照されなくなり、キャッシュの期限切れで自然に消える。
+版番号の初期値は 1 ではなく時刻（ナノ秒）にする。ファイルキャッシュは
+MAX_ENTRIES を超えると期限の無いキーも間引くので、版番号が消えて 1 から
+数え直すと、以前の版のキーに残っていた古い結果をまた拾ってしまうため。
+版上げは songs.signals から行うので、ビュー・API・admin のどこから
+保存しても追従する。
+
+複数プロセス（PythonAnywhere の複数ワーカー）で版番号を共有する必要が
+あるため、本番ではファイルキャッシュなど共有できるバックエンドを使うこと。
+locmem はテストや単一プロセスの開発用。
+"""
+
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import InvalidCacheBackendError, caches
+from django.db import transaction
+
+from songs.instrumentation import record_cache
+
+CACHE_ALIAS = "rankings"
+
+_CATALOG_VERSION_KEY = "ranking:ver:catalog"
+
+# ヒット/ミスの件数（プロセス単位）。cache_stats() で読む。
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def _cache():
+    """ランキング用のキャッシュ。設定が無い／無効なら None。"""
+    if getattr(settings, "RANKING_CACHE_TIMEOUT", 0) <= 0:
+        return None
+    try:
+        return caches[CACHE_ALIAS]
+    except InvalidCacheBackendError:
+        return None
+
+
+def _user_version_key(user_id):
+    return f"ranking:ver:user:{user_id}"
+
+
+def _new_version():
+    """
+    版番号の初期値。間引かれた版番号を作り直しても、それまでに使った
+    どの版（初期値 + 版上げの回数）とも重ならないよう時刻から作る。
+    """
+    return time.time_ns()
+
+
+def _get_version(cache, key):
+    version = cache.get(key)
+    if version is None:
+        # 版番号は期限切れにしない（MAX_ENTRIES の間引きでは消えうる）
+        cache.add(key, _new_version(), timeout=None)
+        version = cache.get(key)
+        if version is None:
+            # 入れた直後に間引かれた。この回は作った値をそのまま使う
+            version = _new_version()
+    return version
+
+
+def _bump(key):
+    cache = _cache()
+    if cache is None:
+        return
+    try:
+        cache.incr(key)
+    except ValueError:
+        # 版番号が無い（まだ作っていないか、間引かれた）。
+        # 時刻から作り直すので、以前のどの版とも重ならない
+        cache.add(key, _new_version(), timeout=None)
+
+
+def bump_user_version(user_id):
+    """
+    ユーザーの評価が変わったことを知らせる。
+
+    コミット後に版を上げる。コミット前に上げると、その間に別のリクエストが
+    古いデータで集計した結果を新しい版のキーで保存してしまうため。
+    """
+    transaction.on_commit(lambda: _bump(_user_version_key(user_id)))
+
+
+def bump_catalog_version():
+    """曲・歌手の情報が変わったことを知らせる（全ユーザーの結果が対象）。"""
+    transaction.on_commit(lambda: _bump(_CATALOG_VERSION_KEY))
+
+
+def data_version(user_id):
+    """
+    (ユーザー版, カタログ版) を返す。キャッシュが無効なら None。
+    集計結果以外のもの（songs.ranking_engine が取り出した配列など）を
+    同じ版で使い回すときに使う。
+    """
+    cache = _cache()
+    if cache is None:
+        return None
+    return (
+        _get_version(cache, _user_version_key(user_id)),
+        _get_version(cache, _CATALOG_VERSION_KEY),
+    )
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def cache_stats():
+    """このプロセスでのヒット/ミス件数を返す。"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_cache_stats():
+    with _stats_lock:
+        for k in _stats:
+            _stats[k] = 0
+
+
+def _cache_key(name, arguments, versions):
+    """
+    (関数名, 引数, 版番号) からキーを作る。
+    memcached の長さ制限・使用不可文字を避けるため、引数部分はハッシュにする。
+    """
+    raw = "&".join(f"{k}={arguments[k]!r}" for k in sorted(arguments))
+    digest = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+    user_version, catalog_version = versions
+    return (
+        f"ranking:{arguments.get('user_id')}:{user_version}:{catalog_version}:"
+        f"{name}:{digest}"
+    )
+
+
+def cached_call(name, arguments, compute):
+    """
+    集計関数の結果をキャッシュ経由で返す。
+    name: 関数名 / arguments: 既定値込みの引数 dict / compute: 実際に集計する関数
+    """
+    cache = _cache()
+    if cache is None or arguments.get("user_id") is None:
+        return compute()
+
+    versions = data_version(arguments["user_id"])
+    arguments = dict(arguments)
+    # region_id は "1" と 1 が同じ意味で渡ってくるので揃える（空は全地域）
+    if "region_id" in arguments:
+        arguments["region_id"] = int(arguments["region_id"] or 0)
+    if "top_ns" in arguments:
+        arguments["top_ns"] = tuple(int(n) for n in arguments["top_ns"])
+    arguments["backend"] = getattr(settings, "RANKING_BACKEND", "sql")
+    key = _cache_key(name, arguments, versions)
+
+    result = cache.get(key)
+    if result is not None:
+        _count("hits")
+        record_cache(hit=True)
+        return result
+
+    _count("misses")
+    record_cache(hit=False)
+    result = compute()
+    cache.set(key, result, timeout=settings.RANKING_CACHE_TIMEOUT)
+    return result
@@ -0,0 +1,541 @@
+"""
+ランキングを NumPy で集計する実装（RANKING_BACKEND=numpy）。
+
+services.py の CTE は画面を開くたびに、集計軸ごと・top_n ごとに
+ウィンドウ関数（ROW_NUMBER / RANK / SUM）を DB に計算させる。共有の
+MySQL が混んでいるときはこれが一番重い。ここではユーザーの非カバー曲の
+評価を1回のクエリで列の配列として取り出し、グループ内の並び・順位・
+TOP N の合計・「その他」をすべて NumPy で計算する。
+
+  - DB に残すのは照合順序が絡む比較だけ。曲名・歌手名・作詞/作曲/年の
+    UPPER() 順と、GROUP BY 相当のグループ分けを DENSE_RANK の番号として
+    取得時に一緒に受け取る（大文字小文字やアクセントの扱いを DB と揃えるため）。
+  - 点数は整数で持つ。カラオケ採点は 1000 倍して整数にするので、
+    合計も SQL の DECIMAL と同じく誤差なく計算できる。
+  - 取り出した配列はデータの版（songs.ranking_cache）ごとにプロセス内で
+    使い回す。同じ画面の TOP と「その他」、地域や TOP N の切り替えは
+    再取得せずに計算し直すだけになる。
+
+関数名・引数・戻り値は services.py と同じで、songs.rankings から差し替えて使う。
+SQL 版と一致しているかは manage.py check_rankings --backend numpy で確かめられる。
+numpy はこの実装を使うときだけ必要（requirements.txt には含めていない）。
+"""
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+
+from . import ranking_cache, services
+
+try:
+    import numpy as np
+except ImportError:  # RANKING_BACKEND=numpy にしない限り不要
+    np = None
+
+# カラオケ採点（小数3桁）を整数で持つための倍率
+_KARAOKE_SCALE = 1000
+
+# プロセス内で取り出した配列を持っておくユーザー数
+_MEMO_SIZE = 16
+
+_memo_lock = threading.Lock()
+_memo = OrderedDict()
+
+
+def _creator_keys_sql():
+    """作詞/作曲/年のグループ番号と UPPER() 順の番号を取る列。"""
+    return ",\n            ".join(
+        f"DENSE_RANK() OVER (ORDER BY s.{col}) AS {col}_group,\n"
+        f"            DENSE_RANK() OVER (ORDER BY UPPER(s.{col})) AS {col}_key"
+        for col, _ in services._CREATOR_COLUMNS.values()
+    )
+
+
+@dataclass
+class _UserArrays:
+    """1ユーザー分の評価（非カバー曲）。配列の添字は行番号で共通。"""
+
+    song_id: "np.ndarray"
+    artist_id: "np.ndarray"
+    region_id: "np.ndarray"
+    score: "np.ndarray"
+    has_score: "np.ndarray"
+    karaoke: "np.ndarray"
+    has_karaoke: "np.ndarray"
+    title_key: "np.ndarray"
+    artist_key: "np.ndarray"
+    # 集計軸ごとの (グループ番号, 並び順の番号, 集計対象か)
+    groups: dict
+    # 戻り値の dict に入れる値（文字列などは配列にせずリストのまま）
+    titles: list
+    artist_names: list
+    creators: dict
+
+
+def _require_numpy():
+    if np is None:
+        raise ImproperlyConfigured(
+            "RANKING_BACKEND=numpy には numpy が必要です（pip install numpy）"
+        )
+
+
+def _fetch(user_id):
+    """ユーザーの非カバー曲の評価を1回のクエリで取り出す。"""
+    _require_numpy()
+    sql = f"""
+        SELECT
+            s.id,
+            s.title,
+            s.artist_id,
+            a.name,
+            a.region_id,
+            r.score,
+            r.karaoke_score,
+            s.lyricist,
+            s.composer,
+            s.year,
+            DENSE_RANK() OVER (ORDER BY s.title_key) AS title_key,
+            DENSE_RANK() OVER (ORDER BY a.name_key) AS artist_key,
+            {_creator_keys_sql()}
+        FROM songs_rating r
+        JOIN songs_song s ON r.song_id = s.id
+        JOIN songs_artist a ON s.artist_id = a.id
+        WHERE r.user_id = %s
+          AND s.is_cover = 0
+          AND (r.score IS NOT NULL OR r.karaoke_score IS NOT NULL)
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [user_id])
+        rows = cursor.fetchall()
+
+    width = len(cursor.description)
+    columns = list(zip(*rows)) if rows else [()] * width
+    (
+        song_ids,
+        titles,
+        artist_ids,
+        artist_names,
+        region_ids,
+        scores,
+        karaoke_scores,
+        *rest,
+    ) = columns
+    creator_values = dict(zip(services._CREATOR_COLUMNS, rest[:3]))
+    title_keys, artist_keys, *creator_keys = rest[3:]
+
+    def ints(values):
+        return np.array([v or 0 for v in values], dtype=np.int64)
+
+    groups = {"artist": (ints(artist_ids), ints(artist_keys), np.ones(len(rows), bool))}
+    for i, (creator_type, (_, is_numeric)) in enumerate(
+        services._CREATOR_COLUMNS.items()
+    ):
+        values = creator_values[creator_type]
+        # services._creator_filtered_cte と同じく NULL（文字列は空文字も）は対象外
+        valid = np.array(
+            [v is not None and (is_numeric or v != "") for v in values], dtype=bool
+        )
+        groups[creator_type] = (
+            ints(creator_keys[2 * i]),
+            ints(creator_keys[2 * i + 1]),
+            valid,
+        )
+
+    return _UserArrays(
+        song_id=ints(song_ids),
+        artist_id=ints(artist_ids),
+        region_id=ints(region_ids),
+        score=ints(scores),
+        has_score=np.array([v is not None for v in scores], dtype=bool),
+        karaoke=np.array(
+            [
+                round(v * _KARAOKE_SCALE) if v is not None else 0
+                for v in karaoke_scores
+            ],
+            dtype=np.int64,
+        ),
+        has_karaoke=np.array([v is not None for v in karaoke_scores], dtype=bool),
+        title_key=ints(title_keys),
+        artist_key=ints(artist_keys),
+        groups=groups,
+        titles=list(titles),
+        artist_names=list(artist_names),
+        creators=creator_values,
+    )
+
+
+def _user_arrays(user_id):
+    """
+    ユーザーの配列を返す。データの版が同じ間はプロセス内で使い回す。
+    キャッシュが無効な設定（版が取れない）なら毎回取り出す。
+    """
+    version = ranking_cache.data_version(user_id)
+    if version is None:
+        return _fetch(user_id)
+
+    key = (user_id, version)
+    with _memo_lock:
+        arrays = _memo.get(key)
+        if arrays is not None:
+            _memo.move_to_end(key)
+            return arrays
+
+    arrays = _fetch(user_id)
+    with _memo_lock:
+        # 古い版の配列は同じユーザーの分だけ先に捨てる
+        for stale in [k for k in _memo if k[0] == user_id]:
+            del _memo[stale]
+        _memo[key] = arrays
+        while len(_memo) > _MEMO_SIZE:
+            _memo.popitem(last=False)
+    return arrays
+
+
+@dataclass
+class _Ranked:
+    """
+    ある (地域, 採点の種類, 集計軸) の並び替え結果。
+    rows 以下の配列は「グループ順 → 点数の降順 → 曲名順」に並んだ曲単位、
+    start 以下はグループ単位。
+    """
+
+    rows: "np.ndarray"  # _UserArrays の行番号
+    score: "np.ndarray"
+    order: "np.ndarray"  # ROW_NUMBER() OVER (PARTITION BY g ORDER BY score DESC, UPPER(title))
+    rank: "np.ndarray"  # RANK() OVER (PARTITION BY g ORDER BY score DESC)
+    group: "np.ndarray"  # 曲が属するグループの添字
+    start: "np.ndarray"
+    count: "np.ndarray"
+    sort_key: "np.ndarray"  # グループ名の UPPER() 順
+    cumsum: "np.ndarray"  # 先頭に 0 を付けた score の累積和
+
+
+def _rank(arrays, region_id, karaoke_mode, dimension):
+    """グループ内の通し番号・順位と、TOP N の合計に使う累積和を一度に計算する。"""
+    group_code, sort_key, valid = arrays.groups[dimension]
+    if karaoke_mode:
+        score, mask = arrays.karaoke, arrays.has_karaoke & valid
+    else:
+        score, mask = arrays.score, arrays.has_score & valid
+    if region_id:
+        mask = mask & (arrays.region_id == int(region_id))
+
+    rows = np.flatnonzero(mask)
+    # lexsort は最後のキーが第1キー。同じ曲名（UPPER）どうしは曲ID順にしておく
+    rows = rows[
+        np.lexsort(
+            (
+                arrays.song_id[rows],
+                arrays.title_key[rows],
+                -score[rows],
+                group_code[rows],
+            )
+        )
+    ]
+    codes = group_code[rows]
+    sorted_score = score[rows]
+    n = len(rows)
+    positions = np.arange(n)
+
+    is_start = np.ones(n, dtype=bool)
+    is_start[1:] = codes[1:] != codes[:-1]
+    start = np.flatnonzero(is_start)
+    group = np.cumsum(is_start) - 1
+    count = np.diff(np.append(start, n))
+
+    # 点数が変わった位置（とグループの先頭）から RANK を振る
+    is_new_score = is_start.copy()
+    is_new_score[1:] |= sorted_score[1:] != sorted_score[:-1]
+    last_new = np.maximum.accumulate(np.where(is_new_score, positions, 0))
+
+    return _Ranked(
+        rows=rows,
+        score=sorted_score,
+        order=positions - start[group] + 1,
+        rank=last_new - start[group] + 1,
+        group=group,
+        start=start,
+        count=count,
+        sort_key=sort_key[rows[start]],
+        cumsum=np.concatenate(([0], np.cumsum(sorted_score))),
+    )
+
+
+def _top_totals(ranked, top_n):
+    """グループごとの TOP N の合計。曲数が top_n に満たないグループは None 扱い（mask）。"""
+    qualified = ranked.count >= top_n
+    end = np.minimum(ranked.start + top_n, len(ranked.rows))
+    totals = ranked.cumsum[end] - ranked.cumsum[ranked.start]
+    return totals, qualified
+
+
+def _competition_rank(values):
+    """RANK() OVER (ORDER BY value DESC) 相当（同点は同順位、次は飛ばす）。"""
+    ascending = np.sort(values)
+    return len(values) - np.searchsorted(ascending, values, side="right") + 1
+
+
+def _score_value(value, karaoke_mode):
+    """整数で持っている点数を SQL 版と同じ型（好み度は int、カラオケは Decimal）に戻す。"""
+    value = int(value)
+    return Decimal(value).scaleb(-3) if karaoke_mode else value
+
+
+def _song_fields(arrays, i):
+    return {
+        "song_id": int(arrays.song_id[i]),
+        "song_title": arrays.titles[i],
+        "artist_id": int(arrays.artist_id[i]),
+        "artist_name": arrays.artist_names[i],
+    }
+
+
+def _credit_fields(arrays, i):
+    return {
+        "lyricist": arrays.creators["lyricist"][i],
+        "composer": arrays.creators["composer"][i],
+        "year": arrays.creators["year"][i],
+    }
+
+
+def _top_rows(ranked, top_n):
+    """
+    曲数が top_n 以上のグループの上位 top_n 曲を、
+    (グループ順位, グループ名, 通し番号) の順で返す。
+    戻り値: (曲の位置, グループの合計, グループの順位)
+    """
+    totals, qualified = _top_totals(ranked, top_n)
+    group_rank = np.zeros(len(totals), dtype=np.int64)
+    group_rank[qualified] = _competition_rank(totals[qualified])
+
+    picked = np.flatnonzero(qualified[ranked.group] & (ranked.order <= top_n))
+    g = ranked.group[picked]
+    picked = picked[np.lexsort((ranked.order[picked], ranked.sort_key[g], group_rank[g]))]
+    g = ranked.group[picked]
+    return picked, totals[g], group_rank[g]
+
+
+def _insufficient_rows(arrays, ranked, top_n):
+    """
+    曲数が top_n に満たないグループの曲を、点数の降順 → 歌手名 → 曲名で返す。
+    戻り値: (曲の位置, 点数の順位)
+    """
+    picked = np.flatnonzero(ranked.count[ranked.group] < top_n)
+    rows = ranked.rows[picked]
+    picked = picked[
+        np.lexsort(
+            (arrays.title_key[rows], arrays.artist_key[rows], -ranked.score[picked])
+        )
+    ]
+    return picked, _competition_rank(ranked.score[picked])
+
+
+def _check_creator_type(creator_type):
+    if creator_type not in services._CREATOR_COLUMNS:
+        raise ValueError(f"Invalid creator_type: {creator_type}")
+
+
+def call_artist_song_top_n(user_id, top_n, region_id, karaoke_mode=False):
+    """services.call_artist_song_top_n の NumPy 版。"""
+    return _artist_song_top_n(_user_arrays(user_id), top_n, region_id, karaoke_mode)
+
+
+def _artist_song_top_n(arrays, top_n, region_id, karaoke_mode):
+    ranked = _rank(arrays, region_id, karaoke_mode, "artist")
+    picked, totals, group_ranks = _top_rows(ranked, top_n)
+
+    result = []
+    for p, total, group_rank in zip(picked, totals, group_ranks):
+        i = ranked.rows[p]
+        result.append(
+            {
+                **_song_fields(arrays, i),
+                "region_id": int(arrays.region_id[i]) or None,
+                "score": _score_value(ranked.score[p], karaoke_mode),
+                "order_artist": int(ranked.order[p]),
+                "rank_artist": int(ranked.rank[p]),
+                "total_score": _score_value(total, karaoke_mode),
+                "artist_rank": int(group_rank),
+                **_credit_fields(arrays, i),
+            }
+        )
+    return result
+
+
+def call_creator_song_top_n(user_id, top_n, region_id, creator_type, karaoke_mode=False):
+    """services.call_creator_song_top_n の NumPy 版。"""
+    _check_creator_type(creator_type)
+    return _creator_song_top_n(
+        _user_arrays(user_id), top_n, region_id, creator_type, karaoke_mode
+    )
+
+
+def _creator_song_top_n(arrays, top_n, region_id, creator_type, karaoke_mode):
+    ranked = _rank(arrays, region_id, karaoke_mode, creator_type)
+    picked, totals, group_ranks = _top_rows(ranked, top_n)
+    creators = arrays.creators[creator_type]
+
+    result = []
+    for p, total, group_rank in zip(picked, totals, group_ranks):
+        i = ranked.rows[p]
+        # 照合順序で同じグループにまとまった値は、グループ先頭の曲の表記を使う
+        head = ranked.rows[ranked.start[ranked.group[p]]]
+        result.append(
+            {
+                "creator": creators[head],
+                "creator_rank": int(group_rank),
+                "total_score": _score_value(total, karaoke_mode),
+                **_song_fields(arrays, i),
+                "score": _score_value(ranked.score[p], karaoke_mode),
+                "rank_creator": int(ranked.rank[p]),
+                "order_creator": int(ranked.order[p]),
+                **_credit_fields(arrays, i),
+            }
+        )
+    return result
+
+
+def call_artist_insufficient_songs(user_id, top_n, region_id, karaoke_mode=False):
+    """services.call_artist_insufficient_songs の NumPy 版。"""
+    return _artist_insufficient_songs(
+        _user_arrays(user_id), top_n, region_id, karaoke_mode
+    )
+
+
+def _artist_insufficient_songs(arrays, top_n, region_id, karaoke_mode):
+    ranked = _rank(arrays, region_id, karaoke_mode, "artist")
+    picked, ranks = _insufficient_rows(arrays, ranked, top_n)
+
+    result = []
+    for p, rank in zip(picked, ranks):
+        i = ranked.rows[p]
+        result.append(
+            {
+                **_song_fields(arrays, i),
+                "region_id": int(arrays.region_id[i]) or None,
+                "score": _score_value(ranked.score[p], karaoke_mode),
+                "order_artist": int(ranked.order[p]),
+                **_credit_fields(arrays, i),
+                "rank_within_insufficient": int(rank),
+            }
+        )
+    return result
+
+
+def call_creator_insufficient_songs(
+    user_id, top_n, region_id, creator_type, karaoke_mode=False
+):
+    """services.call_creator_insufficient_songs の NumPy 版。"""
+    _check_creator_type(creator_type)
+    return _creator_insufficient_songs(
+        _user_arrays(user_id), top_n, region_id, creator_type, karaoke_mode
+    )
+
+
+def _creator_insufficient_songs(arrays, top_n, region_id, creator_type, karaoke_mode):
+    ranked = _rank(arrays, region_id, karaoke_mode, creator_type)
+    picked, ranks = _insufficient_rows(arrays, ranked, top_n)
+    creators = arrays.creators[creator_type]
+
+    result = []
+    for p, rank in zip(picked, ranks):
+        i = ranked.rows[p]
+        head = ranked.rows[ranked.start[ranked.group[p]]]
+        result.append(
+            {
+                "creator": creators[head],
+                **_song_fields(arrays, i),
+                "score": _score_value(ranked.score[p], karaoke_mode),
+                **_credit_fields(arrays, i),
+                "rank_within_insufficient": int(rank),
+            }
+        )
+    return result
+
+
+def call_group_prefix_sums(user_id, region_id, kind, karaoke_mode=False):
+    """services.call_group_prefix_sums の NumPy 版（_rank の累積和をそのまま切り出す）。"""
+    if kind != "artist":
+        _check_creator_type(kind)
+    return _group_prefix_sums(_user_arrays(user_id), region_id, kind, karaoke_mode)
+
+
+def _group_prefix_sums(arrays, region_id, kind, karaoke_mode):
+    ranked = _rank(arrays, region_id, karaoke_mode, kind)
+
+    groups = []
+    for g in np.argsort(ranked.sort_key, kind="stable"):
+        start, count = ranked.start[g], ranked.count[g]
+        head = ranked.rows[start]
+        prefix = (
+            ranked.cumsum[start + 1 : start + min(count, services.MAX_TOP_N) + 1]
+            - ranked.cumsum[start]
+        )
+        if kind == "artist":
+            group = {
+                "artist_id": int(arrays.artist_id[head]),
+                "artist_name": arrays.artist_names[head],
+                "region_id": int(arrays.region_id[head]) or None,
+            }
+        else:
+            group = {"creator": arrays.creators[kind][head]}
+        group["song_count"] = int(count)
+        group["prefix"] = [_score_value(v, karaoke_mode) for v in prefix]
+        groups.append(group)
+    return groups
+
+
+def _region_keys(arrays):
+    """評価のある地域（全地域の None を先頭に）。"""
+    return [None] + [int(r) for r in np.unique(arrays.region_id) if r]
+
+
+def call_group_prefix_sums_by_region(user_id, kind, karaoke_mode=False):
+    """services.call_group_prefix_sums_by_region の NumPy 版。"""
+    if kind != "artist":
+        _check_creator_type(kind)
+    arrays = _user_arrays(user_id)
+    regions = {}
+    for region_id in _region_keys(arrays):
+        groups = _group_prefix_sums(arrays, region_id, kind, karaoke_mode)
+        if groups:
+            regions[region_id] = groups
+    return regions
+
+
+def call_ranking_bundle(user_id, top_n, region_id):
+    """services.call_ranking_bundle の NumPy 版（評価の取り出しは1回だけ）。"""
+    return _ranking_bundle(_user_arrays(user_id), top_n, region_id)
+
+
+def _ranking_bundle(arrays, top_n, region_id):
+    bundle = {}
+    for kind in services.RANKING_KINDS:
+        for karaoke_mode in (False, True):
+            if kind == "artist":
+                top = _artist_song_top_n(arrays, top_n, region_id, karaoke_mode)
+                insufficient = _artist_insufficient_songs(
+                    arrays, top_n, region_id, karaoke_mode
+                )
+            else:
+                top = _creator_song_top_n(arrays, top_n, region_id, kind, karaoke_mode)
+                insufficient = _creator_insufficient_songs(
+                    arrays, top_n, region_id, kind, karaoke_mode
+                )
+            bundle[(kind, karaoke_mode)] = {"top": top, "insufficient": insufficient}
+    return bundle
+
+
+def call_ranking_bundle_by_region(user_id, top_n):
+    """services.call_ranking_bundle_by_region の NumPy 版（評価の取り出しは1回だけ）。"""
+    arrays = _user_arrays(user_id)
+    bundles = {}
+    for region_id in _region_keys(arrays):
+        bundle = _ranking_bundle(arrays, top_n, region_id)
+        if any(part["top"] or part["insufficient"] for part in bundle.values()):
+            bundles[region_id] = bundle
+    return bundles
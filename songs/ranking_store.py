@@ -0,0 +1,613 @@
+"""
+ランキングの集計テーブル（読み取りモデル）。
+
+services.py の CTE は画面を開くたびに、ユーザーの全評価に対して
+ウィンドウ関数を計算し直す。ここでは結果を RankingGroup / RankingEntry に
+持っておき、評価や曲情報が変わったときに影響するグループだけを作り直す。
+
+  RankingEntry: 曲単位。グループ内の通し番号（同点は曲名順）と順位
+  RankingGroup: グループ単位。評価済み曲数
+
+作り直しの単位は (ユーザー, 集計軸, グループ)。地域（全地域/各地域）と
+採点の種類（好み度/カラオケ採点）はその中でまとめて作る。
+書き込みは songs.signals から呼ばれるので、ビュー・API・admin のどこから
+保存しても追従する（QuerySet.update / bulk_create はシグナルが飛ばないので、
+使う場合は refresh_song / rebuild_user を自分で呼ぶこと）。
+
+読み出し関数は services.py と同じ名前・引数・戻り値にしてあり、
+songs.rankings から差し替えて使う。SQL 版と一致しているかは
+manage.py rebuild_rankings --check で確かめられる。
+"""
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BooleanField, Case, F, Q, Value, When, Window
+from django.db.models.functions import DenseRank, Upper
+
+from . import services
+from .models import Rating, RankingEntry, RankingGroup, Song
+
+DIMENSIONS = ("artist", "lyricist", "composer", "year")
+
+# 全地域を表す region_key
+ALL_REGIONS = 0
+
+# refresh_songs でグループ単位に作り直す上限。超えたらユーザー単位で作り直す
+REFRESH_GROUPS_MAX = 200
+
+# 作り直しに使う Rating 側の列
+_RATING_FIELDS = (
+    "song_id",
+    "score",
+    "karaoke_score",
+    "song__artist_id",
+    "song__artist__region_id",
+    "song__lyricist",
+    "song__composer",
+    "song__year",
+)
+
+# 文字列でグループを作る集計軸。グループの同一性は DB の照合順序で決める
+# （utf8mb4_ja_0900_as_cs はひらがなとカタカナを同じ値として扱うので、
+# Python の文字列比較でまとめると GROUP BY や一意制約と食い違う）
+_COLLATED_DIMENSIONS = ("lyricist", "composer")
+
+# 読み出しで曲情報として返す列（RankingEntry からの JOIN）
+_ENTRY_FIELDS = (
+    "group_key",
+    "order_in_group",
+    "rank_in_group",
+    "score",
+    "song_id",
+    "song__title",
+    "song__artist_id",
+    "song__artist__name",
+    "song__artist__region_id",
+    "song__lyricist",
+    "song__composer",
+    "song__year",
+)
+
+# 曲情報のうち、変わるとランキングに影響する列
+TRACKED_SONG_FIELDS = ("artist_id", "title", "is_cover", "lyricist", "composer", "year")
+
+
+def is_enabled():
+    """集計テーブルを維持・使用する設定になっているか。"""
+    return getattr(settings, "RANKING_BACKEND", "sql") == "store"
+
+
+# ===== 書き込み側 =====
+
+
+def _group_key(dimension, row):
+    """Rating の行から集計軸のグループキーを取り出す。集計対象外なら None。"""
+    if dimension == "artist":
+        return str(row["song__artist_id"])
+    value = row[f"song__{dimension}"]
+    # services._creator_filtered_cte と同じく NULL と空文字は対象外
+    if value is None or value == "":
+        return None
+    return str(value)
+
+
+def _song_group_keys(song):
+    """曲（values の dict）が属するグループを (集計軸, グループキー) の集合で返す。"""
+    row = {f"song__{k}": v for k, v in song.items()}
+    keys = set()
+    for dimension in DIMENSIONS:
+        key = _group_key(dimension, row)
+        if key is not None:
+            keys.add((dimension, key))
+    return keys
+
+
+def _build(user_id, rows, dimensions, targets=None):
+    """
+    Rating の行から RankingGroup / RankingEntry のインスタンスを組み立てる。
+
+    rows は曲名（UPPER）順に並んでいること。スコアの降順に安定ソートすると、
+    同点の曲は曲名順のまま残るので ORDER BY score DESC, UPPER(title) と一致する。
+    曲名の比較を Python 側でやらないのは、DB の照合順序と並びを揃えるため。
+
+    作詞者・作曲者は _rating_rows が付ける DB 側の番号（{集計軸}_group）で
+    まとめ、グループキーにはその中で最小の値を使う。
+    targets を渡したときは、その (集計軸, グループキー) に当たるグループだけ返す。
+    """
+    groups = []
+    entries = []
+    for dimension in dimensions:
+        collated = dimension in _COLLATED_DIMENSIONS
+        names = {}
+        if collated:
+            for row in rows:
+                key = _group_key(dimension, row)
+                if key is None:
+                    continue
+                ident = row[f"{dimension}_group"]
+                names[ident] = min(names.get(ident, key), key)
+
+        for karaoke_mode in (False, True):
+            score_field = "karaoke_score" if karaoke_mode else "score"
+
+            buckets = defaultdict(list)
+            for row in rows:
+                if row[score_field] is None:
+                    continue
+                key = _group_key(dimension, row)
+                if key is None:
+                    continue
+                if collated:
+                    key = names[row[f"{dimension}_group"]]
+                buckets[(ALL_REGIONS, key)].append(row)
+                region_id = row["song__artist__region_id"]
+                if region_id:
+                    buckets[(region_id, key)].append(row)
+
+            for (region_key, key), members in buckets.items():
+                if targets is not None:
+                    if collated:
+                        # 対象キーとの一致も DB の照合順序で判定したもの
+                        hit = any(r[f"{dimension}_targeted"] for r in members)
+                    else:
+                        hit = (dimension, key) in targets
+                    if not hit:
+                        continue
+                members.sort(key=lambda r: r[score_field], reverse=True)
+                scope = {
+                    "user_id": user_id,
+                    "region_key": region_key,
+                    "dimension": dimension,
+                    "karaoke_mode": karaoke_mode,
+                    "group_key": key,
+                }
+
+                rank = 0
+                prev_score = object()
+                for order, row in enumerate(members, start=1):
+                    score = row[score_field]
+                    if score != prev_score:
+                        rank = order
+                    prev_score = score
+                    entries.append(
+                        RankingEntry(
+                            song_id=row["song_id"],
+                            score=score,
+                            order_in_group=order,
+                            rank_in_group=rank,
+                            **scope,
+                        )
+                    )
+                groups.append(RankingGroup(song_count=len(members), **scope))
+    return groups, entries
+
+
+def _rating_rows(user_id, condition=None, targets=()):
+    """
+    ユーザーの非カバー曲の評価を曲名（UPPER）順で返す。
+
+    作詞者・作曲者には DENSE_RANK で DB の照合順序上のグループ番号を付ける
+    （ranking_engine と同じやり方）。targets を渡すと、その作詞者・作曲者と
+    照合順序で一致する行に {集計軸}_targeted = True を付ける。
+    """
+    qs = Rating.objects.filter(user_id=user_id, song__is_cover=False)
+    if condition is not None:
+        qs = qs.filter(condition)
+    annotations = {}
+    for dimension in _COLLATED_DIMENSIONS:
+        annotations[f"{dimension}_group"] = Window(
+            DenseRank(), order_by=F(f"song__{dimension}").asc()
+        )
+        keys = [key for dim, key in targets if dim == dimension]
+        annotations[f"{dimension}_targeted"] = (
+            Case(
+                When(**{f"song__{dimension}__in": keys}, then=Value(True)),
+                default=Value(False),
+                output_field=BooleanField(),
+            )
+            if keys
+            else Value(False, output_field=BooleanField())
+        )
+    return list(
+        qs.annotate(**annotations)
+        # 曲名が同じ曲は id 順（ウィンドウ関数を付けると DB の並びが変わるため明示する）
+        .order_by("song__title_key", "song_id")
+        .values(*_RATING_FIELDS, *annotations)
+    )
+
+
+@transaction.atomic
+def refresh_groups(user_id, targets):
+    """
+    指定グループだけ作り直す。
+    targets: (集計軸, グループキー) の iterable
+    """
+    targets = set(targets)
+    if not targets:
+        return
+
+    condition = Q()
+    for dimension, key in targets:
+        if dimension == "artist":
+            condition |= Q(song__artist_id=int(key))
+        elif dimension == "year":
+            condition |= Q(song__year=int(key))
+        else:
+            condition |= Q(**{f"song__{dimension}": key})
+
+    rows = _rating_rows(user_id, condition, targets)
+    # 取ってきた行のうち、対象グループに属するものだけ作る
+    # （OR 条件で一緒に引っかかった別グループの曲を書き込まないため）
+    groups, entries = _build(
+        user_id, rows, sorted({dimension for dimension, _ in targets}), targets
+    )
+
+    stale = Q()
+    for dimension, key in targets:
+        stale |= Q(dimension=dimension, group_key=key)
+    RankingEntry.objects.filter(stale, user_id=user_id).delete()
+    RankingGroup.objects.filter(stale, user_id=user_id).delete()
+    RankingGroup.objects.bulk_create(groups)
+    RankingEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+@transaction.atomic
+def rebuild_user(user_id):
+    """1ユーザー分を全部作り直す。戻り値: (グループ数, 曲行数)"""
+    rows = _rating_rows(user_id)
+    groups, entries = _build(user_id, rows, DIMENSIONS)
+    RankingEntry.objects.filter(user_id=user_id).delete()
+    RankingGroup.objects.filter(user_id=user_id).delete()
+    RankingGroup.objects.bulk_create(groups, batch_size=1000)
+    RankingEntry.objects.bulk_create(entries, batch_size=1000)
+    return len(groups), len(entries)
+
+
+def refresh_song(user_id, song_id, extra_targets=()):
+    """
+    ある曲の評価が変わったときに、その曲が属するグループを作り直す。
+    extra_targets には曲情報の変更前に属していたグループを渡す。
+    """
+    song = (
+        Song.objects.filter(pk=song_id)
+        .values("artist_id", "lyricist", "composer", "year")
+        .first()
+    )
+    targets = set(extra_targets)
+    if song is not None:
+        targets |= _song_group_keys(song)
+    refresh_groups(user_id, targets)
+
+
+def refresh_songs(user_id, song_ids):
+    """
+    複数の曲の評価がまとめて変わったとき（bulk_create での同期など）に、
+    それらの曲が属するグループを1回で作り直す。
+    グループが多すぎて OR 条件が長くなるときはユーザー単位で作り直す。
+    """
+    targets = set()
+    for song in Song.objects.filter(pk__in=song_ids).values(
+        "artist_id", "lyricist", "composer", "year"
+    ):
+        targets |= _song_group_keys(song)
+    if len(targets) > REFRESH_GROUPS_MAX:
+        rebuild_user(user_id)
+    else:
+        refresh_groups(user_id, targets)
+
+
+def song_snapshot(song_id):
+    """曲情報の変更前の値を取っておく（Song の pre_save から使う）。"""
+    return (
+        Song.objects.filter(pk=song_id).values(*TRACKED_SONG_FIELDS).first()
+    )
+
+
+def refresh_song_for_all_users(song_id, old_snapshot):
+    """曲情報が変わったときに、その曲を評価している全ユーザー分を作り直す。"""
+    old_targets = _song_group_keys(old_snapshot) if old_snapshot else set()
+    user_ids = (
+        Rating.objects.filter(song_id=song_id)
+        .values_list("user_id", flat=True)
+        .distinct()
+    )
+    for user_id in user_ids:
+        refresh_song(user_id, song_id, extra_targets=old_targets)
+
+
+def rebuild_users_of_artist(artist_id):
+    """
+    歌手の地域が変わったときに、その歌手の曲を評価している全ユーザー分を作り直す。
+    地域が変わると作詞/作曲/年のグループも地域別の行が入れ替わるので、
+    グループ単位ではなくユーザー単位で作り直す（めったに起きない操作のため）。
+    """
+    user_ids = (
+        Rating.objects.filter(song__artist_id=artist_id)
+        .values_list("user_id", flat=True)
+        .distinct()
+    )
+    for user_id in user_ids:
+        rebuild_user(user_id)
+
+
+# ===== 読み出し側（services.py と同じインタフェース） =====
+
+
+def _scope(user_id, region_id, dimension, karaoke_mode):
+    return {
+        "user_id": user_id,
+        "region_key": int(region_id) if region_id else ALL_REGIONS,
+        "dimension": dimension,
+        "karaoke_mode": bool(karaoke_mode),
+    }
+
+
+def _score_value(value, karaoke_mode):
+    """
+    DecimalField で持っている点数を SQL 版と同じ型に戻す。
+    好み度は整数、カラオケ採点は Decimal。
+    """
+    if value is None:
+        return None
+    return value if karaoke_mode else int(value)
+
+
+def _competition_ranks(values):
+    """降順に並んだ値に RANK() 相当の順位（同点は同順位、次は飛ばす）を振る。"""
+    ranks = []
+    prev = object()
+    rank = 0
+    for i, value in enumerate(values, start=1):
+        if value != prev:
+            rank = i
+        prev = value
+        ranks.append(rank)
+    return ranks
+
+
+def _creator_value(creator_type, key):
+    """group_key（文字列）を SQL 版の creator 列と同じ型に戻す。"""
+    return int(key) if creator_type == "year" else key
+
+
+def _top_entries(scope, top_n, group_order):
+    """
+    曲数が top_n 以上のグループについて、上位 top_n 曲を
+    (グループ順, 通し番号) で返し、グループの合計点と順位を付ける。
+    戻り値: [(entry, total, group_rank), ...]（group_rank の昇順）
+    """
+    qualified = RankingGroup.objects.filter(**scope, song_count__gte=top_n).values(
+        "group_key"
+    )
+    entries = list(
+        RankingEntry.objects.filter(
+            **scope, group_key__in=qualified, order_in_group__lte=top_n
+        )
+        .order_by(group_order, "order_in_group")
+        .values(*_ENTRY_FIELDS)
+    )
+
+    totals = defaultdict(int)
+    for e in entries:
+        totals[e["group_key"]] += e["score"]
+    # 合計点ごとの順位（RANK() OVER (ORDER BY total DESC) 相当）
+    rank_of = {}
+    for rank, value in enumerate(sorted(totals.values(), reverse=True), start=1):
+        rank_of.setdefault(value, rank)
+
+    result = [
+        (e, totals[e["group_key"]], rank_of[totals[e["group_key"]]]) for e in entries
+    ]
+    # 安定ソートなので、同順位内は DB で並べた (グループ名, 通し番号) 順のまま
+    result.sort(key=lambda x: x[2])
+    return result
+
+
+def call_artist_song_top_n(user_id, top_n, region_id, karaoke_mode=False):
+    """services.call_artist_song_top_n の集計テーブル版。"""
+    scope = _scope(user_id, region_id, "artist", karaoke_mode)
+    rows = []
+    for e, total, rank in _top_entries(scope, top_n, "song__artist__name_key"):
+        rows.append(
+            {
+                "song_id": e["song_id"],
+                "song_title": e["song__title"],
+                "artist_id": e["song__artist_id"],
+                "artist_name": e["song__artist__name"],
+                "region_id": e["song__artist__region_id"],
+                "score": _score_value(e["score"], karaoke_mode),
+                "order_artist": e["order_in_group"],
+                "rank_artist": e["rank_in_group"],
+                "total_score": _score_value(total, karaoke_mode),
+                "artist_rank": rank,
+                "lyricist": e["song__lyricist"],
+                "composer": e["song__composer"],
+                "year": e["song__year"],
+            }
+        )
+    return rows
+
+
+def call_creator_song_top_n(user_id, top_n, region_id, creator_type, karaoke_mode=False):
+    """services.call_creator_song_top_n の集計テーブル版。"""
+    if creator_type not in services._CREATOR_COLUMNS:
+        raise ValueError(f"Invalid creator_type: {creator_type}")
+    scope = _scope(user_id, region_id, creator_type, karaoke_mode)
+    rows = []
+    for e, total, rank in _top_entries(scope, top_n, Upper("group_key")):
+        rows.append(
+            {
+                "creator": _creator_value(creator_type, e["group_key"]),
+                "creator_rank": rank,
+                "total_score": _score_value(total, karaoke_mode),
+                "song_id": e["song_id"],
+                "song_title": e["song__title"],
+                "artist_id": e["song__artist_id"],
+                "artist_name": e["song__artist__name"],
+                "score": _score_value(e["score"], karaoke_mode),
+                "rank_creator": e["rank_in_group"],
+                "order_creator": e["order_in_group"],
+                "lyricist": e["song__lyricist"],
+                "composer": e["song__composer"],
+                "year": e["song__year"],
+            }
+        )
+    return rows
+
+
+def _insufficient_entries(scope, top_n):
+    """曲数が top_n に満たないグループの曲を、スコア降順→歌手名→曲名で返す。"""
+    insufficient = RankingGroup.objects.filter(
+        **scope, song_count__lt=top_n
+    ).values("group_key")
+    entries = list(
+        RankingEntry.objects.filter(**scope, group_key__in=insufficient)
+        .order_by("-score", "song__artist__name_key", "song__title_key")
+        .values(*_ENTRY_FIELDS)
+    )
+    ranks = _competition_ranks([e["score"] for e in entries])
+    return zip(entries, ranks)
+
+
+def call_artist_insufficient_songs(user_id, top_n, region_id, karaoke_mode=False):
+    """services.call_artist_insufficient_songs の集計テーブル版。"""
+    scope = _scope(user_id, region_id, "artist", karaoke_mode)
+    return [
+        {
+            "song_id": e["song_id"],
+            "song_title": e["song__title"],
+            "artist_id": e["song__artist_id"],
+            "artist_name": e["song__artist__name"],
+            "region_id": e["song__artist__region_id"],
+            "score": _score_value(e["score"], karaoke_mode),
+            "order_artist": e["order_in_group"],
+            "lyricist": e["song__lyricist"],
+            "composer": e["song__composer"],
+            "year": e["song__year"],
+            "rank_within_insufficient": rank,
+        }
+        for e, rank in _insufficient_entries(scope, top_n)
+    ]
+
+
+def call_creator_insufficient_songs(
+    user_id, top_n, region_id, creator_type, karaoke_mode=False
+):
+    """services.call_creator_insufficient_songs の集計テーブル版。"""
+    if creator_type not in services._CREATOR_COLUMNS:
+        raise ValueError(f"Invalid creator_type: {creator_type}")
+    scope = _scope(user_id, region_id, creator_type, karaoke_mode)
+    return [
+        {
+            "creator": _creator_value(creator_type, e["group_key"]),
+            "song_id": e["song_id"],
+            "song_title": e["song__title"],
+            "artist_id": e["song__artist_id"],
+            "artist_name": e["song__artist__name"],
+            "score": _score_value(e["score"], karaoke_mode),
+            "lyricist": e["song__lyricist"],
+            "composer": e["song__composer"],
+            "year": e["song__year"],
+            "rank_within_insufficient": rank,
+        }
+        for e, rank in _insufficient_entries(scope, top_n)
+    ]
+
+
+def call_group_prefix_sums(user_id, region_id, kind, karaoke_mode=False):
+    """services.call_group_prefix_sums の集計テーブル版。"""
+    if kind != "artist" and kind not in services._CREATOR_COLUMNS:
+        raise ValueError(f"Invalid kind: {kind}")
+    scope = _scope(user_id, region_id, kind, karaoke_mode)
+    counts = dict(
+        RankingGroup.objects.filter(**scope).values_list("group_key", "song_count")
+    )
+    name = "song__artist__name_key" if kind == "artist" else Upper("group_key")
+    entries = (
+        RankingEntry.objects.filter(
+            **scope, order_in_group__lte=services.MAX_TOP_N
+        )
+        .order_by(name, "group_key", "order_in_group")
+        .values(
+            "group_key",
+            "order_in_group",
+            "score",
+            "song__artist__name",
+            "song__artist__region_id",
+        )
+    )
+
+    groups = []
+    for e in entries:
+        if e["order_in_group"] == 1:
+            if kind == "artist":
+                group = {
+                    "artist_id": int(e["group_key"]),
+                    "artist_name": e["song__artist__name"],
+                    "region_id": e["song__artist__region_id"],
+                }
+            else:
+                group = {"creator": _creator_value(kind, e["group_key"])}
+            group["song_count"] = counts[e["group_key"]]
+            group["prefix"] = []
+            running = 0
+            groups.append(group)
+        running += e["score"]
+        group["prefix"].append(_score_value(running, karaoke_mode))
+    return groups
+
+
+def call_ranking_bundle(user_id, top_n, region_id):
+    """services.call_ranking_bundle の集計テーブル版（各集計軸の関数を組み合わせる）。"""
+    bundle = {}
+    for kind in services.RANKING_KINDS:
+        for karaoke_mode in (False, True):
+            if kind == "artist":
+                top = call_artist_song_top_n(user_id, top_n, region_id, karaoke_mode)
+                insufficient = call_artist_insufficient_songs(
+                    user_id, top_n, region_id, karaoke_mode
+                )
+            else:
+                top = call_creator_song_top_n(
+                    user_id, top_n, region_id, kind, karaoke_mode
+                )
+                insufficient = call_creator_insufficient_songs(
+                    user_id, top_n, region_id, kind, karaoke_mode
+                )
+            bundle[(kind, karaoke_mode)] = {"top": top, "insufficient": insufficient}
+    return bundle
+
+
+def _region_keys(user_id, **filters):
+    """集計テーブルに行のある地域（全地域の None を先頭に）。"""
+    keys = (
+        RankingGroup.objects.filter(user_id=user_id, **filters)
+        .exclude(region_key=ALL_REGIONS)
+        .values_list("region_key", flat=True)
+        .distinct()
+        .order_by("region_key")
+    )
+    return [None] + list(keys)
+
+
+def call_group_prefix_sums_by_region(user_id, kind, karaoke_mode=False):
+    """services.call_group_prefix_sums_by_region の集計テーブル版（地域ごとに読む）。"""
+    regions = {}
+    filters = {"dimension": kind, "karaoke_mode": bool(karaoke_mode)}
+    for region_id in _region_keys(user_id, **filters):
+        groups = call_group_prefix_sums(user_id, region_id, kind, karaoke_mode)
+        if groups:
+            regions[region_id] = groups
+    return regions
+
+
+def call_ranking_bundle_by_region(user_id, top_n):
+    """services.call_ranking_bundle_by_region の集計テーブル版（地域ごとに読む）。"""
+    bundles = {}
+    for region_id in _region_keys(user_id):
+        bundle = call_ranking_bundle(user_id, top_n, region_id)
+        if any(part["top"] or part["insufficient"] for part in bundle.values()):
+            bundles[region_id] = bundle
+    return bundles
@@ -0,0 +1,110 @@
+"""
+ランキング集計の窓口。views はここ経由で services.py 相当の関数を呼ぶ。
+
+settings.RANKING_BACKEND で実装を切り替える。
+  "sql"   : songs.services（表示のたびにウィンドウ関数の CTE を実行する）
+  "store" : songs.ranking_store（書き込み時に更新しておく集計テーブルを読む）
+  "numpy" : songs.ranking_engine（評価を1回で取り出し、NumPy で集計する）
+
+どの実装も関数名・引数・戻り値は services.py と同じ。
+実装側に無い関数（call_song_ranking など）は services.py にフォールバックする。
+結果は songs.ranking_cache でキャッシュする（データの版が変わるまで使い回す）。
+
+call_artist_top_n_multi / call_creator_top_n_multi だけは実装に直接渡さず、
+キャッシュしたグループごとの累積和（call_group_prefix_sums）から組み立てる。
+画面で top_n の組を変えても、集計し直さずに済む。
+
+call_ranking_bundle / call_group_prefix_sums も実装に地域ごとには渡さず、
+全地域＋地域別をまとめて集計する *_by_region の結果（キャッシュは1件）から
+地域を切り出す。地域タブを切り替えても集計し直さずに済む。
+"""
+
+import inspect
+from importlib import import_module
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from . import metrics, ranking_cache, services
+from .services import MAX_TOP_N, TOP_NS  # noqa: F401  views が選択肢に使う
+
+RANKING_BACKENDS = {
+    "sql": "songs.services",
+    "store": "songs.ranking_store",
+    "numpy": "songs.ranking_engine",
+}
+
+
+def _backend():
+    name = getattr(settings, "RANKING_BACKEND", "sql")
+    try:
+        return import_module(RANKING_BACKENDS[name])
+    except KeyError:
+        raise ImproperlyConfigured(f"RANKING_BACKEND が不正です: {name}")
+
+
+def _dispatch(name):
+    signature = inspect.signature(getattr(services, name))
+
+    def call(*args, **kwargs):
+        func = getattr(_backend(), name, None) or getattr(services, name)
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+
+        def compute():
+            metrics.inc(
+                "music_ranking_computations_total",
+                function=name,
+                backend=getattr(settings, "RANKING_BACKEND", "sql"),
+            )
+            return func(*args, **kwargs)
+
+        return ranking_cache.cached_call(name, bound.arguments, compute)
+
+    call.__name__ = name
+    call.__doc__ = getattr(services, name).__doc__
+    return call
+
+
+call_artist_song_top_n = _dispatch("call_artist_song_top_n")
+call_artist_insufficient_songs = _dispatch("call_artist_insufficient_songs")
+call_creator_song_top_n = _dispatch("call_creator_song_top_n")
+call_creator_insufficient_songs = _dispatch("call_creator_insufficient_songs")
+call_group_prefix_sums_by_region = _dispatch("call_group_prefix_sums_by_region")
+call_ranking_bundle_by_region = _dispatch("call_ranking_bundle_by_region")
+call_song_ranking = _dispatch("call_song_ranking")
+call_song_ranking_page = _dispatch("call_song_ranking_page")
+count_song_ranking = _dispatch("count_song_ranking")
+
+
+def _region_key(region_id):
+    """*_by_region の結果のキー（全地域は None。"1" と 1 は同じ地域）。"""
+    return int(region_id) if region_id else None
+
+
+def call_ranking_bundle(user_id, top_n, region_id):
+    """services.call_ranking_bundle と同じ（地域別まとめのキャッシュから切り出す）。"""
+    bundles = call_ranking_bundle_by_region(user_id, top_n)
+    return bundles.get(_region_key(region_id)) or services.empty_ranking_bundle()
+
+
+def call_group_prefix_sums(user_id, region_id, kind, karaoke_mode=False):
+    """services.call_group_prefix_sums と同じ（地域別まとめのキャッシュから切り出す）。"""
+    regions = call_group_prefix_sums_by_region(user_id, kind, karaoke_mode)
+    return regions.get(_region_key(region_id), [])
+
+
+def call_artist_top_n_multi(user_id, region_id, top_ns=TOP_NS, karaoke_mode=False):
+    """services.call_artist_top_n_multi と同じ（累積和のキャッシュから組み立てる）。"""
+    groups = call_group_prefix_sums(user_id, region_id, "artist", karaoke_mode)
+    return services.rows_from_prefix_sums("artist", groups, top_ns, with_order=True)
+
+
+def call_creator_top_n_multi(
+    user_id, region_id, creator_type, top_ns=TOP_NS, karaoke_mode=False
+):
+    """services.call_creator_top_n_multi と同じ（累積和のキャッシュから組み立てる）。"""
+    if creator_type not in services._CREATOR_COLUMNS:
+        raise ValueError(f"Invalid creator_type: {creator_type}")
+    groups = call_group_prefix_sums(user_id, region_id, creator_type, karaoke_mode)
+    return services.rows_from_prefix_sums(creator_type, groups, top_ns)
@@ -0,0 +1,416 @@
+"""
+オフライン端末からの評価のまとめて同期（POST /api/ratings/score/batch）。
+
+/api/ratings/score/update は1曲ごとに1リクエストで、曲の検索・評価の読み込み・
+保存をそれぞれ SQL で行う。オフラインで数百曲を採点した端末が同期すると、
+その数だけ往復と SQL が出ていた。ここでは1回のリクエストで受け取り、
+
+  - 曲の特定（song_id / 歌手名＋曲名）を項目数によらない回数の SQL でまとめて行い
+  - 既存の評価を1回で読み（行ロック付き）、後勝ちを Python で判定して
+  - bulk_create(update_conflicts=True) で1回の upsert として書く（1トランザクション）
+
+項目ごとの指定:
+  key               冪等キー（64文字まで、任意）。処理済みのキーは書き込まずに
+                    前回の結果を返す（replayed: true）。送り直しても二重にならない
+  song_id           曲の id。無ければ artist / title で探す（update_score と同じ規則）
+  score             好み度 0〜100 の整数（karaoke_score とどちらか必須）
+  karaoke_score     カラオケ採点 0〜100
+  client_updated_at 端末で採点した時刻（ISO 8601）。無ければ受け取った時刻
+
+後勝ちは client_updated_at と、サーバー上の評価の最終更新
+（Rating.last_modified）を比べる。古い項目は書かずに stale として今の値を返す。
+未来の時刻は受け取った時刻に丸める（時計のずれた端末が以降の更新を塞がないため）。
+
+bulk_create はシグナルが飛ばないので、ランキングの版上げ・集計テーブルの
+作り直し・メトリクスはここで自分で行う。
+"""
+
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import metrics, ranking_cache, ranking_store
+from .models import ArtistAlias, Rating, RatingSyncReceipt, Song
+from .utils import normalize
+
+# 1リクエストで受け取る項目数の上限
+MAX_ITEMS = 500
+
+STATUS_CREATED = "created"
+STATUS_UPDATED = "updated"
+STATUS_STALE = "stale"
+STATUS_NOT_FOUND = "not_found"
+STATUS_INVALID = "invalid"
+
+# 受領を残す結果（見つからない・不正な項目は、直して送り直せば通るので残さない）
+_RECEIPT_STATUSES = {STATUS_CREATED, STATUS_UPDATED, STATUS_STALE}
+
+_KEY_MAX_LENGTH = RatingSyncReceipt._meta.get_field("key").max_length
+_KARAOKE_EXPONENT = Decimal(1).scaleb(
+    -Rating._meta.get_field("karaoke_score").decimal_places
+)
+
+
+def _present(value):
+    return value is not None and str(value).strip() != ""
+
+
+def _parse_item(raw, now):
+    """
+    1項目を検査して dict にする。不正なら (None, エラーメッセージ)。
+    メッセージは update_score と同じ。
+    """
+    if not isinstance(raw, dict):
+        return None, "項目はオブジェクトで指定してください"
+
+    key = raw.get("key")
+    if key is not None and (
+        not isinstance(key, str) or not key or len(key) > _KEY_MAX_LENGTH
+    ):
+        return None, f"key は {_KEY_MAX_LENGTH} 文字以内の文字列で指定してください"
+
+    item = {"key": key, "song_id": None, "artist": None, "title": None}
+    if _present(raw.get("song_id")):
+        try:
+            item["song_id"] = int(raw["song_id"])
+        except (TypeError, ValueError):
+            return None, "song_id は整数で指定してください"
+    else:
+        artist, title = raw.get("artist"), raw.get("title")
+        if not isinstance(artist, str) or not isinstance(title, str):
+            return None, "song_id または artist/title が必要です"
+        if not artist.strip() or not title.strip():
+            return None, "song_id または artist/title が必要です"
+        item["artist"], item["title"] = artist, title
+
+    has_score = _present(raw.get("score"))
+    has_karaoke = _present(raw.get("karaoke_score"))
+    if not has_score and not has_karaoke:
+        return None, "score または karaoke_score が必要です"
+    item["has_score"], item["has_karaoke"] = has_score, has_karaoke
+
+    item["score"] = None
+    if has_score:
+        try:
+            item["score"] = int(raw["score"])
+        except (TypeError, ValueError):
+            return None, "score は整数で指定してください"
+        if not (0 <= item["score"] <= 100):
+            return None, "score は 0〜100 で指定してください"
+
+    item["karaoke_score"] = None
+    if has_karaoke:
+        try:
+            value = Decimal(str(raw["karaoke_score"]))
+        except (TypeError, ValueError, InvalidOperation):
+            return None, "karaoke_score は数値で指定してください"
+        # NaN / Infinity は比較できない（比較すると InvalidOperation になる）
+        if not value.is_finite():
+            return None, "karaoke_score は数値で指定してください"
+        if not (Decimal("0") <= value <= Decimal("100")):
+            return None, "karaoke_score は 0〜100 で指定してください"
+        # 列の桁に丸めておく（結果に返す値を保存される値と揃える）
+        item["karaoke_score"] = value.quantize(_KARAOKE_EXPONENT)
+
+    stamp = now
+    if _present(raw.get("client_updated_at")):
+        try:
+            stamp = parse_datetime(str(raw["client_updated_at"]))
+        except ValueError:
+            stamp = None
+        if stamp is None:
+            return None, "client_updated_at は ISO 8601 の日時で指定してください"
+        if timezone.is_naive(stamp):
+            stamp = timezone.make_aware(stamp)
+        stamp = min(stamp, now)
+    item["client_updated_at"] = stamp
+    return item, None
+
+
+# ===== 曲の特定（項目数によらない回数の SQL） =====
+
+_SONG_FIELDS = ("id", "title", "artist__name")
+
+
+def _songs_by_id(song_ids):
+    if not song_ids:
+        return {}
+    return {
+        row["id"]: row
+        for row in Song.objects.filter(id__in=song_ids).values(*_SONG_FIELDS)
+    }
+
+
+def _songs_by_format_names(pairs):
+    """
+    (歌手名, 曲名) -> 曲。find_song_loose_readonly の 1) と同じ、
+    format_name / format_title の厳密一致（歌手・名義・別表記）。
+    """
+    keys = {pair: (normalize(pair[0]), normalize(pair[1])) for pair in pairs}
+    names = {fn for fn, _ft in keys.values()}
+    titles = {ft for _fn, ft in keys.values()}
+
+    alias_artists = {}
+    for name, artist_id in ArtistAlias.objects.filter(
+        format_name__in=names
+    ).values_list("format_name", "artist_id"):
+        alias_artists.setdefault(name, set()).add(artist_id)
+    all_alias_artists = set().union(*alias_artists.values()) if alias_artists else set()
+
+    rows = (
+        Song.objects.filter(
+            Q(artist__format_name__in=names)
+            | Q(credit__format_name__in=names)
+            | Q(artist_id__in=all_alias_artists),
+            format_title__in=titles,
+        )
+        .order_by("id")
+        .values(
+            *_SONG_FIELDS,
+            "format_title",
+            "artist_id",
+            "artist__format_name",
+            "credit__format_name",
+        )
+    )
+    by_title = {}
+    for row in rows:
+        by_title.setdefault(row["format_title"], []).append(row)
+    found = {}
+    for pair, (fn, ft) in keys.items():
+        for row in by_title.get(ft, ()):
+            if fn in (row["artist__format_name"], row["credit__format_name"]) or row[
+                "artist_id"
+            ] in alias_artists.get(fn, ()):
+                found[pair] = row
+                break
+    return found
+
+
+def _songs_by_names(pairs):
+    """(歌手名, 曲名) -> 曲。find_song_loose_readonly の 2) と同じ大文字小文字無視の一致。"""
+    keys = {pair: (pair[0].strip().lower(), pair[1].strip().lower()) for pair in pairs}
+    names = {name for name, _title in keys.values()}
+    titles = {title for _name, title in keys.values()}
+
+    alias_artists = {}
+    for name, artist_id in (
+        ArtistAlias.objects.annotate(lower_name=Lower("name"))
+        .filter(lower_name__in=names)
+        .values_list("name", "artist_id")
+    ):
+        alias_artists.setdefault(name.lower(), set()).add(artist_id)
+    all_alias_artists = set().union(*alias_artists.values()) if alias_artists else set()
+
+    rows = (
+        Song.objects.annotate(
+            lower_title=Lower("title"),
+            lower_artist=Lower("artist__name"),
+            lower_credit=Lower("credit__name"),
+        )
+        .filter(
+            Q(lower_artist__in=names)
+            | Q(lower_credit__in=names)
+            | Q(artist_id__in=all_alias_artists),
+            lower_title__in=titles,
+        )
+        .order_by("id")
+        .values(*_SONG_FIELDS, "artist_id", "credit__name")
+    )
+    by_title = {}
+    for row in rows:
+        by_title.setdefault(row["title"].lower(), []).append(row)
+    found = {}
+    for pair, (name, title) in keys.items():
+        for row in by_title.get(title, ()):
+            if (
+                name == row["artist__name"].lower()
+                or name == (row["credit__name"] or "").lower()
+                or row["artist_id"] in alias_artists.get(name, ())
+            ):
+                found[pair] = row
+                break
+    return found
+
+
+def _resolve(items):
+    """各項目に曲（values の dict、見つからなければ None）を付ける。"""
+    by_id = _songs_by_id({item["song_id"] for item in items if item["song_id"]})
+    pairs = {(item["artist"], item["title"]) for item in items if not item["song_id"]}
+    by_name = _songs_by_format_names(pairs) if pairs else {}
+    rest = pairs - by_name.keys()
+    if rest:
+        by_name.update(_songs_by_names(rest))
+    for item in items:
+        if item["song_id"]:
+            item["song"] = by_id.get(item["song_id"])
+        else:
+            item["song"] = by_name.get((item["artist"], item["title"]))
+
+
+# ===== 書き込み =====
+
+
+def _result(item, status, rating=None):
+    song = item["song"]
+    result = {
+        "key": item["key"],
+        "status": status,
+        "song_id": song["id"],
+        "artist": song["artist__name"],
+        "title": song["title"],
+    }
+    if rating is not None:
+        result["score"] = rating.score
+        result["karaoke_score"] = (
+            str(rating.karaoke_score) if rating.karaoke_score is not None else None
+        )
+    return result
+
+
+def _upsert(ratings):
+    """評価を1回の INSERT ... ON CONFLICT / ON DUPLICATE KEY UPDATE で書く。"""
+    # MySQL は衝突する一意キーを指定できない（行に一意キーは (user, song) しか無い）
+    unique_fields = (
+        ["user", "song"]
+        if connection.features.supports_update_conflicts_with_target
+        else None
+    )
+    Rating.objects.bulk_create(
+        ratings,
+        update_conflicts=True,
+        unique_fields=unique_fields,
+        update_fields=["score", "karaoke_score", "updated_at", "client_updated_at"],
+    )
+
+
+def _apply(user, items):
+    """
+    曲の見つかった項目を後勝ちで当てる。戻り値: 書き込んだ曲の id の集合。
+    同じ曲の項目が複数あれば、端末の時刻の順に当てる（最後のものが残る）。
+    """
+    song_ids = {item["song"]["id"] for item in items}
+    current = {
+        rating.song_id: rating
+        for rating in Rating.objects.select_for_update()
+        .filter(user=user, song_id__in=song_ids)
+        .only("song_id", "score", "karaoke_score", "updated_at", "client_updated_at")
+    }
+
+    changed = {}
+    for item in sorted(items, key=lambda item: item["client_updated_at"]):
+        song_id = item["song"]["id"]
+        rating = current.get(song_id)
+        if rating is not None and item["client_updated_at"] < rating.last_modified:
+            item["result"] = _result(item, STATUS_STALE, rating)
+            continue
+        new = Rating(
+            user=user,
+            song_id=song_id,
+            score=rating.score if rating is not None else None,
+            karaoke_score=rating.karaoke_score if rating is not None else None,
+            client_updated_at=item["client_updated_at"],
+        )
+        if item["has_score"]:
+            new.score = item["score"]
+        if item["has_karaoke"]:
+            new.karaoke_score = item["karaoke_score"]
+        status = STATUS_CREATED if rating is None else STATUS_UPDATED
+        item["result"] = _result(item, status, new)
+        current[song_id] = changed[song_id] = new
+
+    if changed:
+        _upsert(list(changed.values()))
+    return set(changed)
+
+
+def _save_receipts(user, items, now):
+    days = getattr(settings, "RATING_SYNC_RECEIPT_DAYS", 30)
+    RatingSyncReceipt.objects.filter(
+        user=user, created_at__lt=now - timedelta(days=days)
+    ).delete()
+    # 同じキーの同時の送り直しは、後から来た方の受領を捨てる（書き込みは後勝ちで同じ結果）
+    RatingSyncReceipt.objects.bulk_create(
+        [
+            RatingSyncReceipt(user=user, key=item["key"], result=item["result"])
+            for item in items
+            if item["key"] and item["result"]["status"] in _RECEIPT_STATUSES
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def sync_ratings(user, raw_items):
+    """
+    評価をまとめて同期する。戻り値: 送られた順の項目ごとの結果のリスト。
+    各結果には index（送られた位置）と status が入る。
+    """
+    now = timezone.now()
+    results = [None] * len(raw_items)
+    items = []
+    for index, raw in enumerate(raw_items):
+        item, error = _parse_item(raw, now)
+        if error:
+            results[index] = {
+                "key": raw.get("key") if isinstance(raw, dict) else None,
+                "status": STATUS_INVALID,
+                "detail": error,
+            }
+        else:
+            item["index"] = index
+            items.append(item)
+
+    # 処理済みのキー（前回の同期、または同じリクエストの先の項目）は結果を返すだけ
+    keys = {item["key"] for item in items if item["key"]}
+    receipts = dict(
+        RatingSyncReceipt.objects.filter(user=user, key__in=keys).values_list(
+            "key", "result"
+        )
+        if keys
+        else ()
+    )
+    first_of_key = {}
+    pending, repeats = [], []
+    for item in items:
+        key = item["key"]
+        if key in receipts:
+            results[item["index"]] = {**receipts[key], "replayed": True}
+        elif key and key in first_of_key:
+            repeats.append((item, first_of_key[key]))
+        else:
+            if key:
+                first_of_key[key] = item
+            pending.append(item)
+
+    if pending:
+        _resolve(pending)
+    found = [item for item in pending if item["song"] is not None]
+    for item in pending:
+        if item["song"] is None:
+            item["result"] = {"key": item["key"], "status": STATUS_NOT_FOUND}
+
+    changed = set()
+    if found:
+        with transaction.atomic():
+            changed = _apply(user, found)
+            _save_receipts(user, found, now)
+            if changed:
+                ranking_cache.bump_user_version(user.id)
+                if ranking_store.is_enabled():
+                    ranking_store.refresh_songs(user.id, changed)
+    if changed:
+        metrics.inc("music_rating_writes_total", len(changed), operation="save")
+
+    for item in pending:
+        results[item["index"]] = item["result"]
+    for item, first in repeats:
+        results[item["index"]] = {**first["result"], "replayed": True}
+    for index, result in enumerate(results):
+        result["index"] = index
+    return results
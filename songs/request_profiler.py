@@ -0,0 +1,160 @@
+"""
+スタッフ用のその場プロファイラ。
+
+スタッフのユーザーが任意の画面の URL に ?_profile=1 を付ける（または
+X-Profile: 1 ヘッダを送る）と、そのリクエストを cProfile と簡易サンプリング
+プロファイラの下で実行し、settings.PROFILE_DIR に次の2つを保存する。
+  - <ID>.pstats    : cProfile の結果（python -m pstats / snakeviz などで開く）
+  - <ID>.collapsed : 呼び出しスタックごとの標本数（flamegraph.pl / speedscope で開く）
+レスポンスは普段どおりで、X-Profile-Id ヘッダに ID が付く。
+?_profile=stats にすると画面の代わりに上位の関数の一覧（テキスト）を返す。
+保存したファイルは /profiles/<ID>.pstats などでダウンロードできる（スタッフのみ）。
+
+manage.py profile_page が手元で行うことを、本番のデータ・本物のパラメータで
+行うためのもの。新しいものから PROFILE_KEEP 組だけ残す。
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse
+
+# 保存するファイルの拡張子
+EXTENSIONS = ("pstats", "collapsed")
+# ?_profile=stats で表示する関数の件数
+STATS_LINES = 40
+
+# ファイル名。ダウンロードの URL から受け取るので形を確かめる
+_FILE_NAME = re.compile(r"^(\d+-\d+)\.(pstats|collapsed)$")
+
+
+def _directory():
+    return Path(settings.PROFILE_DIR)
+
+
+def _requested(request):
+    value = request.GET.get("_profile") or request.headers.get("X-Profile")
+    return value if value and value != "0" else None
+
+
+class _Sampler(threading.Thread):
+    """
+    指定したスレッドのスタックを一定間隔で控える。
+    結果は「外側;…;内側」をキーにした標本数（flame graph の collapsed 形式）。
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                filename = os.path.basename(code.co_filename)
+                stack.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _save(profiler, sampler):
+    """2つのファイルを書き出して ID を返す。"""
+    directory = _directory()
+    directory.mkdir(parents=True, exist_ok=True)
+    profile_id = f"{time.time_ns()}-{os.getpid()}"
+    profiler.dump_stats(directory / f"{profile_id}.pstats")
+    with open(directory / f"{profile_id}.collapsed", "w", encoding="utf-8") as f:
+        for stack, count in sampler.stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    _prune(directory)
+    return profile_id
+
+
+def _prune(directory):
+    ids = sorted(
+        {m.group(1) for p in directory.iterdir() if (m := _FILE_NAME.match(p.name))},
+        key=lambda i: int(i.split("-")[0]),
+        reverse=True,
+    )
+    for profile_id in ids[getattr(settings, "PROFILE_KEEP", 50) :]:
+        for ext in EXTENSIONS:
+            try:
+                (directory / f"{profile_id}.{ext}").unlink()
+            except FileNotFoundError:
+                pass
+
+
+def profile_path(name):
+    """ダウンロードするファイルのパス。名前の形が違う・無いときは None。"""
+    if not _FILE_NAME.match(name):
+        return None
+    path = _directory() / name
+    return path if path.is_file() else None
+
+
+def _stats_response(profiler, profile_id, response):
+    buffer = io.StringIO()
+    buffer.write(
+        f"status={response.status_code}  profile={profile_id}\n"
+        f"ダウンロード: /profiles/{profile_id}.pstats  /profiles/{profile_id}.collapsed\n\n"
+    )
+    pstats.Stats(profiler, stream=buffer).sort_stats("cumulative").print_stats(
+        STATS_LINES
+    )
+    return HttpResponse(buffer.getvalue(), content_type="text/plain; charset=utf-8")
+
+
+class RequestProfilerMiddleware:
+    """
+    スタッフが ?_profile=1 を付けたリクエストをプロファイルする。
+    request.user を見るので AuthenticationMiddleware より後に置く。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = _requested(request)
+        user = getattr(request, "user", None)
+        if mode is None or user is None or not user.is_staff:
+            return self.get_response(request)
+
+        sampler = _Sampler(
+            threading.get_ident(), getattr(settings, "PROFILE_SAMPLE_INTERVAL", 0.005)
+        )
+        profiler = cProfile.Profile()
+        sampler.start()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+            sampler.stop()
+
+        try:
+            profile_id = _save(profiler, sampler)
+        except OSError:
+            return response  # 保存できなくても画面は返す
+        if mode == "stats":
+            return _stats_response(profiler, profile_id, response)
+        response["X-Profile-Id"] = profile_id
+        return response
@@ -0,0 +1,71 @@
+"""
+「もっと見る」用の結果カーソル。
+
+ランキング・歌手検索の「もっと見る」は、これまでクリックのたびに
+全件を集計し直してから offset で切り出していた。ここでは初回に集計した
+結果をサーバー側に一時保存し、推測できないトークン（カーソル）を画面に渡す。
+続きの読み込みはトークンで保存済みの結果を引き、DB を触らずに切り出す。
+
+  - 保存先は settings.CACHES["cursors"]。期限は RESULT_CURSOR_TTL 秒。
+  - 1件あたり RESULT_CURSOR_MAX_BYTES を超える結果は保存しない
+    （件数の上限はキャッシュの MAX_ENTRIES で決まるので、合計もこの積で抑えられる）。
+  - 期限切れ・別ユーザー・条件違いのトークンは無効として None を返すので、
+    呼び出し側は集計し直してから新しいトークンを発行する。
+"""
+
+import pickle
+import secrets
+
+from django.conf import settings
+from django.core.cache import InvalidCacheBackendError, caches
+
+CACHE_ALIAS = "cursors"
+
+
+def _cache():
+    try:
+        return caches[CACHE_ALIAS]
+    except InvalidCacheBackendError:
+        return None
+
+
+def _key(token):
+    return f"cursor:{token}"
+
+
+def save(request, scope, data):
+    """
+    data を保存してトークンを返す。保存しなかった場合は空文字。
+    scope: 集計条件を表すタプル（読み出し時に一致を確認する）
+    """
+    cache = _cache()
+    if cache is None:
+        return ""
+
+    payload = pickle.dumps(
+        {"user_id": request.user.id, "scope": scope, "data": data},
+        protocol=pickle.HIGHEST_PROTOCOL,
+    )
+    if len(payload) > settings.RESULT_CURSOR_MAX_BYTES:
+        return ""
+
+    token = secrets.token_urlsafe(16)
+    # pickle 済みの bytes を置く（キャッシュ側で dict を丸ごと pickle し直さないため）
+    cache.set(_key(token), payload, timeout=settings.RESULT_CURSOR_TTL)
+    return token
+
+
+def load(request, token, scope):
+    """トークンに対応する data を返す。無効なら None。"""
+    cache = _cache()
+    if cache is None or not token:
+        return None
+
+    payload = cache.get(_key(token))
+    if payload is None:
+        return None
+
+    saved = pickle.loads(payload)
+    if saved["user_id"] != request.user.id or saved["scope"] != scope:
+        return None
+    return saved["data"]
@@ -1,3 +1,5 @@
+from decimal import Decimal
+
 from django.db import connection
 
 # 作詞/作曲/年 ランキング用の対象カラム（SQLインジェクション対策のためホワイトリスト化）
@@ -42,6 +44,8 @@ def _creator_filtered_cte(col, region_filter, is_numeric=False, karaoke_mode=Fal
                 s.title AS song_title,
                 s.artist_id,
                 a.name AS artist_name,
+                s.title_key AS song_title_key,
+                a.name_key AS artist_name_key,
                 {score_col} AS score,
                 a.region_id,
                 s.lyricist AS lyricist,
@@ -92,7 +96,7 @@ def call_creator_song_top_n(user_id, top_n, region_id, creator_type, karaoke_mod
                 f.*,
                 ROW_NUMBER() OVER (
                     PARTITION BY f.creator
-                    ORDER BY f.score DESC, UPPER(f.song_title)
+                    ORDER BY f.score DESC, f.song_title_key
                 ) AS order_creator,
                 RANK() OVER (
                     PARTITION BY f.creator
@@ -181,7 +185,7 @@ def call_creator_insufficient_songs(
             RANK() OVER (ORDER BY f.score DESC) AS rank_within_insufficient
         FROM filtered f
         JOIN insufficient_creators ic ON f.creator = ic.creator
-        ORDER BY f.score DESC, UPPER(f.artist_name), UPPER(f.song_title)
+        ORDER BY f.score DESC, f.artist_name_key, f.song_title_key
     """
 
     with connection.cursor() as cursor:
@@ -230,6 +234,8 @@ def _artist_filtered_cte(region_filter, karaoke_mode=False):
                 s.title AS song_title,
                 s.artist_id,
                 a.name AS artist_name,
+                s.title_key AS song_title_key,
+                a.name_key AS artist_name_key,
                 a.region_id,
                 {score_col} AS score,
                 s.lyricist AS lyricist,
@@ -277,7 +283,7 @@ def call_artist_song_top_n(user_id, top_n, region_id, karaoke_mode=False):
                 f.*,
                 ROW_NUMBER() OVER (
                     PARTITION BY f.artist_id
-                    ORDER BY f.score DESC, UPPER(f.song_title)
+                    ORDER BY f.score DESC, f.song_title_key
                 ) AS order_artist,
                 RANK() OVER (
                     PARTITION BY f.artist_id
@@ -322,7 +328,7 @@ def call_artist_song_top_n(user_id, top_n, region_id, karaoke_mode=False):
             ts.year
         FROM top_songs ts
         JOIN ranked_totals rt ON ts.artist_id = rt.artist_id
-        ORDER BY rt.artist_rank, UPPER(ts.artist_name), ts.order_artist
+        ORDER BY rt.artist_rank, ts.artist_name_key, ts.order_artist
         """
 
     with connection.cursor() as cursor:
@@ -355,7 +361,7 @@ def call_artist_top_n(user_id, top_n, region_id):
                 f.*,
                 ROW_NUMBER() OVER (
                     PARTITION BY f.artist_id
-                    ORDER BY f.score DESC, UPPER(f.song_title)
+                    ORDER BY f.score DESC, f.song_title_key
                 ) AS order_artist
             FROM filtered f
         ),
@@ -395,96 +401,214 @@ def call_artist_top_n(user_id, top_n, region_id):
 
 TOP_NS = (5, 10, 15, 20)
 
+# top_n に指定できる上限。グループごとの累積和はこの件数まで持つ。
+MAX_TOP_N = 100
+
 
 def _validate_top_ns(top_ns):
     """SQLに直接埋め込むため、整数であることを保証する"""
     ns = [int(n) for n in top_ns]
     if not ns:
         raise ValueError("top_ns が空です")
+    if not all(1 <= n <= MAX_TOP_N for n in ns):
+        raise ValueError(f"top_n は 1〜{MAX_TOP_N} で指定してください: {ns}")
     return ns
 
 
-def call_artist_top_n_multi(user_id, region_id, top_ns=TOP_NS, karaoke_mode=False):
+def call_group_prefix_sums(user_id, region_id, kind, karaoke_mode=False):
     """
-    歌手ランキングを top_n 4種類ぶんまとめて1クエリで返す（歌手TOP / 歌手ランク用）。
+    グループ（歌手/作詞者/作曲者/年）ごとに、点数の高い順に並べた曲の累積和を返す。
 
-    従来は call_artist_top_n を top_n ごとに4回呼んでいたが、
-    重い部分（曲の順位付けウィンドウ関数）は top_n に依存しないため共有できる。
+    prefix[i] は上位 i+1 曲の合計（同点は曲名順、ROW_NUMBER と同じ並び）。
+    これがあれば任意の top_n の合計は prefix[top_n - 1] を見るだけで済むので、
+    top_n の組を変えてもクエリを流し直さずに rows_from_prefix_sums で集計できる。
+    累積和は上位 MAX_TOP_N 曲までしか持たない。
 
-    戻り値: 歌手単位のdictリスト
-      {artist_id, artist_name, region_id,
-       total_5, rank_5, order_5, total_10, rank_10, order_10, ...}
-      その top_n の条件（評価済み曲数 >= top_n）を満たさない歌手は
-      total_N / rank_N / order_N が None になる。
-      order_N は表示順（同点時の並びを従来のSQLと一致させるための通し番号）。
+    kind: 'artist' / 'lyricist' / 'composer' / 'year'
+    戻り値: グループ単位のdictリスト（名前の UPPER() 順）
+      artist: {artist_id, artist_name, region_id, song_count, prefix}
+      その他: {creator, song_count, prefix}
     """
-    ns = _validate_top_ns(top_ns)
+    return _group_prefix_sums(user_id, region_id, kind, karaoke_mode).get(None, [])
+
+
+def call_group_prefix_sums_by_region(user_id, kind, karaoke_mode=False):
+    """
+    call_group_prefix_sums の全地域＋地域別を1クエリでまとめて返す
+    （複製と PARTITION BY の考え方は call_ranking_bundle_by_region と同じ）。
 
+    戻り値: {region_id: call_group_prefix_sums の結果}
+      全地域は None。評価の無い地域はキーを持たない。
+    """
+    return _group_prefix_sums(user_id, None, kind, karaoke_mode, by_region=True)
+
+
+def _group_prefix_sums(user_id, region_id, kind, karaoke_mode=False, by_region=False):
+    """
+    call_group_prefix_sums / call_group_prefix_sums_by_region の本体。
+    by_region=False なら region_id で絞った結果だけをキー None で返す。
+    """
     region_filter = ""
     params = [user_id]
     if region_id:
         region_filter = "AND a.region_id = %s"
         params.append(int(region_id))
+    params.append(MAX_TOP_N)
+
+    if kind == "artist":
+        cte = _artist_filtered_cte(region_filter, karaoke_mode)
+        group_col = "artist_id"
+        select_cols = "p.artist_id, p.artist_name, p.region_id"
+        name_order = "p.artist_name_key"
+    elif kind in _CREATOR_COLUMNS:
+        col, is_numeric = _CREATOR_COLUMNS[kind]
+        cte = _creator_filtered_cte(col, region_filter, is_numeric, karaoke_mode)
+        group_col = "creator"
+        select_cols = "p.creator"
+        name_order = "UPPER(p.creator)"
+    else:
+        raise ValueError(f"Invalid kind: {kind}")
+
+    # 地域別の行は region_key に地域IDを入れて複製する（0 = 全地域）。
+    # 曲数も地域ごとに変わるので、counts ではなくウィンドウ関数で数える。
+    region_rows = ""
+    if by_region:
+        region_rows = """
+            UNION ALL
+            SELECT f.region_id AS region_key, f.*
+            FROM filtered f WHERE f.region_id IS NOT NULL
+        """
 
-    total_cols = ",\n            ".join(
-        f"CASE WHEN c.song_count >= {n} "
-        f"THEN SUM(CASE WHEN r.order_artist <= {n} THEN r.score END) END AS total_{n}"
-        for n in ns
-    )
-    rank_cols = ",\n            ".join(
-        f"""total_{n},
-            CASE WHEN total_{n} IS NULL THEN NULL
-                 ELSE RANK() OVER (ORDER BY total_{n} DESC) END AS rank_{n},
-            CASE WHEN total_{n} IS NULL THEN NULL
-                 ELSE ROW_NUMBER() OVER (ORDER BY total_{n} DESC, UPPER(artist_name)) END AS order_{n}"""
-        for n in ns
-    )
-
-    sql = (
-        _artist_filtered_cte(region_filter, karaoke_mode)
-        + f"""
+    sql = cte + f"""
         ,
+        regions AS (
+            SELECT 0 AS region_key, f.* FROM filtered f
+            {region_rows}
+        ),
         ranked AS (
             SELECT
-                f.*,
+                g.*,
                 ROW_NUMBER() OVER (
-                    PARTITION BY f.artist_id
-                    ORDER BY f.score DESC, UPPER(f.song_title)
-                ) AS order_artist
-            FROM filtered f
+                    PARTITION BY g.region_key, g.{group_col}
+                    ORDER BY g.score DESC, g.song_title_key
+                ) AS order_in_group,
+                COUNT(*) OVER (
+                    PARTITION BY g.region_key, g.{group_col}
+                ) AS song_count
+            FROM regions g
         ),
-        totals AS (
+        prefix AS (
             SELECT
-                r.artist_id,
-                MAX(r.artist_name) AS artist_name,
-                MAX(r.region_id) AS region_id,
-                {total_cols}
+                r.*,
+                SUM(r.score) OVER (
+                    PARTITION BY r.region_key, r.{group_col}
+                    ORDER BY r.order_in_group
+                    ROWS UNBOUNDED PRECEDING
+                ) AS prefix_sum
             FROM ranked r
-            JOIN counts c ON r.artist_id = c.artist_id
-            GROUP BY r.artist_id, c.song_count
         )
         SELECT
-            artist_id,
-            artist_name,
-            region_id,
-            {rank_cols}
-        FROM totals
-        ORDER BY UPPER(artist_name)
-        """
-    )
+            p.region_key,
+            {select_cols},
+            p.song_count,
+            p.order_in_group,
+            p.prefix_sum
+        FROM prefix p
+        WHERE p.order_in_group <= %s
+        ORDER BY p.region_key, {name_order}, p.{group_col}, p.order_in_group
+    """
 
     with connection.cursor() as cursor:
         cursor.execute(sql, params)
         columns = [c[0] for c in cursor.description]
-        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    group_columns = columns[1 : columns.index("song_count") + 1]
+    regions = {}
+    for row in rows:
+        # グループの切れ目は通し番号で判定する（照合順序で同じグループに
+        # まとめられた表記ゆれを、Python 側の比較で分けてしまわないため）
+        if row["order_in_group"] == 1:
+            group = {k: row[k] for k in group_columns}
+            group["prefix"] = []
+            regions.setdefault(row["region_key"] or None, []).append(group)
+        group["prefix"].append(row["prefix_sum"])
+    return regions
+
+
+def rows_from_prefix_sums(kind, groups, top_ns, with_order=False):
+    """
+    call_group_prefix_sums の結果から、top_n ごとの合計・順位を付けた
+    グループ単位の行を作る（top_n 1つあたりグループ数ぶんの計算で済む）。
+
+    groups は名前の UPPER() 順に並んでいること（order_N の同点時の並びに使う）。
+    戻り値: call_artist_top_n_multi / call_creator_top_n_multi と同じ形
+      {..., total_N, rank_N[, order_N]}
+      その top_n の条件（曲数 >= top_n）を満たさないグループは None。
+    """
+    ns = _validate_top_ns(top_ns)
+    if kind == "artist":
+        rows = [
+            {
+                "artist_id": g["artist_id"],
+                "artist_name": g["artist_name"],
+                "region_id": g["region_id"],
+            }
+            for g in groups
+        ]
+    else:
+        rows = [{"creator": g["creator"]} for g in groups]
+
+    for n in ns:
+        totals = [
+            g["prefix"][n - 1] if g["song_count"] >= n else None for g in groups
+        ]
+        ranked = sorted(
+            (i for i, total in enumerate(totals) if total is not None),
+            key=lambda i: totals[i],
+            reverse=True,
+        )
+        # 安定ソートの reverse=True は同点の並びを保つので、同点は名前順のまま
+        rank_of = {}
+        for order, i in enumerate(ranked, start=1):
+            if order == 1 or totals[i] != totals[ranked[order - 2]]:
+                rank = order
+            rank_of[i] = (rank, order)
+
+        for i, row in enumerate(rows):
+            row[f"total_{n}"] = totals[i]
+            rank, order = rank_of.get(i, (None, None))
+            row[f"rank_{n}"] = rank
+            if with_order:
+                row[f"order_{n}"] = order
+    return rows
+
+
+def call_artist_top_n_multi(user_id, region_id, top_ns=TOP_NS, karaoke_mode=False):
+    """
+    歌手ランキングを複数の top_n ぶんまとめて返す（歌手TOP / 歌手ランク用）。
+
+    以前は top_n ごとに CASE/SUM/RANK の列を SQL に足していたが、
+    歌手ごとの累積和（call_group_prefix_sums）を1回取れば、
+    どの top_n も Python 側でグループ数ぶんの計算で出せる。
+
+    戻り値: 歌手単位のdictリスト（歌手名の UPPER() 順）
+      {artist_id, artist_name, region_id,
+       total_5, rank_5, order_5, total_10, rank_10, order_10, ...}
+      その top_n の条件（評価済み曲数 >= top_n）を満たさない歌手は
+      total_N / rank_N / order_N が None になる。
+      order_N は表示順（同点時の並びを従来のSQLと一致させるための通し番号）。
+    """
+    groups = call_group_prefix_sums(user_id, region_id, "artist", karaoke_mode)
+    return rows_from_prefix_sums("artist", groups, top_ns, with_order=True)
 
 
 def call_creator_top_n_multi(
     user_id, region_id, creator_type, top_ns=TOP_NS, karaoke_mode=False
 ):
     """
-    作詞者/作曲者/年ランキングを top_n 4種類ぶんまとめて1クエリで返す
-    （作詞・作曲・年のTOP / ランク画面用）。
+    作詞者/作曲者/年ランキングを複数の top_n ぶんまとめて返す
+    （作詞・作曲・年のTOP / ランク画面用）。集計方法は call_artist_top_n_multi と同じ。
 
     戻り値: クリエイター単位のdictリスト
       {creator, total_5, rank_5, total_10, rank_10, ...}
@@ -492,59 +616,8 @@ def call_creator_top_n_multi(
     """
     if creator_type not in _CREATOR_COLUMNS:
         raise ValueError(f"Invalid creator_type: {creator_type}")
-    col, is_numeric = _CREATOR_COLUMNS[creator_type]
-    ns = _validate_top_ns(top_ns)
-
-    region_filter = ""
-    params = [user_id]
-    if region_id:
-        region_filter = "AND a.region_id = %s"
-        params.append(int(region_id))
-
-    total_cols = ",\n            ".join(
-        f"CASE WHEN c.song_count >= {n} "
-        f"THEN SUM(CASE WHEN r.order_creator <= {n} THEN r.score END) END AS total_{n}"
-        for n in ns
-    )
-    rank_cols = ",\n            ".join(
-        f"""total_{n},
-            CASE WHEN total_{n} IS NULL THEN NULL
-                 ELSE RANK() OVER (ORDER BY total_{n} DESC) END AS rank_{n}"""
-        for n in ns
-    )
-
-    sql = (
-        _creator_filtered_cte(col, region_filter, is_numeric, karaoke_mode)
-        + f"""
-        ,
-        ranked AS (
-            SELECT
-                f.*,
-                ROW_NUMBER() OVER (
-                    PARTITION BY f.creator
-                    ORDER BY f.score DESC, UPPER(f.song_title)
-                ) AS order_creator
-            FROM filtered f
-        ),
-        totals AS (
-            SELECT
-                r.creator,
-                {total_cols}
-            FROM ranked r
-            JOIN counts c ON r.creator = c.creator
-            GROUP BY r.creator, c.song_count
-        )
-        SELECT
-            creator,
-            {rank_cols}
-        FROM totals
-        """
-    )
-
-    with connection.cursor() as cursor:
-        cursor.execute(sql, params)
-        columns = [c[0] for c in cursor.description]
-        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    groups = call_group_prefix_sums(user_id, region_id, creator_type, karaoke_mode)
+    return rows_from_prefix_sums(creator_type, groups, top_ns)
 
 
 def call_artist_insufficient_songs(user_id, top_n, region_id, karaoke_mode=False):
@@ -572,7 +645,7 @@ def call_artist_insufficient_songs(user_id, top_n, region_id, karaoke_mode=False
                 f.*,
                 ROW_NUMBER() OVER (
                     PARTITION BY f.artist_id
-                    ORDER BY f.score DESC, UPPER(f.song_title)
+                    ORDER BY f.score DESC, f.song_title_key
                 ) AS order_artist
             FROM filtered f
         ),
@@ -598,7 +671,7 @@ def call_artist_insufficient_songs(user_id, top_n, region_id, karaoke_mode=False
             year,
             RANK() OVER (ORDER BY score DESC) AS rank_within_insufficient
         FROM insufficient_songs
-        ORDER BY score DESC, UPPER(artist_name), UPPER(song_title)
+        ORDER BY score DESC, artist_name_key, song_title_key
         """
 
     with connection.cursor() as cursor:
@@ -607,27 +680,357 @@ def call_artist_insufficient_songs(user_id, top_n, region_id, karaoke_mode=False
         return [dict(zip(columns, row)) for row in cursor.fetchall()]
 
 
-def count_song_ranking(user_id, region_id):
+# ===== 4集計軸まとめて（1往復） =====
+
+RANKING_KINDS = ("artist",) + tuple(_CREATOR_COLUMNS)
+
+
+def _bundle_value(value, karaoke_mode):
     """
-    全曲ランキングの総件数（「もっと見る」の残件数表示・打ち切り判定用）。
-    call_song_ranking と同じ抽出条件で COUNT だけを取る軽量クエリ。
-    ※ 条件を変えたら call_song_ranking 側も必ず合わせること。
+    まとめ版では好み度とカラオケ採点を同じ列で扱うので DECIMAL で返ってくる。
+    好み度は個別の関数と同じく int に戻す（表示が 80.000 にならないように）。
+    """
+    if value is None or karaoke_mode:
+        return value
+    return int(value)
+
+
+def empty_ranking_bundle():
+    """評価が1件も無い地域に返す、空の call_ranking_bundle の結果。"""
+    return {
+        (kind, karaoke_mode): {"top": [], "insufficient": []}
+        for kind in RANKING_KINDS
+        for karaoke_mode in (False, True)
+    }
+
+
+def call_ranking_bundle(user_id, top_n, region_id):
+    """
+    歌手/作詞/作曲/年 × 好み度/カラオケ採点のランキングを1クエリでまとめて返す。
+
+    個別の関数（call_artist_song_top_n など）は画面ごとに評価の行を読み直すが、
+    ここでは評価を1回だけ読み、集計軸と採点の種類を縦に並べてから
+    (集計軸, 採点の種類, グループ) 単位でウィンドウ関数を計算する。
+    どれか1画面を開けば、同じ top_n・地域の他の画面もキャッシュから出せる。
+
+    戻り値: {(kind, karaoke_mode): {"top": [...], "insufficient": [...]}}
+      kind は RANKING_KINDS のいずれか。
+      "top" は call_artist_song_top_n / call_creator_song_top_n、
+      "insufficient" は call_artist_insufficient_songs /
+      call_creator_insufficient_songs と同じ形・同じ並び。
+    """
+    bundles = _ranking_bundles(user_id, top_n, region_id)
+    return bundles.get(None) or empty_ranking_bundle()
+
+
+def call_ranking_bundle_by_region(user_id, top_n):
+    """
+    call_ranking_bundle の全地域＋地域別を1クエリでまとめて返す。
+
+    評価の行を「全地域」と「その曲の地域」の2通りに複製し、地域も
+    ウィンドウ関数の PARTITION BY に加えて同じ走査で集計する。
+    地域タブを切り替えても集計し直さずに済む（キャッシュもまとめて1件）。
+
+    戻り値: {region_id: call_ranking_bundle の結果}
+      全地域は None。評価の無い地域はキーを持たない（empty_ranking_bundle を使う）。
+    """
+    return _ranking_bundles(user_id, top_n, None, by_region=True)
+
+
+def _ranking_bundles(user_id, top_n, region_id, by_region=False):
+    """
+    call_ranking_bundle / call_ranking_bundle_by_region の本体。
+    by_region=False なら region_id で絞った結果だけをキー None で返す。
     """
     region_filter = ""
     params = [user_id]
     if region_id:
         region_filter = "AND a.region_id = %s"
         params.append(int(region_id))
+    params += [top_n, top_n, top_n]
+
+    # 地域別の行は region_key に地域IDを入れて複製する（0 = 全地域）
+    region_rows = ""
+    if by_region:
+        region_rows = """
+            UNION ALL
+            SELECT b.region_id AS region_key, b.*
+            FROM base b WHERE b.region_id IS NOT NULL
+        """
 
+    # グループは (group_id, group_name) の組で表す（NULL を含めないため 0 / '' で埋める）
+    #   artist: (artist_id, artist_name) / lyricist・composer: (0, 名前) / year: (年, '')
+    # 最後の ORDER BY は、TOP の行を (順位, 名前, 通し番号)、「その他」の行を
+    # (点数, 歌手名, 曲名) で並べる（個別の関数と同じ並び）。
     sql = f"""
-        SELECT COUNT(*)
-        FROM songs_rating r
-        JOIN songs_song s ON r.song_id = s.id
-        JOIN songs_artist a ON s.artist_id = a.id
-        WHERE r.user_id = %s
-          AND r.score IS NOT NULL
-          AND s.is_cover = 0
-          {region_filter}
+        WITH base AS (
+            SELECT
+                s.id AS song_id,
+                s.title AS song_title,
+                s.artist_id,
+                a.name AS artist_name,
+                s.title_key AS song_title_key,
+                a.name_key AS artist_name_key,
+                a.region_id,
+                r.score,
+                r.karaoke_score,
+                s.lyricist,
+                s.composer,
+                s.year
+            FROM songs_rating r
+            JOIN songs_song s ON r.song_id = s.id
+            JOIN songs_artist a ON s.artist_id = a.id
+            WHERE r.user_id = %s
+              AND (r.score IS NOT NULL OR r.karaoke_score IS NOT NULL)
+              AND s.is_cover = 0
+              {region_filter}
+        ),
+        regions AS (
+            SELECT 0 AS region_key, b.* FROM base b
+            {region_rows}
+        ),
+        modes AS (
+            SELECT g.*, 0 AS karaoke_mode, g.score AS value
+            FROM regions g WHERE g.score IS NOT NULL
+            UNION ALL
+            SELECT g.*, 1 AS karaoke_mode, g.karaoke_score AS value
+            FROM regions g WHERE g.karaoke_score IS NOT NULL
+        ),
+        filtered AS (
+            SELECT 'artist' AS kind, m.artist_id AS group_id,
+                   m.artist_name AS group_name, m.*
+            FROM modes m
+            UNION ALL
+            SELECT 'lyricist', 0, m.lyricist, m.*
+            FROM modes m WHERE m.lyricist IS NOT NULL AND m.lyricist <> ''
+            UNION ALL
+            SELECT 'composer', 0, m.composer, m.*
+            FROM modes m WHERE m.composer IS NOT NULL AND m.composer <> ''
+            UNION ALL
+            SELECT 'year', m.year, '', m.*
+            FROM modes m WHERE m.year IS NOT NULL
+        ),
+        ranked AS (
+            SELECT
+                f.*,
+                ROW_NUMBER() OVER (
+                    PARTITION BY f.region_key, f.kind, f.karaoke_mode, f.group_id, f.group_name
+                    ORDER BY f.value DESC, f.song_title_key
+                ) AS order_in_group,
+                RANK() OVER (
+                    PARTITION BY f.region_key, f.kind, f.karaoke_mode, f.group_id, f.group_name
+                    ORDER BY f.value DESC
+                ) AS rank_in_group,
+                COUNT(*) OVER (
+                    PARTITION BY f.region_key, f.kind, f.karaoke_mode, f.group_id, f.group_name
+                ) AS song_count
+            FROM filtered f
+        ),
+        totals AS (
+            SELECT
+                region_key, kind, karaoke_mode, group_id, group_name,
+                SUM(value) AS total_score
+            FROM ranked
+            WHERE song_count >= %s AND order_in_group <= %s
+            GROUP BY region_key, kind, karaoke_mode, group_id, group_name
+        ),
+        ranked_totals AS (
+            SELECT
+                t.*,
+                RANK() OVER (
+                    PARTITION BY t.region_key, t.kind, t.karaoke_mode
+                    ORDER BY t.total_score DESC
+                ) AS group_rank
+            FROM totals t
+        )
+        SELECT
+            r.region_key,
+            r.kind,
+            r.karaoke_mode,
+            r.group_id,
+            r.group_name,
+            r.song_id,
+            r.song_title,
+            r.artist_id,
+            r.artist_name,
+            r.region_id,
+            r.value AS score,
+            r.order_in_group,
+            r.rank_in_group,
+            r.lyricist,
+            r.composer,
+            r.year,
+            rt.total_score,
+            rt.group_rank,
+            RANK() OVER (
+                PARTITION BY r.region_key, r.kind, r.karaoke_mode, rt.group_rank IS NULL
+                ORDER BY r.value DESC
+            ) AS rank_within_insufficient
+        FROM ranked r
+        LEFT JOIN ranked_totals rt
+          ON rt.region_key = r.region_key
+         AND rt.kind = r.kind
+         AND rt.karaoke_mode = r.karaoke_mode
+         AND rt.group_id = r.group_id
+         AND rt.group_name = r.group_name
+        WHERE r.order_in_group <= %s
+        ORDER BY
+            r.region_key,
+            r.kind,
+            r.karaoke_mode,
+            rt.group_rank IS NULL,
+            rt.group_rank,
+            CASE WHEN rt.group_rank IS NOT NULL THEN UPPER(r.group_name) END,
+            CASE WHEN rt.group_rank IS NOT NULL THEN r.group_id END,
+            CASE WHEN rt.group_rank IS NOT NULL THEN r.order_in_group END,
+            r.value DESC,
+            r.artist_name_key,
+            r.song_title_key
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        columns = [c[0] for c in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    bundles = {}
+    for row in rows:
+        region_key = row["region_key"] or None
+        if region_key not in bundles:
+            bundles[region_key] = empty_ranking_bundle()
+        karaoke_mode = bool(row["karaoke_mode"])
+        part = bundles[region_key][(row["kind"], karaoke_mode)]
+        score = _bundle_value(row["score"], karaoke_mode)
+        song = {
+            "song_id": row["song_id"],
+            "song_title": row["song_title"],
+            "artist_id": row["artist_id"],
+            "artist_name": row["artist_name"],
+        }
+        credits = {
+            "lyricist": row["lyricist"],
+            "composer": row["composer"],
+            "year": row["year"],
+        }
+
+        if row["kind"] == "artist":
+            if row["group_rank"] is not None:
+                part["top"].append(
+                    {
+                        **song,
+                        "region_id": row["region_id"],
+                        "score": score,
+                        "order_artist": row["order_in_group"],
+                        "rank_artist": row["rank_in_group"],
+                        "total_score": _bundle_value(row["total_score"], karaoke_mode),
+                        "artist_rank": row["group_rank"],
+                        **credits,
+                    }
+                )
+            else:
+                part["insufficient"].append(
+                    {
+                        **song,
+                        "region_id": row["region_id"],
+                        "score": score,
+                        "order_artist": row["order_in_group"],
+                        **credits,
+                        "rank_within_insufficient": row["rank_within_insufficient"],
+                    }
+                )
+            continue
+
+        creator = row["group_id"] if row["kind"] == "year" else row["group_name"]
+        if row["group_rank"] is not None:
+            part["top"].append(
+                {
+                    "creator": creator,
+                    "creator_rank": row["group_rank"],
+                    "total_score": _bundle_value(row["total_score"], karaoke_mode),
+                    **song,
+                    "score": score,
+                    "rank_creator": row["rank_in_group"],
+                    "order_creator": row["order_in_group"],
+                    **credits,
+                }
+            )
+        else:
+            part["insufficient"].append(
+                {
+                    "creator": creator,
+                    **song,
+                    "score": score,
+                    **credits,
+                    "rank_within_insufficient": row["rank_within_insufficient"],
+                }
+            )
+    return bundles
+
+
+def _song_ranking_cte(region_filter, karaoke_mode=False):
+    """
+    全曲ランキング（call_song_ranking / call_song_ranking_page /
+    count_song_ranking）の共通CTE。抽出条件と並び順はここだけで決める。
+
+      好み度: is_cover = 0 かつ score IS NOT NULL の曲。
+        並びは (score DESC, UPPER(歌手名), UPPER(曲名), 曲ID)。
+      カラオケ採点: カバー曲も含め、karaoke_score IS NOT NULL の曲。
+        並びは (karaoke_score DESC, LOWER(曲名), 曲ID)。歌手名では並べないので
+        artist_key は空文字にしてある。
+
+    集計対象の点数は score、並び順のキーは artist_key / title_key という
+    別名で返すので、使う側の SQL はモードによらず同じでよい。
+    カラオケ採点のときは karaoke_score 列を NULL にする（score と重ねて表示しないため）。
+    """
+    if karaoke_mode:
+        score_col = "r.karaoke_score"
+        karaoke_col = "NULL"
+        conditions = "r.karaoke_score IS NOT NULL"
+        artist_key = "''"
+        title_key = "LOWER(s.title)"
+    else:
+        score_col = "r.score"
+        karaoke_col = "r.karaoke_score"
+        conditions = "r.score IS NOT NULL AND s.is_cover = 0"
+        artist_key = "a.name_key"
+        title_key = "s.title_key"
+    return f"""
+        WITH filtered AS (
+            SELECT
+                s.id AS song_id,
+                s.title AS song_title,
+                s.artist_id,
+                a.name AS artist_name,
+                {score_col} AS score,
+                s.lyricist AS lyricist,
+                s.composer AS composer,
+                s.year AS year,
+                {karaoke_col} AS karaoke_score,
+                {artist_key} AS artist_key,
+                {title_key} AS title_key
+            FROM songs_rating r
+            JOIN songs_song s ON r.song_id = s.id
+            JOIN songs_artist a ON s.artist_id = a.id
+            WHERE r.user_id = %s
+              AND {conditions}
+              {region_filter}
+        )
+    """
+
+
+def count_song_ranking(user_id, region_id, karaoke_mode=False):
+    """
+    全曲ランキングの総件数（「もっと見る」の残件数表示・打ち切り判定用）。
+    call_song_ranking と同じ抽出条件（_song_ranking_cte）で COUNT だけを取る。
+    """
+    region_filter = ""
+    params = [user_id]
+    if region_id:
+        region_filter = "AND a.region_id = %s"
+        params.append(int(region_id))
+
+    sql = _song_ranking_cte(region_filter, karaoke_mode) + """
+        SELECT COUNT(*) FROM filtered
     """
 
     with connection.cursor() as cursor:
@@ -635,11 +1038,12 @@ def count_song_ranking(user_id, region_id):
         return cursor.fetchone()[0]
 
 
-def call_song_ranking(user_id, region_id, offset=0, limit=None):
+def call_song_ranking(user_id, region_id, offset=0, limit=None, karaoke_mode=False):
     """
     全曲ランキング（旧 rank_view 置き換え）。
     region_id 指定時はその地域内のランキング、未指定時は全体ランキング。
-    is_cover = 0 かつ好み度が入力済み（score IS NOT NULL）の曲のみ対象。
+    好み度は is_cover = 0 かつ好み度が入力済み（score IS NOT NULL）の曲、
+    karaoke_mode=True ならカラオケ採点の入っている曲が対象（_song_ranking_cte）。
     user_id を CTE 内で先に絞り込むため、ウィンドウ関数の対象行数を最小化できる。
 
     limit を指定すると display_order 順の一部だけを返す（「もっと見る」用）。
@@ -648,7 +1052,8 @@ def call_song_ranking(user_id, region_id, offset=0, limit=None):
 
     戻り値: 曲単位のdictリスト
       {display_rank, display_order, artist_id, artist_name,
-       song_id, song_title, score}
+       song_id, song_title, score, lyricist, composer, year, karaoke_score}
+      karaoke_mode のときは score がカラオケ採点。
     """
     region_filter = ""
     params = [user_id]
@@ -660,27 +1065,7 @@ def call_song_ranking(user_id, region_id, offset=0, limit=None):
     if limit is not None:
         limit_clause = "LIMIT %s OFFSET %s"
 
-    sql = f"""
-        WITH filtered AS (
-            SELECT
-                s.id AS song_id,
-                s.title AS song_title,
-                s.artist_id,
-                a.name AS artist_name,
-                a.region_id,
-                r.score,
-                s.lyricist AS lyricist,
-                s.composer AS composer,
-                s.year AS year,
-                r.karaoke_score
-            FROM songs_rating r
-            JOIN songs_song s ON r.song_id = s.id
-            JOIN songs_artist a ON s.artist_id = a.id
-            WHERE r.user_id = %s
-              AND r.score IS NOT NULL
-              AND s.is_cover = 0
-              {region_filter}
-        )
+    sql = _song_ranking_cte(region_filter, karaoke_mode) + f"""
         SELECT
             song_id,
             song_title,
@@ -691,7 +1076,7 @@ def call_song_ranking(user_id, region_id, offset=0, limit=None):
                 ORDER BY score DESC
             ) AS display_rank,
             ROW_NUMBER() OVER (
-                ORDER BY score DESC, UPPER(artist_name), UPPER(song_title)
+                ORDER BY score DESC, artist_key, title_key, song_id
             ) AS display_order,
             lyricist,
             composer,
@@ -712,6 +1097,102 @@ def call_song_ranking(user_id, region_id, offset=0, limit=None):
         return [dict(zip(columns, row)) for row in cursor.fetchall()]
 
 
+def call_song_ranking_page(user_id, region_id, limit, after=None, karaoke_mode=False):
+    """
+    全曲ランキングをキーセット（シーク）方式で limit 件ずつ返す（「もっと見る」用）。
+
+    call_song_ranking(offset=, limit=) は毎回全件に順位を付けてから
+    OFFSET で読み飛ばすため、奥のページほど遅くなる。ここでは並び順のキー
+    (score DESC, artist_key, title_key, 曲ID) で前のページの続きから読み、
+    順位は前のページから引き継いだ状態で Python 側で振る。
+    総件数は先頭ページのクエリで COUNT(*) OVER () として一緒に取り、
+    以降のページは状態に入れて引き継ぐ（別の COUNT クエリは流さない）。
+
+    after: 前回の戻り値の "next"（先頭ページは None）
+    戻り値: {"songs": [...], "total": 総件数, "next": 続きの状態（無ければ None）}
+      songs の各行は call_song_ranking と同じ形。
+      next は JSON にできる dict（画面に渡すときは署名して渡すこと）。
+      カラオケ採点の点数は Decimal なので、next には文字列で入れる。
+    """
+    region_filter = ""
+    params = [user_id]
+    if region_id:
+        region_filter = "AND a.region_id = %s"
+        params.append(int(region_id))
+
+    seek = ""
+    total_col = ", COUNT(*) OVER () AS total_count"
+    if after:
+        after_score = Decimal(after["score"]) if karaoke_mode else after["score"]
+        seek = """
+        WHERE score < %s
+           OR (score = %s AND (artist_key > %s
+               OR (artist_key = %s AND (title_key > %s
+                   OR (title_key = %s AND song_id > %s)))))
+        """
+        params += [
+            after_score,
+            after_score,
+            after["artist_key"],
+            after["artist_key"],
+            after["title_key"],
+            after["title_key"],
+            after["song_id"],
+        ]
+        total_col = ""
+    params.append(int(limit))
+
+    sql = _song_ranking_cte(region_filter, karaoke_mode) + f"""
+        SELECT *{total_col}
+        FROM filtered
+        {seek}
+        ORDER BY score DESC, artist_key, title_key, song_id
+        LIMIT %s
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        columns = [c[0] for c in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    if after:
+        total = after["total"]
+        position, rank, prev_score = after["position"], after["rank"], after_score
+    else:
+        total = rows[0]["total_count"] if rows else 0
+        position, rank, prev_score = 0, 0, None
+
+    songs = []
+    for row in rows:
+        row.pop("total_count", None)
+        artist_key = row.pop("artist_key")
+        title_key = row.pop("title_key")
+        if karaoke_mode and row["score"] is not None:
+            # DB によっては DECIMAL が float で返るので、引き継いだ点数と比べられるよう揃える
+            row["score"] = Decimal(str(row["score"]))
+        position += 1
+        # RANK() OVER (ORDER BY score DESC) 相当（ページをまたいでも連続させる）
+        if row["score"] != prev_score:
+            rank = position
+        prev_score = row["score"]
+        row["display_rank"] = rank
+        row["display_order"] = position
+        songs.append(row)
+
+    next_state = None
+    if len(songs) == int(limit) and position < total:
+        next_state = {
+            "score": str(prev_score) if karaoke_mode else prev_score,
+            "artist_key": artist_key,
+            "title_key": title_key,
+            "song_id": songs[-1]["song_id"],
+            "rank": rank,
+            "position": position,
+            "total": total,
+        }
+    return {"songs": songs, "total": total, "next": next_state}
+
+
 def call_artist_insufficient(user_id, top_n, region_id):
     """
     歌手集計モードの「その他」枠：
@@ -742,7 +1223,7 @@ def call_artist_insufficient(user_id, top_n, region_id):
         GROUP BY a.id, a.name
         HAVING SUM(CASE WHEN r.id IS NULL THEN 0 ELSE 1 END) < %s
            AND SUM(CASE WHEN r.id IS NULL THEN 0 ELSE 1 END) > 0
-        ORDER BY rated_count DESC, total_songs DESC, UPPER(a.name)
+        ORDER BY rated_count DESC, total_songs DESC, a.name_key
     """
 
     with connection.cursor() as cursor:
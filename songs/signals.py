@@ -0,0 +1,139 @@
+"""
+モデルの保存・削除に追従して、派生データ（ランキング集計テーブルと
+ランキング結果キャッシュの版番号、曲目録の変更履歴）を更新する。
+
+ビュー・DRF API・admin（import_export を含む）はいずれも Model.save() /
+delete() を通るので、ここで受ければ書き込み経路ごとに手当てしなくて済む。
+QuerySet.update() と bulk_create() はシグナルが飛ばないので注意。
+
+raw=True（loaddata）のときは何もしない。フィクスチャ投入後は
+manage.py rebuild_rankings で作り直すこと。
+"""
+
+from django.contrib.auth.models import User
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import catalog_changes, metrics, ranking_cache, ranking_store
+from .models import Artist, ArtistAlias, ArtistCredit, CatalogChange, Rating, Song
+
+
+# ===== ランキング結果キャッシュの版上げ =====
+# 曲・歌手は表示項目（曲名・歌手名）も結果に含まれるので、どの列の変更でも上げる。
+
+
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def rating_changed(sender, instance, signal=None, **kwargs):
+    ranking_cache.bump_user_version(instance.user_id)
+    metrics.inc(
+        "music_rating_writes_total",
+        operation="save" if signal is post_save else "delete",
+    )
+
+
+@receiver(post_save, sender=Song)
+@receiver(post_delete, sender=Song)
+@receiver(post_save, sender=Artist)
+@receiver(post_delete, sender=Artist)
+def catalog_changed(sender, instance, **kwargs):
+    ranking_cache.bump_catalog_version()
+
+
+# ===== 曲目録の変更履歴（/api/changes） =====
+# loaddata（raw=True）で入れた行も同期先に届ける必要があるので記録する。
+
+
+@receiver(post_save, sender=Artist)
+@receiver(post_save, sender=ArtistCredit)
+@receiver(post_save, sender=ArtistAlias)
+@receiver(post_save, sender=Song)
+def catalog_saved(sender, instance, created=False, **kwargs):
+    catalog_changes.record(
+        instance, CatalogChange.OP_INSERT if created else CatalogChange.OP_UPDATE
+    )
+    if sender is ArtistCredit and not created:
+        catalog_changes.record_credit_songs(instance)
+
+
+@receiver(post_delete, sender=Artist)
+@receiver(post_delete, sender=ArtistCredit)
+@receiver(post_delete, sender=ArtistAlias)
+@receiver(post_delete, sender=Song)
+def catalog_deleted(sender, instance, **kwargs):
+    catalog_changes.record(instance, CatalogChange.OP_DELETE)
+
+
+# ===== ランキング集計テーブル =====
+
+
+def _deleted_with_user(origin):
+    """ユーザー削除の連鎖で消えた行か（そのユーザーの集計は作り直さない）。"""
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return issubclass(model, User)
+
+
+@receiver(post_save, sender=Rating)
+def rating_saved(sender, instance, raw=False, **kwargs):
+    if raw or not ranking_store.is_enabled():
+        return
+    ranking_store.refresh_song(instance.user_id, instance.song_id)
+
+
+@receiver(post_delete, sender=Rating)
+def rating_deleted(sender, instance, origin=None, **kwargs):
+    if not ranking_store.is_enabled():
+        return
+    # ユーザーごと消える場合、集計テーブルも CASCADE で消える。
+    # ここで作り直すと、削除途中のユーザーを指す行を書き込んでしまう。
+    if origin is not None and _deleted_with_user(origin):
+        return
+    ranking_store.refresh_song(instance.user_id, instance.song_id)
+
+
+@receiver(pre_save, sender=Song)
+def song_pre_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    """変更前の曲情報を控えておく（post_save で旧グループも作り直すため）。"""
+    instance._ranking_snapshot = None
+    if raw or instance.pk is None or not ranking_store.is_enabled():
+        return
+    if update_fields is not None:
+        tracked = {f.removesuffix("_id") for f in ranking_store.TRACKED_SONG_FIELDS}
+        if not tracked & {f.removesuffix("_id") for f in update_fields}:
+            return
+    instance._ranking_snapshot = ranking_store.song_snapshot(instance.pk)
+
+
+@receiver(post_save, sender=Song)
+def song_saved(sender, instance, created=False, raw=False, **kwargs):
+    old = getattr(instance, "_ranking_snapshot", None)
+    if created or raw or old is None:
+        return
+    if all(
+        old[f] == getattr(instance, f) for f in ranking_store.TRACKED_SONG_FIELDS
+    ):
+        return
+    ranking_store.refresh_song_for_all_users(instance.pk, old)
+
+
+@receiver(pre_save, sender=Artist)
+def artist_pre_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    """変更前の地域を控えておく。地域を触らない保存なら何もしない。"""
+    instance._ranking_region_snapshot = None
+    if raw or instance.pk is None or not ranking_store.is_enabled():
+        return
+    if update_fields is not None and "region" not in update_fields:
+        return
+    instance._ranking_region_snapshot = (
+        Artist.objects.filter(pk=instance.pk).values("region_id").first()
+    )
+
+
+@receiver(post_save, sender=Artist)
+def artist_saved(sender, instance, created=False, raw=False, **kwargs):
+    old = getattr(instance, "_ranking_region_snapshot", None)
+    if created or raw or old is None:
+        return
+    if old["region_id"] != instance.region_id:
+        ranking_store.rebuild_users_of_artist(instance.pk)
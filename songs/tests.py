@@ -1 +1,1115 @@
-# テストは未整備。追加する場合は django.test.TestCase を継承したクラスをここに書く。
+"""
+songs のテスト。どれも manage.py generate_dataset で作った合成データの上で動かす
+（土台は SyntheticDataTestCase）。
+
+QueryBudgetTests: ビュー・API ごとの SQL 件数と結果の大きさの回帰テスト。
+manage.py generate_dataset で作った合成データの上で、songs/urls.py と
+songs/api_urls.py の各 URL を叩き、
+  - SQL の件数が songs.query_audit.VIEW_QUERY_BUDGETS の上限以内か
+  - 同じ形の SQL が繰り返されていないか（N+1）
+  - 「もっと見る」などのページ単位の応答が1ページ分を超えていないか
+を確かめる。さらにデータを増やしてから同じ URL を叩き、SQL の件数が
+変わらない（1行ごとに SQL を出していない）ことを確かめる。
+
+その他の機能（流し出し・変更履歴・条件付き GET・まとめての同期・遅いリクエストの
+記録・処理時間の内訳・実行計画の基準・ランキングのキャッシュと集計テーブル）は機能ごとのクラスに分ける。
+
+ランキングのキャッシュは切って、毎回集計させる。
+"""
+
+import importlib.util
+import itertools
+import json
+import tempfile
+import unittest
+from collections import Counter
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
+from django.template.base import Template
+from django.test import TestCase, override_settings
+from django.urls import resolve
+from rest_framework.authtoken.models import Token
+
+from . import (
+    api_views,
+    catalog_changes,
+    flight_recorder,
+    instrumentation,
+    ranking_cache,
+    ranking_store,
+    services,
+    views,
+    views_dump,
+)
+from .management.commands.check_rankings import _normalize_rows, _settle_ties
+from .models import (
+    Artist,
+    ArtistAlias,
+    ArtistCredit,
+    CatalogChange,
+    MusicRegion,
+    RankingEntry,
+    RankingGroup,
+    Rating,
+    Song,
+)
+from .query_audit import VIEW_QUERY_BUDGETS, audit_queries
+
+# 曲追加（bulk_add）で一度に送る行数と、1行あたりの SQL の上限
+# （曲の検索・作成と評価の update_or_create。それぞれセーブポイントを含む）
+BULK_ADD_ROWS = 50
+BULK_ADD_QUERIES_PER_ROW = 10
+
+EXPORT_TOKEN = "test-export-token"
+
+# ランキングの golden テストで比べる top_n
+GOLDEN_TOP_NS = (1, 3, 5, 10, 20)
+
+# 書き換え前（sort key 列や累積和を入れる前）の services.py の SQL。
+# 歌手と作詞/作曲/年で同じ形なので、集計する列と返す列の名前だけ差し替える。
+_PRE_REWRITE_CTE = """
+    WITH filtered AS (
+        SELECT
+            s.{group_col} AS grp,
+            s.id AS song_id,
+            s.title AS song_title,
+            s.artist_id,
+            a.name AS artist_name,
+            {score_col} AS score
+        FROM songs_rating r
+        JOIN songs_song s ON r.song_id = s.id
+        JOIN songs_artist a ON s.artist_id = a.id
+        WHERE r.user_id = %s
+          AND {score_col} IS NOT NULL
+          AND s.is_cover = 0
+          AND s.{group_col} IS NOT NULL
+          {empty_check}
+          {region_filter}
+    ),
+    counts AS (
+        SELECT grp, COUNT(*) AS song_count FROM filtered GROUP BY grp
+    ),
+    ranked AS (
+        SELECT
+            f.*,
+            ROW_NUMBER() OVER (
+                PARTITION BY f.grp
+                ORDER BY f.score DESC, UPPER(f.song_title)
+            ) AS ord,
+            RANK() OVER (PARTITION BY f.grp ORDER BY f.score DESC) AS rnk
+        FROM filtered f
+    )
+"""
+
+_PRE_REWRITE_TOP = """
+    ,
+    top_songs AS (
+        SELECT r.*
+        FROM ranked r
+        JOIN counts c ON r.grp = c.grp
+        WHERE c.song_count >= %s AND r.ord <= %s
+    ),
+    totals AS (
+        SELECT grp, SUM(score) AS total_score FROM top_songs GROUP BY grp
+    ),
+    ranked_totals AS (
+        SELECT grp, total_score, RANK() OVER (ORDER BY total_score DESC) AS grp_rank
+        FROM totals
+    )
+    SELECT
+        ts.grp AS {group_alias},
+        rt.grp_rank AS {prefix}_rank,
+        rt.total_score,
+        ts.song_id,
+        ts.song_title,
+        ts.artist_id,
+        ts.artist_name,
+        ts.score,
+        ts.rnk AS rank_{prefix},
+        ts.ord AS order_{prefix}
+    FROM top_songs ts
+    JOIN ranked_totals rt ON ts.grp = rt.grp
+    ORDER BY rt.grp_rank, UPPER({name_col}), ts.ord
+"""
+
+_PRE_REWRITE_INSUFFICIENT = """
+    ,
+    insufficient_songs AS (
+        SELECT r.*
+        FROM ranked r
+        JOIN counts c ON r.grp = c.grp
+        WHERE c.song_count < %s AND r.ord <= %s
+    )
+    SELECT
+        grp AS {group_alias},
+        song_id,
+        song_title,
+        artist_id,
+        artist_name,
+        score,
+        ord AS order_{prefix},
+        RANK() OVER (ORDER BY score DESC) AS rank_within_insufficient
+    FROM insufficient_songs
+    ORDER BY score DESC, UPPER(artist_name), UPPER(song_title)
+"""
+
+# golden テストで比べる列（関数ごと）。名前などの表示用の列は除く
+_GOLDEN_FIELDS = {
+    "call_artist_song_top_n": (
+        "artist_id",
+        "artist_rank",
+        "total_score",
+        "song_id",
+        "score",
+        "rank_artist",
+        "order_artist",
+    ),
+    "call_creator_song_top_n": (
+        "creator",
+        "creator_rank",
+        "total_score",
+        "song_id",
+        "score",
+        "rank_creator",
+        "order_creator",
+    ),
+    "call_artist_insufficient_songs": (
+        "artist_id",
+        "song_id",
+        "score",
+        "order_artist",
+        "rank_within_insufficient",
+    ),
+    "call_creator_insufficient_songs": (
+        "creator",
+        "song_id",
+        "score",
+        "rank_within_insufficient",
+    ),
+}
+
+
+def _pre_rewrite_rows(kind, insufficient, user_id, top_n, region_id, karaoke_mode):
+    """書き換え前の SQL で、services の関数と同じ名前の列の行を返す。"""
+    if kind == "artist":
+        group_col, is_numeric = "artist_id", True
+        names = {
+            "group_alias": "artist_id",
+            "prefix": "artist",
+            "name_col": "ts.artist_name",
+        }
+    else:
+        group_col, is_numeric = services._CREATOR_COLUMNS[kind]
+        names = {"group_alias": "creator", "prefix": "creator", "name_col": "ts.grp"}
+    params = [user_id]
+    region_filter = ""
+    if region_id:
+        region_filter = "AND a.region_id = %s"
+        params.append(region_id)
+    params += [top_n, top_n]
+    sql = _PRE_REWRITE_CTE.format(
+        group_col=group_col,
+        score_col="r.karaoke_score" if karaoke_mode else "r.score",
+        empty_check="" if is_numeric else f"AND s.{group_col} <> ''",
+        region_filter=region_filter,
+    ) + (_PRE_REWRITE_INSUFFICIENT if insufficient else _PRE_REWRITE_TOP).format(
+        **names
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        columns = [c[0] for c in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def _view_key(path):
+    """VIEW_QUERY_BUDGETS のキー（URL 名。名前の無い API は URL パターン）。"""
+    match = resolve(path.split("?", 1)[0])
+    return match.url_name or match.route
+
+
+def _seed(prefix, **sizes):
+    call_command("generate_dataset", prefix=prefix, seed=1, stdout=StringIO(), **sizes)
+
+
+@override_settings(
+    RANKING_CACHE_TIMEOUT=0,
+    QUERY_AUDIT="off",
+    SLOW_REQUEST_MS=0,
+    METRICS_ENABLED=False,
+    REQUIRE_API_AUTH=True,
+    # チェックサムの控えをリポジトリの cache/ に書かない
+    CACHES={
+        **settings.CACHES,
+        "catalog": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    },
+)
+class SyntheticDataTestCase(TestCase):
+    """
+    generate_dataset の合成データ（ユーザー2人・曲300曲）の上で叩くテストの土台。
+    base_0 はスタッフで、API のトークンも持つ。
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        _seed("base", users=2, artists=30, songs=300, ratings_per_user=200)
+        cls.user = User.objects.get(username="base_0")
+        cls.user.is_staff = True
+        cls.user.save(update_fields=["is_staff"])
+        cls.token = Token.objects.create(user=cls.user).key
+        cls.artist = Artist.objects.order_by("id").first()
+        cls.song = Song.objects.filter(ratings__user=cls.user).order_by("id").first()
+        cls.region = MusicRegion.objects.order_by("id").first()
+
+    def setUp(self):
+        # チェックサムの控えはテストのロールバックで戻らない
+        caches[catalog_changes.CACHE_ALIAS].clear()
+        self.client.force_login(self.user)
+
+    def _budget(self, path):
+        view = _view_key(path)
+        self.assertIn(view, VIEW_QUERY_BUDGETS, f"{view} の上限がありません")
+        return VIEW_QUERY_BUDGETS[view]
+
+    def _request(self, method, path, budget=None, **kwargs):
+        """上限と N+1 を確かめながら叩く。戻り値: (response, SQL の件数)"""
+        if budget is None:
+            budget = self._budget(path)
+        with audit_queries(budget=budget, label=f"{method} {path}") as log:
+            response = getattr(self.client, method)(path, **kwargs)
+        return response, log.count
+
+    def _api_headers(self):
+        return {"HTTP_AUTHORIZATION": f"Token {self.token}"}
+
+
+class QueryBudgetTests(SyntheticDataTestCase):
+    """ビュー・API ごとの SQL 件数の上限と、データを増やしても件数が増えないこと。"""
+
+    def _get_cases(self):
+        """GET で叩く URL。地域・集計軸・カラオケ・ページの切り替えを含める。"""
+        artist_id = self.artist.id
+        return [
+            "/ranking/",
+            "/ranking/?top_n=20&karaoke=1",
+            "/ranking/?region_id=",
+            "/ranking/more/?kind=artist&parent_offset=20",
+            "/ranking/more/?kind=year&parent_offset=0&karaoke=1",
+            "/ranking/more/?kind=lyricist&parent_offset=1000",
+            "/artists/",
+            "/artist_rank_matrix/",
+            "/artist_rank_matrix/?ns=1,3,10",
+            "/song_ranking/",
+            "/song_ranking/?karaoke=1&region_id=",
+            "/song_ranking/rows/?offset=200",
+            "/song_ranking/rows/?offset=200&karaoke=1",
+            f"/artists/{artist_id}/songs/",
+            "/songs/",
+            "/songs/?q=a",
+            "/artist_search/",
+            "/artist_search/?prefix=a&top=1",
+            "/artist_search/rows/?offset=200",
+            "/lyricists/",
+            "/composers/?karaoke=1",
+            "/years/",
+            "/lyricist-grid/",
+            "/composer-grid/",
+            "/year-grid/",
+            "/lyricist-matrix/",
+            "/composer-matrix/",
+            "/year-matrix/",
+            "/creator-songs/?type=lyricist&name=a",
+            "/songs/bulk_add/",
+            f"/songs/bulk_add/?artist_id={artist_id}",
+            "/artist_year_heatmap/",
+            "/slow-requests/",
+        ]
+
+    def _api_cases(self):
+        return [
+            "/api/artists/",
+            "/api/artist_credits/",
+            "/api/artist_aliases/",
+            "/api/songs/",
+            "/api/changes?since=0",
+            "/api/songs_rating",
+            f"/api/songs_rating?user_id={self.user.id}&limit=50",
+        ]
+
+    def _measure_gets(self):
+        counts = {}
+        for path in self._get_cases():
+            with self.subTest(path=path):
+                response, counts[path] = self._request("get", path)
+                self.assertEqual(response.status_code, 200)
+        for path in self._api_cases():
+            with self.subTest(path=path):
+                response, counts[path] = self._request(
+                    "get", path, **self._api_headers()
+                )
+                self.assertEqual(response.status_code, 200)
+        return counts
+
+    def _grow(self):
+        """歌手・曲を増やし、ログイン中のユーザーにも評価を足す。"""
+        _seed("grow", users=1, artists=60, songs=900, ratings_per_user=10)
+        songs = Song.objects.filter(artist__name__startswith="grow").order_by("id")
+        Rating.objects.bulk_create(
+            Rating(
+                user=self.user,
+                song=song,
+                score=40 + (song.id % 60),
+                karaoke_score=80 + song.id % 20 if song.id % 3 == 0 else None,
+            )
+            for song in songs
+        )
+
+
+    # ===== GET =====
+
+    def test_get_budgets_stay_flat_as_data_grows(self):
+        before = self._measure_gets()
+        self._grow()
+        after = self._measure_gets()
+        for path, count in before.items():
+            with self.subTest(path=path):
+                self.assertLessEqual(
+                    after[path], count, f"データを増やしたら SQL が増えた: {path}"
+                )
+
+    def test_paged_endpoints_return_one_page(self):
+        self._grow()
+        cases = [
+            ("/song_ranking/rows/?offset=0", views.SONG_RANKING_PAGE_SIZE),
+            ("/song_ranking/rows/?offset=0&karaoke=1", views.SONG_RANKING_PAGE_SIZE),
+            ("/artist_search/rows/?offset=0", views.ARTIST_SEARCH_PAGE_SIZE),
+        ]
+        for path, page_size in cases:
+            with self.subTest(path=path):
+                response, _ = self._request("get", path)
+                data = response.json()
+                self.assertLessEqual(data["loaded_count"], page_size)
+
+        response, _ = self._request("get", "/song_ranking/")
+        self.assertLessEqual(
+            len(response.context["songs"]), views.SONG_RANKING_PAGE_SIZE
+        )
+        response, _ = self._request("get", "/ranking/?region_id=")
+        self.assertLessEqual(
+            len(response.context["rankings"]), views.RANKING_PARENT_PAGE_SIZE
+        )
+        response, _ = self._request(
+            "get", "/ranking/more/?kind=artist&parent_offset=0&region_id="
+        )
+        self.assertLessEqual(
+            response.content.count(b"artist-card"),
+            views.RANKING_PARENT_PAGE_SIZE * 2,
+        )
+
+    def test_api_lists_return_each_row_once(self):
+        headers = self._api_headers()
+        cases = [
+            ("/api/artists/", Artist.objects.count()),
+            ("/api/artist_credits/", ArtistCredit.objects.count()),
+            ("/api/artist_aliases/", ArtistAlias.objects.count()),
+            ("/api/songs/", Song.objects.count()),
+            ("/api/songs_rating", Rating.objects.count()),
+            (f"/api/songs_rating?user_id={self.user.id}&limit=50", 50),
+        ]
+        for path, expected in cases:
+            with self.subTest(path=path):
+                response, _ = self._request("get", path, **headers)
+                self.assertEqual(len(response.json()), expected)
+
+    def test_ops_endpoints(self):
+        with mock.patch.object(views_dump, "EXPORT_API_TOKEN", EXPORT_TOKEN):
+            response, _ = self._request(
+                "get", "/metrics", HTTP_X_EXPORT_TOKEN=EXPORT_TOKEN
+            )
+            self.assertEqual(response.status_code, 200)
+            response, _ = self._request(
+                "get", "/api/dump/list", HTTP_X_EXPORT_TOKEN=EXPORT_TOKEN
+            )
+            self.assertEqual(response.status_code, 200)
+        response, _ = self._request("get", "/slow-requests/0-0/")
+        self.assertEqual(response.status_code, 404)
+        response, _ = self._request("get", "/profiles/0-0.pstats")
+        self.assertEqual(response.status_code, 404)
+
+        self.client.logout()
+        response, _ = self._request("get", "/login/")
+        self.assertEqual(response.status_code, 200)
+        response, _ = self._request("get", "/signup/")
+        self.assertEqual(response.status_code, 200)
+
+    # ===== 書き込み =====
+
+    def test_rating_updates(self):
+        song_id = self.song.id
+        response, _ = self._request(
+            "post", "/update-rating/", data={"song_id": song_id, "score": 77}
+        )
+        self.assertEqual(response.json()["score"], 77)
+        response, _ = self._request(
+            "post",
+            "/update-karaoke-score/",
+            data={"song_id": song_id, "karaoke_score": "88.5"},
+        )
+        self.assertTrue(response.json()["success"])
+        response, _ = self._request(
+            "post", "/update-cover/", data={"song_id": song_id, "is_cover": "true"}
+        )
+        self.assertTrue(response.json()["success"])
+        response, _ = self._request(
+            "post",
+            "/update-credits/",
+            data={"song_id": song_id, "field": "year", "value": "1999"},
+        )
+        self.assertEqual(response.status_code, 200)
+
+        headers = self._api_headers()
+        response, _ = self._request(
+            "post",
+            "/api/ratings/score/update",
+            data={"song_id": song_id, "score": 66, "karaoke_score": "90.1"},
+            **headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        response, _ = self._request(
+            "post",
+            "/api/songs/update_credits",
+            data={"song_id": song_id, "lyricist": "作詞者", "year": 2001},
+            **headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        response, _ = self._request(
+            "post",
+            "/api/songs/create_with_artist",
+            data={
+                "artist_name": "新しい歌手",
+                "title": "新しい曲",
+                "region_id": self.region.id,
+            },
+            **headers,
+        )
+        self.assertIn(response.status_code, (200, 201))
+        self.assertEqual(Rating.objects.get(user=self.user, song=self.song).score, 66)
+
+    def test_heatmap_saves(self):
+        artists = list(Artist.objects.order_by("id").values_list("id", flat=True)[:20])
+        items = [
+            {"artist_id": artist_id, "year": year, "score": (artist_id + year) % 5}
+            for artist_id in artists
+            for year in range(2000, 2010)
+        ]
+        for path, payload in [
+            ("/api/artist_year_heatmap/bulk_save/", {"items": items}),
+            ("/api/artist_year_heatmap/bulk_save/", {"items": items[:10]}),
+            (
+                "/api/artist_year_heatmap/range_set/",
+                {"artist_id": artists[0], "from": 1990, "to": 2020, "score": 3},
+            ),
+            (
+                "/api/artist_year_heatmap/range_set/",
+                {"artist_id": artists[0], "from": 1990, "to": 2020, "score": 0},
+            ),
+            ("/api/artist_year_heatmap/add_artist/", {"artist_id": artists[1]}),
+        ]:
+            with self.subTest(path=path, payload=str(payload)[:60]):
+                response, _ = self._request(
+                    "post",
+                    path,
+                    data=json.dumps(payload),
+                    content_type="application/json",
+                )
+                self.assertTrue(response.json()["success"])
+
+    def test_bulk_add_post(self):
+        """曲追加は行の数だけ保存するので、上限は行数に比例させる（データ量には比例しない）。"""
+        data = {"mode": "single", "artist_id": self.artist.id}
+        for i in range(BULK_ADD_ROWS):
+            data[f"song_title_{i}"] = f"一括追加の曲 {i}"
+            data[f"song_lyricist_{i}"] = "作詞者"
+            data[f"song_year_{i}"] = "2020"
+            data[f"song_score_{i}"] = str(50 + i)
+        budget = BULK_ADD_ROWS * BULK_ADD_QUERIES_PER_ROW + VIEW_QUERY_BUDGETS[
+            "bulk_add_songs"
+        ]
+
+        # 行ごとに同じ形の SQL が出るのは仕様なので、N+1 の検査はしない
+        with audit_queries(budget=budget, threshold=10**9) as log:
+            response = self.client.post("/songs/bulk_add/", data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            Song.objects.filter(title__startswith="一括追加の曲").count(), BULK_ADD_ROWS
+        )
+        first = log.count
+
+        # 同じ行をもう一度（既存曲の更新）送っても、データが増えても件数は変わらない
+        self._grow()
+        with audit_queries(budget=budget, threshold=10**9) as log:
+            self.client.post("/songs/bulk_add/", data)
+        self.assertLessEqual(log.count, first)
+
+
+class RatingExportTests(SyntheticDataTestCase):
+    """/api/songs_rating の流し出し（stream / cursor）。"""
+
+    def test_rating_export_streams_in_chunks_and_resumes(self):
+        """stream=jsonl は chunk ずつ読み、cursor で続きから取り直せる。"""
+        headers = self._api_headers()
+        total = Rating.objects.count()
+        with mock.patch.object(api_views, "RATING_EXPORT_CHUNK", 50):
+            # chunk ごとに同じ形の SELECT が出るのは仕様なので、N+1 の検査はしない
+            with audit_queries(budget=4 + total // 50 + 1, threshold=10**9) as log:
+                response = self.client.get("/api/songs_rating?stream=jsonl", **headers)
+                lines = b"".join(response.streaming_content).decode().splitlines()
+            rows = [json.loads(line) for line in lines]
+            self.assertEqual(len(rows), total)
+            self.assertGreater(log.count, total // 50)  # 1回で全件を読んでいない
+            keys = [(r["updated_at"], r["id"]) for r in rows]
+            self.assertEqual(len(set(keys)), total)
+
+            last = rows[29]
+            cursor = f"{last['updated_at']},{last['id']}"
+            response = self.client.get(
+                "/api/songs_rating", {"cursor": cursor, "stream": "json"}, **headers
+            )
+            rest = json.loads(b"".join(response.streaming_content))
+        self.assertEqual([r["id"] for r in rest], [r["id"] for r in rows[30:]])
+
+
+class CatalogChangeFeedTests(SyntheticDataTestCase):
+    """曲目録の変更履歴（/api/changes）とチェックサム。"""
+
+    def test_catalog_changes_feed(self):
+        """変更履歴は行ごとに最後の状態へまとめ、依存の順で返す。"""
+        headers = self._api_headers()
+        since = self.client.get("/api/changes", **headers).json()["next"]
+
+        artist = Artist.objects.order_by("id").last()
+        artist.name = "改名した歌手"
+        artist.save()
+        alias = ArtistAlias.objects.create(artist=artist, name="別表記")
+        alias.name = "別表記2"
+        alias.save()
+        credit = ArtistCredit.objects.filter(songs__isnull=False).first()
+        credit.name = "改名した名義"
+        credit.save()
+        song = Song.objects.exclude(credit=credit).order_by("id").first()
+        song_id = song.id
+        song.delete()
+
+        response, _ = self._request("get", f"/api/changes?since={since}", **headers)
+        data = response.json()
+        self.assertFalse(data["has_more"])
+        self.assertEqual(
+            [u["table"] for u in data["upserts"]],
+            ["artists", "artist_credits", "artist_aliases", "songs"],
+        )
+        upserts = {u["table"]: u["rows"] for u in data["upserts"]}
+        self.assertEqual([r["name"] for r in upserts["artist_aliases"]], ["別表記2"])
+        self.assertEqual(upserts["artists"][0]["name"], "改名した歌手")
+        self.assertEqual(
+            {r["credit_name"] for r in upserts["songs"]}, {"改名した名義"}
+        )
+        self.assertEqual(data["deletes"], [{"table": "songs", "ids": [song_id]}])
+
+        # 手元で同じ計算をしたチェックサムと合う
+        for table, path in [
+            ("artists", "/api/artists/"),
+            ("artist_aliases", "/api/artist_aliases/"),
+            ("songs", "/api/songs/"),
+        ]:
+            rows = self.client.get(path, **headers).json()
+            expected = {
+                "count": len(rows),
+                "crc32_sum": sum(map(catalog_changes.row_checksum, rows)) % 2**32,
+            }
+            self.assertEqual(data["checksums"][table], expected, table)
+
+        # 詰めても同じ差分を返す
+        before = catalog_changes.changes_since(since)
+        call_command("compact_catalog_changes", days=0, stdout=StringIO())
+        self.assertEqual(catalog_changes.changes_since(since), before)
+
+        data = self.client.get(f"/api/changes?since={data['next']}", **headers).json()
+        self.assertEqual((data["upserts"], data["deletes"]), ([], []))
+
+        # 行を書き換えてからチェックサムを取り直すと、その行だけ計算し直した値が
+        # 全件から計算した値と合う
+        song = Song.objects.order_by("id").first()
+        song.year = 1985
+        song.save()
+        data = self.client.get(f"/api/changes?since={data['next']}", **headers).json()
+        rows = self.client.get("/api/songs/", **headers).json()
+        self.assertEqual(
+            data["checksums"]["songs"]["crc32_sum"],
+            sum(map(catalog_changes.row_checksum, rows)) % 2**32,
+        )
+
+    def test_catalog_changes_late_commit_with_lower_id(self):
+        """後から若い id でコミットされた履歴も、次の差分で返す。"""
+        headers = self._api_headers()
+        first, second = Artist.objects.order_by("id")[:2]
+        CatalogChange.objects.create(
+            id=1000, table="artists", object_id=first.id, op=CatalogChange.OP_UPDATE
+        )
+        data = self.client.get("/api/changes?since=0", **headers).json()
+        self.assertEqual([r["id"] for r in data["upserts"][0]["rows"]], [first.id])
+        self.assertIsNotNone(data["checksums"])
+
+        # id 1000 より前に始まり、読み出しの後でコミットされた書き込み
+        CatalogChange.objects.create(
+            id=999, table="artists", object_id=second.id, op=CatalogChange.OP_UPDATE
+        )
+        data = self.client.get(f"/api/changes?since={data['next']}", **headers).json()
+        self.assertEqual([r["id"] for r in data["upserts"][0]["rows"]], [second.id])
+        data = self.client.get(f"/api/changes?since={data['next']}", **headers).json()
+        self.assertEqual((data["upserts"], data["deletes"]), ([], []))
+
+
+class ConditionalGetTests(SyntheticDataTestCase):
+    """一覧の API と他のユーザーのランキング画面の条件付き GET（ETag）。"""
+
+    def test_conditional_get(self):
+        """一覧の API と他のユーザーのランキング画面は、変わっていなければ 304。"""
+        headers = self._api_headers()
+        response = self.client.get("/api/artists/", **headers)
+        etag = response["ETag"]
+        with audit_queries() as log:
+            response = self.client.get("/api/artists/", HTTP_IF_NONE_MATCH=etag, **headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertLessEqual(log.count, 3)  # トークン・変更履歴・最大の id だけ
+        # 秒単位の時刻では変更を見分けられないので、If-Modified-Since では 304 にしない
+        self.assertFalse(response.has_header("Last-Modified"))
+        response = self.client.get(
+            "/api/artists/",
+            HTTP_IF_MODIFIED_SINCE="Fri, 01 Jan 2100 00:00:00 GMT",
+            **headers,
+        )
+        self.assertEqual(response.status_code, 200)
+
+        artist = Artist.objects.order_by("id").first()
+        artist.name = "改名した歌手"
+        artist.save()
+        response = self.client.get("/api/artists/", HTTP_IF_NONE_MATCH=etag, **headers)
+        self.assertEqual(response.status_code, 200)
+
+        other = User.objects.get(username="base_1")
+        path = f"/ranking/?user={other.id}"
+        self.client.get(path)  # CSRF のクッキーを受け取る（版に含まれる）
+        etag = self.client.get(path)["ETag"]
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        Rating.objects.filter(user=other).first().save()
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        # 自分の画面は採点を直すので毎回作り直す
+        self.assertFalse(self.client.get("/ranking/").has_header("ETag"))
+
+
+class RatingSyncTests(SyntheticDataTestCase):
+    """オフライン端末からの評価のまとめて同期（/api/ratings/score/batch）。"""
+
+    def test_rating_sync_batch(self):
+        rated = list(Rating.objects.filter(user=self.user).order_by("song_id")[:150])
+        unrated = list(
+            Song.objects.exclude(ratings__user=self.user)
+            .select_related("artist")
+            .order_by("id")[:100]
+        )
+        old = "2000-01-01T00:00:00+09:00"
+        items = [
+            {"key": f"r{r.song_id}", "song_id": r.song_id, "score": 11}
+            for r in rated[:-1]
+        ]
+        # サーバー上の評価より古い端末の採点は当てない
+        items.append(
+            {
+                "key": "stale",
+                "song_id": rated[-1].song_id,
+                "score": 1,
+                "client_updated_at": old,
+            }
+        )
+        items += [
+            {"key": f"u{song.id}", "song_id": song.id, "karaoke_score": "77.7"}
+            for song in unrated[:-2]
+        ]
+        # 歌手名＋曲名で探す（大文字小文字無視のフォールバックも）
+        by_name = unrated[-2:]
+        items += [
+            {
+                "key": "n1",
+                "artist": by_name[0].artist.name,
+                "title": by_name[0].title,
+                "score": 55,
+            },
+            {
+                "key": "n2",
+                "artist": by_name[1].artist.name.upper(),
+                "title": by_name[1].title.upper(),
+                "score": 56,
+            },
+            {"key": "missing", "artist": "いない歌手", "title": "無い曲", "score": 1},
+            {"key": "bad", "song_id": self.song.id, "score": 101},
+            # 同じリクエストの中での送り直し
+            {"key": f"r{rated[0].song_id}", "song_id": rated[0].song_id, "score": 11},
+        ]
+        payload = json.dumps({"items": items})
+
+        def post():
+            response, count = self._request(
+                "post",
+                "/api/ratings/score/batch",
+                data=payload,
+                content_type="application/json",
+                **self._api_headers(),
+            )
+            self.assertEqual(response.status_code, 200)
+            return response.json()["results"], count
+
+        results, count = post()
+        statuses = [result["status"] for result in results]
+        self.assertEqual([r["index"] for r in results], list(range(len(items))))
+        self.assertEqual(statuses.count("updated"), 150)  # 同じリクエストの送り直しを含む
+        self.assertEqual(statuses.count("created"), len(unrated))
+        self.assertEqual(statuses[149], "stale")
+        self.assertEqual(statuses[-3:], ["not_found", "invalid", "updated"])
+        self.assertTrue(results[-1]["replayed"])
+        self.assertEqual(
+            [results[-5]["song_id"], results[-4]["song_id"]], [s.id for s in by_name]
+        )
+        ratings = Rating.objects.filter(user=self.user)
+        self.assertEqual(ratings.filter(score=11).count(), 149)
+        self.assertEqual(ratings.filter(karaoke_score="77.7").count(), len(unrated) - 2)
+        self.assertEqual(ratings.get(song_id=rated[-1].song_id).score, rated[-1].score)
+
+        # 送り直しは書き込まずに前回の結果を返す
+        ratings.filter(score=11).update(score=12)
+        replayed, replay_count = post()
+        self.assertLessEqual(replay_count, count)
+        self.assertTrue(
+            all(r.get("replayed") for r in replayed if r["key"] not in ("missing", "bad"))
+        )
+        self.assertEqual(ratings.filter(score=12).count(), 149)
+
+        # 画面で直したら端末の時刻は消え、サーバーの時刻で後勝ちを比べる
+        song_id = rated[0].song_id
+        self.client.post("/update-rating/", data={"song_id": song_id, "score": 30})
+        rating = ratings.get(song_id=song_id)
+        self.assertIsNone(rating.client_updated_at)
+        response = self.client.post(
+            "/api/ratings/score/batch",
+            data=json.dumps(
+                {"items": [{"song_id": song_id, "score": 5, "client_updated_at": old}]}
+            ),
+            content_type="application/json",
+            **self._api_headers(),
+        )
+        self.assertEqual(response.json()["results"][0]["status"], "stale")
+
+        # 不正な数値の項目があっても他の項目は当たる。点数は列の桁に丸めて返す
+        response = self.client.post(
+            "/api/ratings/score/batch",
+            data=json.dumps(
+                {
+                    "items": [
+                        {"song_id": song_id, "karaoke_score": "77.7777"},
+                        {"song_id": song_id, "karaoke_score": "NaN"},
+                        {"song_id": song_id, "karaoke_score": "Infinity"},
+                    ]
+                }
+            ),
+            content_type="application/json",
+            **self._api_headers(),
+        )
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual(results[0]["karaoke_score"], "77.778")
+        self.assertEqual([r["status"] for r in results[1:]], ["invalid", "invalid"])
+        self.assertEqual(
+            str(ratings.get(song_id=song_id).karaoke_score), results[0]["karaoke_score"]
+        )
+
+        response = self.client.post(
+            "/api/ratings/score/batch",
+            data=json.dumps({"items": []}),
+            content_type="application/json",
+            **self._api_headers(),
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class FlightRecorderTests(SyntheticDataTestCase):
+    """遅いリクエストの記録（songs.flight_recorder）。"""
+
+    def test_slow_request_record_hides_credentials(self):
+        session_key = self.client.session.session_key
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(SLOW_REQUEST_MS=0.001, SLOW_REQUEST_DIR=directory):
+                self.client.get("/songs/")
+                self.client.logout()
+                self.client.get("/api/songs_rating?limit=1", **self._api_headers())
+                records = [
+                    flight_recorder.load_record(r["id"])
+                    for r in flight_recorder.list_records()
+                ]
+        self.assertEqual(len(records), 2)
+        text = json.dumps(records, ensure_ascii=False)
+        self.assertIn("django_session", text)
+        self.assertIn("authtoken_token", text)
+        self.assertNotIn(session_key, text)
+        self.assertNotIn(self.token, text)
+
+
+@unittest.skipUnless(connection.vendor == "sqlite", "基準は SQLite 分だけ入れてある")
+class QueryPlanTests(SyntheticDataTestCase):
+    """
+    services.py の SQL の実行計画を基準（query_plans/sqlite.json）と比べる。
+    基準はこのクラスと同じ合成データで取ってある（check_query_plans の説明を参照）。
+    """
+
+    def test_plans_match_baseline(self):
+        out = StringIO()
+        # 実行計画が変わっていれば CommandError になる
+        call_command("check_query_plans", user="base_0", stdout=out)
+        self.assertIn("実行計画の変化はありません", out.getvalue())
+
+
+class ServerTimingTests(SyntheticDataTestCase):
+    """処理時間の内訳（songs.instrumentation）。"""
+
+    @override_settings(SERVER_TIMING=True)
+    def test_template_render_is_patched_once(self):
+        # 差し替えは SongsConfig.ready で済んでいて、ミドルウェアを作っても変わらない
+        self.assertIs(Template.render, instrumentation._timed_render)
+        instrumentation.ServerTimingMiddleware(lambda request: None)
+        instrumentation.install()
+        self.assertIs(Template.render, instrumentation._timed_render)
+
+        # 外からの計測（profile_page）とリクエストの集計は同じ描画を1回ずつ数える
+        with instrumentation.template_timer() as outer:
+            response = self.client.get("/songs/")
+        self.assertGreater(outer.template_ms, 0)
+        self.assertIn(f"tpl;dur={outer.template_ms:.1f}", response["Server-Timing"])
+
+
+@override_settings(
+    RANKING_CACHE_TIMEOUT=60,
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "rankings": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "ranking-cache-tests",
+        },
+    },
+)
+class RankingCacheTests(TestCase):
+    """ランキング結果のキャッシュ（songs.ranking_cache）の版番号。"""
+
+    def test_lost_version_never_reuses_an_old_one(self):
+        seen = [ranking_cache.data_version(1)]
+        with self.captureOnCommitCallbacks(execute=True):
+            ranking_cache.bump_user_version(1)
+            ranking_cache.bump_catalog_version()
+        seen.append(ranking_cache.data_version(1))
+        self.assertNotEqual(seen[0], seen[1])
+
+        # MAX_ENTRIES の間引きで版番号のキーが消えた場合
+        cache = caches[ranking_cache.CACHE_ALIAS]
+        cache.delete(ranking_cache._user_version_key(1))
+        cache.delete(ranking_cache._CATALOG_VERSION_KEY)
+        current = ranking_cache.data_version(1)
+        for old in seen:
+            self.assertNotEqual(current[0], old[0])
+            self.assertNotEqual(current[1], old[1])
+        self.assertEqual(ranking_cache.data_version(1), current)
+
+
+class RankingStoreTests(SyntheticDataTestCase):
+    """ランキングの集計テーブル（songs.ranking_store）。"""
+
+    KANA_NAMES = ["さくら", "サクラ"]
+
+    def _snapshot(self):
+        groups = RankingGroup.objects.filter(user=self.user).values_list(
+            "dimension", "region_key", "karaoke_mode", "group_key", "song_count"
+        )
+        entries = RankingEntry.objects.filter(user=self.user).values_list(
+            "dimension",
+            "region_key",
+            "karaoke_mode",
+            "group_key",
+            "song_id",
+            "order_in_group",
+            "rank_in_group",
+        )
+        return sorted(groups), sorted(entries)
+
+    def _assert_kana_groups_match_db(self):
+        # 作詞者ごとの曲数を DB の GROUP BY で出す
+        # （MySQL の utf8mb4_ja_0900_as_cs ではひらがなとカタカナが1グループになる）
+        expected = (
+            Rating.objects.filter(
+                user=self.user,
+                song__is_cover=False,
+                song__lyricist__in=self.KANA_NAMES,
+            )
+            .values("song__lyricist")
+            .annotate(n=Count("id"))
+            .values_list("n", flat=True)
+        )
+        stored = RankingGroup.objects.filter(
+            user=self.user,
+            dimension="lyricist",
+            region_key=ranking_store.ALL_REGIONS,
+            karaoke_mode=False,
+            group_key__in=self.KANA_NAMES,
+        ).values_list("song_count", flat=True)
+        self.assertEqual(sorted(stored), sorted(expected))
+
+    @override_settings(RANKING_BACKEND="store")
+    def test_kana_variant_lyricists_follow_db_collation(self):
+        credit = self.artist.ensure_primary_credit()
+        songs = [
+            Song.objects.create(
+                title=f"かな違い{i}",
+                artist=self.artist,
+                credit=credit,
+                is_cover=False,
+                lyricist=name,
+            )
+            for i, name in enumerate(self.KANA_NAMES)
+        ]
+        ranking_store.rebuild_user(self.user.id)
+        # 評価の保存ごとにシグナルからグループ単位で作り直される
+        for score, song in zip((80, 90), songs):
+            Rating.objects.create(user=self.user, song=song, score=score)
+        self._assert_kana_groups_match_db()
+        incremental = self._snapshot()
+
+        ranking_store.rebuild_user(self.user.id)
+        self._assert_kana_groups_match_db()
+        self.assertEqual(self._snapshot(), incremental)
+
+        Rating.objects.filter(user=self.user, song=songs[1]).delete()
+        self._assert_kana_groups_match_db()
+        incremental = self._snapshot()
+        ranking_store.rebuild_user(self.user.id)
+        self.assertEqual(self._snapshot(), incremental)
+
+    def test_build_groups_by_db_collation_key(self):
+        # DB が同じグループ番号を付けた作詞者は、文字列が違っても1グループにする
+        # （sqlite の照合順序では再現できないので、MySQL が返す形の行を直接渡す）
+        rows = [
+            {
+                "song_id": song_id,
+                "score": score,
+                "karaoke_score": None,
+                "song__artist_id": self.artist.id,
+                "song__artist__region_id": None,
+                "song__lyricist": name,
+                "song__composer": None,
+                "song__year": None,
+                "lyricist_group": 1,
+                "lyricist_targeted": True,
+                "composer_group": 1,
+                "composer_targeted": False,
+            }
+            for song_id, score, name in ((1, 80, "サクラ"), (2, 90, "さくら"))
+        ]
+        for targets in (None, {("lyricist", "サクラ")}):
+            groups, entries = ranking_store._build(
+                self.user.id, rows, ["lyricist"], targets
+            )
+            self.assertEqual(
+                [(g.group_key, g.song_count) for g in groups], [("さくら", 2)]
+            )
+            self.assertEqual(
+                [(e.song_id, e.order_in_group) for e in entries], [(2, 1), (1, 2)]
+            )
+
+
+@override_settings(RANKING_CACHE_TIMEOUT=0, METRICS_ENABLED=False)
+class RankingGoldenTests(TestCase):
+    """
+    ランキングの各実装（sql / store / numpy）を小さな合成データで突き合わせる。
+    SQL 版は書き換え前の SQL とも比べる。top_n は 1/3/5/10/20、
+    地域は全地域と各地域、採点は好み度とカラオケ採点の両方。
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        _seed("gold", users=1, artists=12, songs=150, ratings_per_user=120)
+        cls.user = User.objects.get(username="gold_0")
+        ranking_store.rebuild_user(cls.user.id)
+        cls.region_ids = [None] + list(
+            MusicRegion.objects.order_by("id").values_list("id", flat=True)
+        )
+
+    def test_backends_match_sql(self):
+        backends = ["sql", "store"]
+        if importlib.util.find_spec("numpy") is not None:
+            backends.append("numpy")
+        for backend in backends:
+            with self.subTest(backend=backend):
+                # 食い違いがあれば CommandError になる
+                call_command(
+                    "check_rankings",
+                    backend=backend,
+                    user=self.user.username,
+                    top_ns=",".join(str(n) for n in GOLDEN_TOP_NS),
+                    stdout=StringIO(),
+                )
+
+    def _golden_rows(self, name, rows):
+        fields = _GOLDEN_FIELDS[name]
+        return [
+            {f: r[f] for f in fields} for r in _normalize_rows(_settle_ties(name, rows))
+        ]
+
+    def test_sql_matches_pre_rewrite_query(self):
+        compared = Counter()
+        patterns = itertools.product(
+            services.RANKING_KINDS,
+            (False, True),
+            self.region_ids,
+            (False, True),
+            GOLDEN_TOP_NS,
+        )
+        for kind, insufficient, region_id, karaoke_mode, top_n in patterns:
+            prefix, extra = ("artist", ()) if kind == "artist" else ("creator", (kind,))
+            name = (
+                f"call_{prefix}_insufficient_songs"
+                if insufficient
+                else f"call_{prefix}_song_top_n"
+            )
+            expected = _pre_rewrite_rows(
+                kind, insufficient, self.user.id, top_n, region_id, karaoke_mode
+            )
+            actual = getattr(services, name)(
+                self.user.id, top_n, region_id, *extra, karaoke_mode=karaoke_mode
+            )
+            compared[name, kind] += len(expected)
+            with self.subTest(
+                name=name,
+                kind=kind,
+                region=region_id,
+                karaoke=karaoke_mode,
+                top_n=top_n,
+            ):
+                self.assertEqual(
+                    self._golden_rows(name, actual), self._golden_rows(name, expected)
+                )
+        # どの関数・集計軸も空の結果どうしの比較になっていないこと
+        self.assertEqual(len(compared), 2 * len(services.RANKING_KINDS))
+        self.assertTrue(all(compared.values()), compared)
@@ -26,7 +26,7 @@ from .views import (
     creator_grid_view,
     creator_matrix_view,
 )
-from . import views_dump
+from . import views_dump, views_metrics, views_profiles, views_slow_requests
 
 urlpatterns = [
     path("ranking/", ranking_view, name="ranking"),
@@ -87,4 +87,20 @@ urlpatterns = [
     path("api/dump/run", views_dump.dump_tables, name="dump_tables"),
     path("api/dump/list", views_dump.list_dumps, name="list_dumps"),
     path("api/dump/download", views_dump.download_dump, name="download_dump"),
+    path("metrics", views_metrics.metrics_view, name="metrics"),
+    path(
+        "slow-requests/",
+        views_slow_requests.slow_request_list_view,
+        name="slow_request_list",
+    ),
+    path(
+        "slow-requests/<str:record_id>/",
+        views_slow_requests.slow_request_detail_view,
+        name="slow_request_detail",
+    ),
+    path(
+        "profiles/<str:name>",
+        views_profiles.profile_download_view,
+        name="profile_download",
+    ),
 ]
@@ -5,6 +5,7 @@ from collections import defaultdict
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
+from django.core import signing
 from django.core.paginator import Paginator
 from django.db import IntegrityError, transaction
 from django.db.models import (
@@ -32,16 +33,17 @@ from .models import (
     ArtistYearPreference,
     UserProfile,
 )
+from . import result_cursors
+from .conditional import other_user_page_condition
 from .utils import normalize
-from .services import (
+from .rankings import (
+    MAX_TOP_N,
     TOP_NS,
-    call_artist_song_top_n,
-    call_artist_insufficient_songs,
     call_artist_top_n_multi,
-    call_creator_song_top_n,
-    call_creator_insufficient_songs,
     call_creator_top_n_multi,
+    call_ranking_bundle,
     call_song_ranking,
+    call_song_ranking_page,
     count_song_ranking,
 )
 
@@ -51,9 +53,12 @@ CREATOR_TYPE_LABELS = {
     "year": "年",
 }
 
-# 画面のプルダウンに出す top_n の選択肢。集計側（services.TOP_NS）と必ず揃える。
+# 画面のプルダウンに出す top_n の選択肢（集計側は 1〜MAX_TOP_N の任意の値に対応）。
 RANKING_OPTIONS = list(TOP_NS)
 
+# TOP表・ランク表で一度に並べられる top_n の数（ns パラメータ）
+MAX_TOP_N_COLUMNS = 8
+
 # ランキング系4画面（歌手別/作詞別/作曲別/年別TOP）の分割表示設定。
 # 全件を一度に返すとHTMLが数MBになるため、親カード→その他の順に少しずつ追加する。
 RANKING_PARENT_PAGE_SIZE = 20
@@ -117,6 +122,25 @@ def _resolve_ranking_params(request):
     return region_id, selected_user, top_n, _resolve_karaoke_mode(request)
 
 
+def _resolve_top_ns(request):
+    """
+    TOP表・ランク表に並べる top_n の組（ns=3,5,10 のようなカンマ区切り）。
+    1〜MAX_TOP_N 以外や数値でないものは無視し、重複を除いて昇順にする。
+    何も残らなければ既定の TOP_NS。
+    戻り値: (top_ns, 画面の入力欄に戻す文字列)
+    """
+    ns = set()
+    for part in request.GET.get("ns", "").split(","):
+        try:
+            n = int(part)
+        except ValueError:
+            continue
+        if 1 <= n <= MAX_TOP_N:
+            ns.add(n)
+    top_ns = tuple(sorted(ns)[:MAX_TOP_N_COLUMNS]) or TOP_NS
+    return top_ns, ",".join(str(n) for n in top_ns)
+
+
 def _ranking_dataset(kind, user_id, top_n, region_id, karaoke_mode=False):
     """
     ランキング系4画面のデータを共通形式で組み立てる。
@@ -124,15 +148,15 @@ def _ranking_dataset(kind, user_id, top_n, region_id, karaoke_mode=False):
     karaoke_mode: True なら点数ではなくカラオケ採点で集計する
     戻り値: (rankings, insufficient_songs)
       rankings: [{parent_rank, parent_name, parent_link, total_score, songs:[...]}, ...]
+
+    4画面×全地域ぶんをまとめて集計する call_ranking_bundle から切り出すので、
+    どれか1画面を開けば同じ top_n の他の画面・他の地域はキャッシュから出せる。
     """
-    if kind == "artist":
-        top_n_data = call_artist_song_top_n(
-            user_id, top_n, region_id, karaoke_mode=karaoke_mode
-        )
-        insufficient_data = call_artist_insufficient_songs(
-            user_id, top_n, region_id, karaoke_mode=karaoke_mode
-        )
+    bundle = call_ranking_bundle(user_id, top_n, region_id)[(kind, bool(karaoke_mode))]
+    top_n_data = bundle["top"]
+    insufficient_data = bundle["insufficient"]
 
+    if kind == "artist":
         # artistごとに曲をグルーピング
         grouped = defaultdict(list)
         for row in top_n_data:
@@ -163,13 +187,6 @@ def _ranking_dataset(kind, user_id, top_n, region_id, karaoke_mode=False):
                 }
             )
     else:
-        top_n_data = call_creator_song_top_n(
-            user_id, top_n, region_id, kind, karaoke_mode=karaoke_mode
-        )
-        insufficient_data = call_creator_insufficient_songs(
-            user_id, top_n, region_id, kind, karaoke_mode=karaoke_mode
-        )
-
         # クリエイターごとに曲をグルーピング
         grouped = defaultdict(list)
         for row in top_n_data:
@@ -212,12 +229,21 @@ def _load_more_label(kind, remaining_parents, remaining_others):
     return ""
 
 
-def _ranking_page_context(kind, rankings, insufficient_songs):
-    """初回描画ぶん（親カードの先頭ページのみ）と「もっと見る」の状態を返す。"""
+def _ranking_cursor_scope(kind, user_id, top_n, region_id, karaoke_mode):
+    """「もっと見る」の結果カーソルが同じ集計条件のものか確かめるためのキー。"""
+    return ("ranking", kind, user_id, top_n, region_id, karaoke_mode)
+
+
+def _ranking_page_context(kind, rankings, insufficient_songs, cursor=""):
+    """
+    初回描画ぶん（親カードの先頭ページのみ）と「もっと見る」の状態を返す。
+    cursor: 集計結果を保存した結果カーソル（続きの読み込みで集計し直さないため）
+    """
     parents = rankings[:RANKING_PARENT_PAGE_SIZE]
     remaining_parents = len(rankings) - len(parents)
     return {
         "kind": kind,
+        "cursor": cursor,
         "rankings": parents,
         # 「その他」は親カードを使い切ってから読み込むため初回は空
         "insufficient_songs": [],
@@ -232,6 +258,7 @@ def _ranking_page_context(kind, rankings, insufficient_songs):
 
 # 歌手別TOP
 @login_required
+@other_user_page_condition
 def ranking_view(request):
     regions = MusicRegion.objects.all()
     users = User.objects.all().order_by("username")
@@ -241,6 +268,13 @@ def ranking_view(request):
     rankings, insufficient_data = _ranking_dataset(
         "artist", selected_user.id, top_n, region_id, karaoke_mode
     )
+    cursor = result_cursors.save(
+        request,
+        _ranking_cursor_scope(
+            "artist", selected_user.id, top_n, region_id, karaoke_mode
+        ),
+        (rankings, insufficient_data),
+    )
 
     context = {
         "ranking_options": RANKING_OPTIONS,
@@ -252,28 +286,32 @@ def ranking_view(request):
         "karaoke_mode": karaoke_mode,
         "is_own_page": selected_user == request.user,
     }
-    context.update(_ranking_page_context("artist", rankings, insufficient_data))
+    context.update(
+        _ranking_page_context("artist", rankings, insufficient_data, cursor)
+    )
 
     return render(request, "songs/artist_ranking.html", context)
 
 
 # 歌手ランキング
 @login_required
+@other_user_page_condition
 def artist_list_view(request):
     regions = MusicRegion.objects.all()
     users = User.objects.all().order_by("username")
 
     region_id, selected_user = _resolve_region_and_user(request)
     karaoke_mode = _resolve_karaoke_mode(request)
+    top_ns, top_ns_value = _resolve_top_ns(request)
 
-    # 4つの top_n を1クエリでまとめて取得し、共通形式
+    # 指定された top_n をまとめて取得し、共通形式
     # (display_name/display_link/display_rank/total_score) に正規化する
     rows = call_artist_top_n_multi(
-        selected_user.id, region_id, karaoke_mode=karaoke_mode
+        selected_user.id, region_id, top_ns, karaoke_mode=karaoke_mode
     )
 
     top_lists = []
-    for n in TOP_NS:
+    for n in top_ns:
         ranked = sorted(
             (r for r in rows if r[f"rank_{n}"] is not None),
             key=lambda r, n=n: r[f"order_{n}"],
@@ -305,12 +343,14 @@ def artist_list_view(request):
             "kind": "artist",
             "kind_label": "歌手",
             "top_lists": top_lists,
+            "top_ns_value": top_ns_value,
         },
     )
 
 
 # 作詞別TOP / 作曲別TOP（creator_type = 'lyricist' or 'composer'）
 @login_required
+@other_user_page_condition
 def creator_list_view(request, creator_type):
     if creator_type not in CREATOR_TYPE_LABELS:
         return redirect("artist_list")
@@ -323,6 +363,13 @@ def creator_list_view(request, creator_type):
     rankings, insufficient_data = _ranking_dataset(
         creator_type, selected_user.id, top_n, region_id, karaoke_mode
     )
+    cursor = result_cursors.save(
+        request,
+        _ranking_cursor_scope(
+            creator_type, selected_user.id, top_n, region_id, karaoke_mode
+        ),
+        (rankings, insufficient_data),
+    )
 
     template_map = {
         "lyricist": "songs/lyricist_ranking.html",
@@ -342,7 +389,9 @@ def creator_list_view(request, creator_type):
         "creator_type": creator_type,
         "creator_label": CREATOR_TYPE_LABELS[creator_type],
     }
-    context.update(_ranking_page_context(creator_type, rankings, insufficient_data))
+    context.update(
+        _ranking_page_context(creator_type, rankings, insufficient_data, cursor)
+    )
 
     return render(request, template_map[creator_type], context)
 
@@ -381,6 +430,10 @@ def ranking_more_view(request):
     """
     ランキング系4画面共通の「もっと見る」。
     親カードが残っていれば親を、使い切っていれば「その他」の行を追加で返す。
+
+    初回表示で保存した結果カーソル（cursor）が有効なら、その集計結果から
+    切り出す（DB を触らない）。期限切れなどで無効なら集計し直し、
+    新しいカーソルを返す。
     """
     kind = request.GET.get("kind", "artist")
     if kind not in RANKING_KIND_FLAGS:
@@ -397,9 +450,17 @@ def ranking_more_view(request):
     parent_offset = _offset("parent_offset")
     others_offset = _offset("others_offset")
 
-    rankings, insufficient_songs = _ranking_dataset(
+    scope = _ranking_cursor_scope(
         kind, selected_user.id, top_n, region_id, karaoke_mode
     )
+    cursor = request.GET.get("cursor", "")
+    dataset = result_cursors.load(request, cursor, scope)
+    if dataset is None:
+        dataset = _ranking_dataset(
+            kind, selected_user.id, top_n, region_id, karaoke_mode
+        )
+        cursor = result_cursors.save(request, scope, dataset)
+    rankings, insufficient_songs = dataset
 
     parents = rankings[parent_offset : parent_offset + RANKING_PARENT_PAGE_SIZE]
     if parents:
@@ -445,6 +506,7 @@ def ranking_more_view(request):
             "others_html": others_html,
             "parent_offset": parent_offset,
             "others_offset": others_offset,
+            "cursor": cursor,
             "load_more_label": _load_more_label(
                 kind,
                 len(rankings) - parent_offset,
@@ -456,6 +518,7 @@ def ranking_more_view(request):
 
 # 作詞TOP / 作曲TOP / 年TOP（artist_list と共通の top_grid.html を使用）
 @login_required
+@other_user_page_condition
 def creator_grid_view(request, creator_type):
     if creator_type not in CREATOR_TYPE_LABELS:
         return redirect("artist_list")
@@ -465,16 +528,17 @@ def creator_grid_view(request, creator_type):
 
     region_id, selected_user = _resolve_region_and_user(request)
     karaoke_mode = _resolve_karaoke_mode(request)
+    top_ns, top_ns_value = _resolve_top_ns(request)
 
-    # 4つの top_n を1クエリでまとめて取得し、共通形式
+    # 指定された top_n をまとめて取得し、共通形式
     # (display_name/display_link/display_rank/total_score) に正規化する
     creator_songs_url = reverse("creator_songs")
     rows = call_creator_top_n_multi(
-        selected_user.id, region_id, creator_type, karaoke_mode=karaoke_mode
+        selected_user.id, region_id, creator_type, top_ns, karaoke_mode=karaoke_mode
     )
 
     top_lists = []
-    for n in TOP_NS:
+    for n in top_ns:
         ranked = sorted(
             (r for r in rows if r[f"rank_{n}"] is not None),
             key=lambda r, n=n: (r[f"rank_{n}"], r["creator"] or ""),
@@ -504,6 +568,7 @@ def creator_grid_view(request, creator_type):
             "kind": creator_type,
             "kind_label": CREATOR_TYPE_LABELS[creator_type],
             "top_lists": top_lists,
+            "top_ns_value": top_ns_value,
         },
     )
 
@@ -513,19 +578,30 @@ def creator_grid_view(request, creator_type):
 _RANK_OUT_OF_RANGE = 10**9
 
 
-def _matrix_sort_key(row):
+def _matrix_sort_key(row, top_ns=TOP_NS):
     """
     ランク表の行の並び順キー。
-    TOP5 の順位を最優先し、同順（または圏外）なら 10 → 15 → 20 と見ていき、
+    最小の top_n の順位を最優先し、同順（または圏外）なら次の top_n と見ていき、
     最後は表示名で安定させる。
     """
     return tuple(
-        row.get(f"rank_{n}", _RANK_OUT_OF_RANGE) for n in TOP_NS
+        row.get(f"rank_{n}", _RANK_OUT_OF_RANGE) for n in top_ns
     ) + (row.get("display_name", ""),)
 
 
+def _matrix_row_ranks(row, source, top_ns):
+    """ランク表の1行に top_n ごとの順位・合計と、テンプレート用の ranks を付ける。"""
+    for n in top_ns:
+        if source[f"rank_{n}"] is not None:
+            row[f"rank_{n}"] = source[f"rank_{n}"]
+            row[f"score_{n}"] = source[f"total_{n}"]
+    row["ranks"] = [row.get(f"rank_{n}") for n in top_ns]
+    return row
+
+
 # 作詞ランク / 作曲ランク / 年ランク（artist_rank_matrix と共通の rank_matrix.html を使用）
 @login_required
+@other_user_page_condition
 def creator_matrix_view(request, creator_type):
     if creator_type not in CREATOR_TYPE_LABELS:
         return redirect("artist_rank_matrix")
@@ -535,14 +611,16 @@ def creator_matrix_view(request, creator_type):
 
     region_id, selected_user = _resolve_region_and_user(request)
     karaoke_mode = _resolve_karaoke_mode(request)
+    top_ns, top_ns_value = _resolve_top_ns(request)
 
-    # 4つの top_n を1クエリでまとめて取得（従来は top_n ごとに4回実行していた）
+    # 指定された top_n をまとめて取得（グループごとの累積和から計算するので、
+    # top_n の組を変えても集計し直さない）
     creator_songs_url = reverse("creator_songs")
     rows_by_creator = {}
     for r in call_creator_top_n_multi(
-        selected_user.id, region_id, creator_type, karaoke_mode=karaoke_mode
+        selected_user.id, region_id, creator_type, top_ns, karaoke_mode=karaoke_mode
     ):
-        if all(r[f"rank_{n}"] is None for n in TOP_NS):
+        if all(r[f"rank_{n}"] is None for n in top_ns):
             # どの top_n の条件も満たさないクリエイターは従来どおり表示しない
             continue
         creator = r["creator"]
@@ -551,13 +629,11 @@ def creator_matrix_view(request, creator_type):
             "display_name": creator,
             "display_link": f"{creator_songs_url}?{qs}",
         }
-        for n in TOP_NS:
-            if r[f"rank_{n}"] is not None:
-                row[f"rank_{n}"] = r[f"rank_{n}"]
-                row[f"score_{n}"] = r[f"total_{n}"]
-        rows_by_creator[creator] = row
+        rows_by_creator[creator] = _matrix_row_ranks(row, r, top_ns)
 
-    matrix_rows = sorted(rows_by_creator.values(), key=_matrix_sort_key)
+    matrix_rows = sorted(
+        rows_by_creator.values(), key=lambda row: _matrix_sort_key(row, top_ns)
+    )
 
     return render(
         request,
@@ -571,6 +647,8 @@ def creator_matrix_view(request, creator_type):
             "selected_user": selected_user,
             "karaoke_mode": karaoke_mode,
             "rows": matrix_rows,
+            "top_ns": top_ns,
+            "top_ns_value": top_ns_value,
         },
     )
 
@@ -610,19 +688,22 @@ def update_song_credits_view(request):
 
 
 @login_required
+@other_user_page_condition
 def artist_rank_matrix_view(request):
     regions = MusicRegion.objects.all()
     users = User.objects.all().order_by("username")
 
     region_id, selected_user = _resolve_region_and_user(request)
     karaoke_mode = _resolve_karaoke_mode(request)
+    top_ns, top_ns_value = _resolve_top_ns(request)
 
-    # 4つの top_n を1クエリでまとめて取得（従来は top_n ごとに4回実行していた）
+    # 指定された top_n をまとめて取得（グループごとの累積和から計算するので、
+    # top_n の組を変えても集計し直さない）
     matrix_rows = []
     for r in call_artist_top_n_multi(
-        selected_user.id, region_id, karaoke_mode=karaoke_mode
+        selected_user.id, region_id, top_ns, karaoke_mode=karaoke_mode
     ):
-        if all(r[f"rank_{n}"] is None for n in TOP_NS):
+        if all(r[f"rank_{n}"] is None for n in top_ns):
             # どの top_n の条件も満たさない歌手は従来どおり表示しない
             continue
         aid = r["artist_id"]
@@ -632,14 +713,10 @@ def artist_rank_matrix_view(request):
             "display_link": reverse("artist_songs", args=[aid]),
             "region_id": r.get("region_id"),
         }
-        for n in TOP_NS:
-            if r[f"rank_{n}"] is not None:
-                row[f"rank_{n}"] = r[f"rank_{n}"]
-                row[f"score_{n}"] = r[f"total_{n}"]
-        matrix_rows.append(row)
+        matrix_rows.append(_matrix_row_ranks(row, r, top_ns))
 
-    # 並び順：TOP5 → TOP10 → TOP15 → TOP20 の順位を優先して昇順
-    matrix_rows.sort(key=_matrix_sort_key)
+    # 並び順：小さい top_n の順位を優先して昇順（既定は TOP5 → 10 → 15 → 20）
+    matrix_rows.sort(key=lambda row: _matrix_sort_key(row, top_ns))
 
     return render(
         request,
@@ -653,6 +730,8 @@ def artist_rank_matrix_view(request):
             "selected_user": selected_user,
             "karaoke_mode": karaoke_mode,
             "rows": matrix_rows,
+            "top_ns": top_ns,
+            "top_ns_value": top_ns_value,
         },
     )
 
@@ -668,66 +747,65 @@ def _resolve_song_ranking_params(request):
     return region_id, selected_user, _resolve_karaoke_mode(request)
 
 
-def _karaoke_ranking(selected_user, region_id):
-    """カラオケ採点ランキング全件（同点は同順位、次は飛ばす）"""
-    rating_qs = Rating.objects.filter(
-        user=selected_user,
-        karaoke_score__isnull=False,
-    ).select_related("song", "song__artist")
-    if region_id:
-        rating_qs = rating_qs.filter(song__artist__region_id=region_id)
-    rating_qs = rating_qs.order_by("-karaoke_score", Lower("song__title"))
-
-    ranked = []
-    prev_score = object()  # 必ず最初は一致しないようにセンチネル
-    current_rank = 0
-    next_rank = 1
-    for r in rating_qs:
-        ks = r.karaoke_score
-        if ks != prev_score:
-            current_rank = next_rank
-        ranked.append(
-            {
-                "display_rank": current_rank,
-                "artist_id": r.song.artist_id,
-                "artist_name": r.song.artist.name,
-                "song_id": r.song_id,
-                "song_title": r.song.title,
-                "score": ks,
-            }
-        )
-        prev_score = ks
-        next_rank += 1
-    return ranked
+# 全曲TOPの続きの位置を画面に渡すときの署名用
+SONG_RANKING_KEYSET_SALT = "songs.song_ranking.keyset"
 
 
-def _song_ranking_slice(selected_user, region_id, karaoke_mode, offset, limit):
+def _song_ranking_slice(
+    request, selected_user, region_id, karaoke_mode, offset, limit, cursor=""
+):
     """
     全曲TOPの一部（offset から limit 件）と総件数を返す。
-    戻り値: (songs, total)
+    戻り値: (songs, total, cursor)
+
+    好み度・カラオケ採点ともキーセット方式（services.call_song_ranking_page）で読む。
+    cursor には続きの位置（並び順のキー・順位・総件数）を署名して入れる。
     """
-    if karaoke_mode:
-        # カラオケ採点分は件数が少ないため全件組み立ててから切り出す
-        ranked = _karaoke_ranking(selected_user, region_id)
-        return ranked[offset : offset + limit], len(ranked)
+    scope = [selected_user.id, int(region_id or 0), int(bool(karaoke_mode))]
+    after = None
+    if cursor:
+        try:
+            after = signing.loads(cursor, salt=SONG_RANKING_KEYSET_SALT)
+        except signing.BadSignature:
+            after = None
+        if after is not None and (
+            after.get("scope") != scope or after.get("position") != offset
+        ):
+            after = None
+
+    if after is None and offset > 0:
+        # 続きの位置が無い・壊れている（古い画面から等）ときは従来の OFFSET で読む
+        songs = call_song_ranking(
+            selected_user.id,
+            region_id,
+            offset=offset,
+            limit=limit,
+            karaoke_mode=karaoke_mode,
+        )
+        total = count_song_ranking(selected_user.id, region_id, karaoke_mode)
+        return songs, total, ""
 
-    # CTE 版（services.call_song_ranking）に置き換え。
-    # 旧 rank_view は user_id でフィルタする前に全ユーザ分のウィンドウ計算を
-    # 走らせていたため、ここでは user_id を先に絞った CTE を使う。
-    songs = call_song_ranking(selected_user.id, region_id, offset=offset, limit=limit)
-    total = count_song_ranking(selected_user.id, region_id)
-    return songs, total
+    page = call_song_ranking_page(
+        selected_user.id, region_id, limit, after=after, karaoke_mode=karaoke_mode
+    )
+    next_cursor = ""
+    if page["next"] is not None:
+        next_cursor = signing.dumps(
+            {**page["next"], "scope": scope}, salt=SONG_RANKING_KEYSET_SALT
+        )
+    return page["songs"], page["total"], next_cursor
 
 
 @login_required
+@other_user_page_condition
 def song_ranking_view(request):
     regions = MusicRegion.objects.all()
     users = User.objects.all().order_by("username")
 
     region_id, selected_user, karaoke_mode = _resolve_song_ranking_params(request)
 
-    songs, total = _song_ranking_slice(
-        selected_user, region_id, karaoke_mode, 0, SONG_RANKING_PAGE_SIZE
+    songs, total, cursor = _song_ranking_slice(
+        request, selected_user, region_id, karaoke_mode, 0, SONG_RANKING_PAGE_SIZE
     )
     loaded = len(songs)
 
@@ -746,6 +824,7 @@ def song_ranking_view(request):
             "total_count": total,
             "remaining_count": max(total - loaded, 0),
             "page_size": SONG_RANKING_PAGE_SIZE,
+            "cursor": cursor,
         },
     )
 
@@ -760,8 +839,14 @@ def song_ranking_rows_view(request):
     except ValueError:
         offset = 0
 
-    songs, total = _song_ranking_slice(
-        selected_user, region_id, karaoke_mode, offset, SONG_RANKING_PAGE_SIZE
+    songs, total, cursor = _song_ranking_slice(
+        request,
+        selected_user,
+        region_id,
+        karaoke_mode,
+        offset,
+        SONG_RANKING_PAGE_SIZE,
+        request.GET.get("cursor", ""),
     )
     loaded = offset + len(songs)
 
@@ -780,6 +865,7 @@ def song_ranking_rows_view(request):
             "html": html,
             "loaded_count": loaded,
             "remaining_count": max(total - loaded, 0),
+            "cursor": cursor,
         }
     )
 
@@ -1496,12 +1582,27 @@ def _artist_search_results(request):
     return region_id, prefix, filter_top, artists
 
 
+def _artist_search_cursor_scope(request):
+    """歌手検索の結果カーソルが同じ検索条件のものか確かめるためのキー。"""
+    return (
+        "artist_search",
+        request.GET.get("region_id", "1"),
+        request.GET.get("prefix", ""),
+        request.GET.get("top"),
+    )
+
+
 # 歌手検索
 @login_required
 def artist_search_view(request):
     region_id, prefix, filter_top, artists = _artist_search_results(request)
 
     shown = artists[:ARTIST_SEARCH_PAGE_SIZE]
+    cursor = ""
+    if len(artists) > len(shown):
+        cursor = result_cursors.save(
+            request, _artist_search_cursor_scope(request), artists
+        )
 
     return render(
         request,
@@ -1514,6 +1615,7 @@ def artist_search_view(request):
             "top": filter_top,
             "loaded_count": len(shown),
             "remaining_count": len(artists) - len(shown),
+            "cursor": cursor,
         },
     )
 
@@ -1521,7 +1623,12 @@ def artist_search_view(request):
 @login_required
 def artist_search_rows_view(request):
     """「もっと見る」用。続きの行をHTML断片として返す。"""
-    _, _, _, artists = _artist_search_results(request)
+    scope = _artist_search_cursor_scope(request)
+    cursor = request.GET.get("cursor", "")
+    artists = result_cursors.load(request, cursor, scope)
+    if artists is None:
+        _, _, _, artists = _artist_search_results(request)
+        cursor = result_cursors.save(request, scope, artists)
 
     try:
         offset = max(int(request.GET.get("offset", 0)), 0)
@@ -1542,6 +1649,7 @@ def artist_search_rows_view(request):
             "html": html,
             "loaded_count": loaded,
             "remaining_count": max(len(artists) - loaded, 0),
+            "cursor": cursor,
         }
     )
 
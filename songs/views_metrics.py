@@ -0,0 +1,21 @@
+"""
+Prometheus 形式のメトリクス（songs.metrics）を返す管理用API。
+
+認証は /api/dump/* と同じ共有トークン（settings.EXPORT_API_TOKEN）。
+トークンは X-Export-Token ヘッダか GET の token で渡す。
+"""
+
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+
+from . import metrics
+from .views_dump import _auth
+
+
+@require_GET
+def metrics_view(request):
+    if not _auth(request):
+        return HttpResponse(status=401)
+    return HttpResponse(
+        metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -0,0 +1,16 @@
+"""
+その場プロファイラ（songs.request_profiler）が保存したファイルを渡すスタッフ用のAPI。
+"""
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import FileResponse, Http404
+
+from . import request_profiler
+
+
+@staff_member_required
+def profile_download_view(request, name):
+    path = request_profiler.profile_path(name)
+    if path is None:
+        raise Http404("ファイルが見つかりません（古いものは消えています）")
+    return FileResponse(open(path, "rb"), as_attachment=True, filename=name)
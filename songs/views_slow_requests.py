@@ -0,0 +1,38 @@
+"""
+遅いリクエストの記録（songs.flight_recorder）を見るスタッフ用の画面。
+"""
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404
+from django.shortcuts import render
+
+from . import flight_recorder
+
+
+@staff_member_required
+def slow_request_list_view(request):
+    return render(
+        request,
+        "songs/slow_request_list.html",
+        {
+            "records": flight_recorder.list_records(),
+            "threshold_ms": flight_recorder.threshold_ms(),
+        },
+    )
+
+
+@staff_member_required
+def slow_request_detail_view(request, record_id):
+    data = flight_recorder.load_record(record_id)
+    if data is None:
+        raise Http404("記録が見つかりません（古いものは消えています）")
+    plans = {e["index"]: e["plan"] for e in data["explains"]}
+    statements = [
+        dict(statement, number=i + 1, plan=plans.get(i))
+        for i, statement in enumerate(data["statements"])
+    ]
+    return render(
+        request,
+        "songs/slow_request_detail.html",
+        {"record": data, "statements": statements},
+    )